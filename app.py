@@ -1,8 +1,11 @@
 from main import *
 from langgraph.graph import StateGraph, END, START
-from langgraph.checkpoint.memory import InMemorySaver
-import random
+from langgraph.types import Overwrite
 import gradio as gr
+from langchain_core.utils.json import parse_partial_json
+# Importing main opens nothing; the served app starts loading models (and opening their stores) in the background
+if config.MODEL_WARMUP:
+    registry.warmup()
 subgraph_builder = StateGraph(CustomState)
 
 subgraph_builder.add_node(user_query_analyzer)
@@ -10,81 +13,164 @@ subgraph_builder.add_node(search_query_planner)
 subgraph_builder.add_node(web_search)
 subgraph_builder.add_node(crawl_contexts)
 subgraph_builder.add_node(data_extracter)
-subgraph_builder.add_node(retriever)
+subgraph_builder.add_node(retrieval_planner)
+subgraph_builder.add_node(retriever, defer=True)  # runs once every page-loading branch of the pass is done
 subgraph_builder.add_node(response_generator)
 subgraph_builder.add_node(response_evaluator)
 subgraph_builder.add_edge(START, 'user_query_analyzer')
 subgraph_builder.add_conditional_edges('user_query_analyzer', route_harmful_query)
 subgraph_builder.add_edge('search_query_planner', 'web_search')
-subgraph_builder.add_edge('web_search', 'data_extracter')
-subgraph_builder.add_edge('data_extracter', 'retriever')
+# Pages are stored while the DB queries are planned; on a web search verdict the context links are crawled and
+# stored next to the search branch. retriever starts once the pages of both branches are stored
+subgraph_builder.add_conditional_edges('web_search', route_search_results)
+subgraph_builder.add_conditional_edges('crawl_contexts', route_crawled_links)
+subgraph_builder.add_edge(['data_extracter', 'retrieval_planner'], 'retriever')
 subgraph_builder.add_edge('retriever', 'response_generator')
 subgraph_builder.add_edge('response_generator',  'response_evaluator')
-subgraph_builder.add_edge('crawl_contexts', 'data_extracter')
 subgraph_builder.add_conditional_edges('response_evaluator', conditional_edge)
 
-Subgraph_checkpointer = InMemorySaver()
-sub_graph_config = {"configurable": {"thread_id": str(random.randint(1, 999))}, 'recursion_limit': 100} 
+# Both graphs persist their state in one on-disk store; their thread ids never overlap
+checkpointer = SQLiteCheckpointSaver()
 websearch_agent = subgraph_builder.compile(
-    checkpointer=Subgraph_checkpointer
+    checkpointer=checkpointer
     )
 class MainState(MessagesState):
     user_request: str
 
-def generate_websearch_response(state: MainState):
+async def generate_websearch_response(state: MainState, config: RunnableConfig):
     user_request = state['user_request']
     
     state['messages'].append(HumanMessage(content=user_request))
     
     # Creating a single refined query from Overall Chat for Web Search Agent
     user_request_refiner = model.with_structured_output(QueryRefiner)
-    output = user_request_refiner.invoke([
+    output = await user_request_refiner.ainvoke([
         SystemPrompts.user_query_refiner,
         *state['messages']])
     refined_query = output.refined_query
-    response = websearch_agent.invoke(
+    response = await websearch_agent.ainvoke(
         CustomState(user_request=refined_query, 
                     iteration=0,
                     crawl_depth=0,
                     max_crawl_depth=2,
                     max_iterations=3,
-                    messages=[],
-                    sources_data=[],
-                    relevant_links=set(),
-                    visited_links=set(),
+                    # Merged channels keep the previous run's values unless overwritten
+                    messages=Overwrite([]),
+                    sources_data=Overwrite([]),
+                    relevant_links=Overwrite(set()),
+                    visited_links=Overwrite(set()),
                     retrieved_docs=[], 
                     search_queries=[],
+                    retrieval_plan=[],
+                    response_rating="",
+                    best_response="",
+                    best_rating="",
                 ),
-                config=sub_graph_config
+                # The web search agent runs on a thread of its own per chat thread
+                config={"configurable": {"thread_id": f"{config['configurable']['thread_id']}:websearch"}, 'recursion_limit': 100}
     )
-    state['messages'].append(AIMessage(content=response['messages'][-1].response))
+    state['messages'].append(AIMessage(content=final_response(response)))
     return state
 
 graph_builder = StateGraph(MainState)
 graph_builder.add_node(generate_websearch_response)
 graph_builder.set_entry_point('generate_websearch_response')
-graph_checkpointer = InMemorySaver()
-graph_config = {"configurable": {"thread_id": str(random.randint(999, 9999))}, 'recursion_limit': 100} 
 
 chat_agent = graph_builder.compile(
-    checkpointer = graph_checkpointer
+    checkpointer = checkpointer
 )
 
 
-def response_generator(message, history):
-    response = chat_agent.invoke(
-        MainState(
-            user_request=message, 
-            history=[]
-                    ),
-        config=graph_config
-    )
-    return response['messages'][-1].content
+chat_server = ChatServer()
+
+# Progress shown in the chat while the agents run, keyed by graph node
+PROGRESS_MESSAGES = {
+    'user_query_analyzer': "Analyzing the question...",
+    'search_query_planner': "Planning web searches...",
+    'web_search': "Searching the web...",
+    'crawl_contexts': "Following links found in the sources...",
+    'data_extracter': "Reading pages...",
+    'retrieval_planner': "Planning the passage search...",
+    'retriever': "Retrieving relevant passages...",
+    'response_generator': "Writing the answer...",
+    'response_evaluator': "Reviewing the answer...",
+}
+
+def is_answer_token(event):
+    """True for streamed chunks of the answer being drafted by the response_generator node."""
+    return event['event'] == 'on_chat_model_stream' and event['metadata'].get('langgraph_node') == 'response_generator' \
+        and any(chunk.get('args') for chunk in getattr(event['data']['chunk'], 'tool_call_chunks', []))
+
+async def stream_updates(events, mode: str = None, show_progress: bool = True):
+    """
+    Turns the chat agent's astream_events into chat UI updates: progress lines, then the draft answer as it is written.
+    In "speculative" mode the first finished draft is shown as the answer while the evaluation continues below it;
+    it is only replaced when the evaluator rates a later draft higher.
+    """
+    speculative = (mode or config.RESPONSE_MODE) == 'speculative'
+    progress, draft, arguments, answer, shown = [], "", "", None, None
+    def render():
+        lines = "\n".join(f"_{line}_" for line in progress[-4:]) if show_progress else ""
+        if answer is not None:  # the answer is out; the rest runs in the background
+            return "\n\n".join(part for part in (answer, lines) if part)
+        return "\n\n".join(part for part in (lines, draft if show_progress else "") if part)
+    async for event in events:
+        kind, node = event['event'], event['metadata'].get('langgraph_node')
+        if kind == 'on_chain_start' and event['name'] == node and node in PROGRESS_MESSAGES:
+            progress.append(PROGRESS_MESSAGES[node])
+            if node == 'response_generator':
+                draft, arguments = "", ""  # a new draft replaces the previous one
+        elif kind == 'on_chain_end' and event['name'] == node and node in ('web_search', 'data_extracter'):
+            output = event['data'].get('output') or {}
+            if node == 'web_search':
+                progress.append(f"Found {len(output.get('sources_data', []))} search results")
+            else:
+                progress.append(f"{len(output.get('visited_links', ()))} pages fetched")
+        elif kind == 'on_chain_end' and event['name'] == node == 'response_generator':
+            draft = event['data']['output']['messages'][-1].response  # models that do not stream tool calls
+            if speculative and answer is None:
+                answer = draft
+        elif kind == 'on_chain_end' and event['name'] == node == 'response_evaluator' and speculative:
+            best_response = event['data']['output'].get('best_response')
+            if best_response and best_response != answer:
+                answer = best_response
+                progress.append("Refined the answer")
+        elif kind == 'on_chat_model_stream' and is_answer_token(event):
+            # The answer arrives as the partial JSON arguments of the ResponseGeneration tool call
+            arguments += "".join(chunk.get('args') or "" for chunk in event['data']['chunk'].tool_call_chunks)
+            draft = (parse_partial_json(arguments) or {}).get('response_to_user_query', draft)
+        elif kind == 'on_chain_end' and not event['parent_ids']:
+            progress, answer = [], event['data']['output']['messages'][-1].content  # the final answer replaces progress and drafts
+        else:
+            continue
+        if render() and render() != shown:
+            shown = render()
+            yield shown
+
+async def response_generator(message, history, request: gr.Request = None):
+    # Every browser session gets its own chat thread; runs are limited and queued by the chat server
+    session_key = request.session_hash if request is not None else None
+    inputs = MainState(user_request=message, history=[])
+    try:
+        if config.STREAMING_RESPONSES or config.RESPONSE_MODE == 'speculative':
+            events = chat_server.stream(session_key, chat_agent, inputs, is_token=is_answer_token)
+            async for update in stream_updates(events, show_progress=config.STREAMING_RESPONSES):
+                yield update
+        else:
+            response = await chat_server.run(session_key, chat_agent, inputs)
+            yield response['messages'][-1].content
+    except ServerBusyError as e:
+        yield str(e)
+        return
+    logger.info(f"**chat_server**=> {chat_server.stats()}")
 # fn: with message and history as arg and response as output
 demo = gr.ChatInterface(
     fn=response_generator, 
-    title="Web Equiped Chatbot"
+    title="Web Equiped Chatbot",
+    concurrency_limit=None  # concurrency and queueing are handled by chat_server
 )
-demo.launch(inbrowser=True)
+if __name__ == '__main__':
+    compactor.start()
+    demo.launch(inbrowser=True)
 
 # print(response_generator("What is the weather like today?", []))
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Checkpointer benchmark.
+
+Runs synthetic conversations through a small graph whose state has the shape of CustomState (a growing message list,
+a large `contexts` SystemMessage, `sources_data` and link sets) with InMemorySaver and with SQLiteCheckpointSaver
+(keeping every checkpoint, and keeping the configured last CHECKPOINT_KEEP_LAST). Reports the mean and p95
+checkpoint write latency, the Python heap held after the run and the bytes stored per conversation.
+
+Usage (from the repository root):
+    python -m benchmarks.checkpointer_benchmark --conversations 50 --turns 5
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+from typing import List, Set
+import numpy as np
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import StateGraph, MessagesState, START, END
+import config
+from utils.checkpointing import SQLiteCheckpointSaver
+
+class BenchState(MessagesState):
+    iteration: int
+    contexts: SystemMessage
+    sources_data: List[dict]
+    visited_links: Set[str]
+
+def _text(words: int):
+    return ' '.join(''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(words))
+
+def build_graph(checkpointer, context_words: int):
+    # search -> extract -> answer, like one web search iteration; each node only changes some channels
+    def search(state: BenchState):
+        links = {f"https://example.com/{state['iteration']}/{i}" for i in range(10)}
+        return {'visited_links': state['visited_links'] | links, 'iteration': state['iteration'] + 1}
+
+    def extract(state: BenchState):
+        sources = [{'url': url, 'title': _text(8), 'snippet': _text(40)} for url in sorted(state['visited_links'])[-10:]]
+        return {'sources_data': state['sources_data'] + sources, 'contexts': SystemMessage(content=_text(context_words))}
+
+    def answer(state: BenchState):
+        return {'messages': [AIMessage(content=_text(150))]}
+
+    builder = StateGraph(BenchState)
+    for node in (search, extract, answer):
+        builder.add_node(node)
+    builder.add_edge(START, 'search')
+    builder.add_edge('search', 'extract')
+    builder.add_edge('extract', 'answer')
+    builder.add_edge('answer', END)
+    return builder.compile(checkpointer=checkpointer)
+
+def timed_puts(checkpointer, latencies: list):
+    put = checkpointer.put
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return put(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    checkpointer.put = wrapper
+
+def run(name: str, checkpointer, conversations: int, turns: int, context_words: int):
+    random.seed(0)
+    latencies = []
+    timed_puts(checkpointer, latencies)
+    tracemalloc.start()
+    graph = build_graph(checkpointer, context_words)
+    for conversation in range(conversations):
+        thread = {'configurable': {'thread_id': f"conversation-{conversation}"}}
+        for turn in range(turns):
+            inputs = {'messages': [HumanMessage(content=_text(20))]}
+            if turn == 0:
+                inputs.update(iteration=0, contexts=SystemMessage(content=''), sources_data=[], visited_links=set())
+            graph.invoke(inputs, config=thread)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    stored = checkpointer.stats()['db_bytes'] if isinstance(checkpointer, SQLiteCheckpointSaver) else None
+    latencies = np.array(latencies) * 1000
+    print(f"{name:<26} {latencies.mean():>9.2f} {np.percentile(latencies, 95):>9.2f} {heap / conversations / 1024:>12.1f} "
+          f"{(stored / conversations / 1024 if stored is not None else float('nan')):>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--context-words', type=int, default=3000, help='size of the contexts message rebuilt every turn')
+    args = parser.parse_args()
+    print(f"{'checkpointer':<26} {'put ms':>9} {'p95 ms':>9} {'heap KB/conv':>12} {'disk KB/conv':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        savers = [('InMemorySaver', InMemorySaver()),
+                  ('SQLite (keep all)', SQLiteCheckpointSaver(os.path.join(directory, 'all.sqlite'), keep_last=None)),
+                  (f"SQLite (keep last {config.CHECKPOINT_KEEP_LAST})", SQLiteCheckpointSaver(os.path.join(directory, 'last.sqlite')))]
+        for name, checkpointer in savers:
+            run(name, checkpointer, args.conversations, args.turns, args.context_words)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Web search graph benchmark.
+
+Runs the same questions through the websearch_agent graph of app.py and through the previous strictly sequential
+wiring of the same nodes. The parallel graph plans the DB queries while data_extracter loads and stores the pages,
+and on a web search verdict (while the crawl depth allows) crawls the context links next to the search planning and
+stores the crawled pages next to the web search. The retriever waits for every stored page, so evaluator loops that
+go straight to the retriever gain nothing. Reports the wall time of the first iteration (question analysis to first
+evaluation), of each later evaluator loop, and of the whole run. Page, search and embedding caches warm up as
+questions are answered, so the two graphs take turns going first. Calls the real services, so it needs the same
+credentials as the app.
+
+Usage (from the repository root):
+    python -m benchmarks.graph_benchmark --questions "What is the current US-India trade deficit?" --repeat 2
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import numpy as np
+from langgraph.graph import StateGraph, END, START
+from langgraph.types import Overwrite
+import app
+from main import *
+
+def sequential_route(state: CustomState, config: RunnableConfig = None):
+    """conditional_edge before the parallel branches: one next step at a time."""
+    if state['next_step'] == 'finish':
+        return END
+    if state['next_step'] == 'web_search':
+        return 'search_query_planner'
+    if state['iteration'] > state['max_iterations'] or state['crawl_depth'] > state['max_crawl_depth']:
+        return END
+    return state['next_step']
+
+def build_sequential_graph():
+    builder = StateGraph(CustomState)
+    for node in (user_query_analyzer, search_query_planner, web_search, crawl_contexts, data_extracter, retriever,
+                 response_generator, response_evaluator):
+        builder.add_node(node)
+    builder.add_edge(START, 'user_query_analyzer')
+    builder.add_conditional_edges('user_query_analyzer', route_harmful_query)
+    builder.add_edge('search_query_planner', 'web_search')
+    builder.add_edge('web_search', 'data_extracter')
+    builder.add_edge('data_extracter', 'retriever')
+    builder.add_edge('retriever', 'response_generator')
+    builder.add_edge('response_generator', 'response_evaluator')
+    builder.add_edge('crawl_contexts', 'data_extracter')
+    builder.add_conditional_edges('response_evaluator', sequential_route)
+    return builder.compile()
+
+async def timed_run(graph, question: str):
+    """Seconds from the start to each response_evaluator pass, and to the end of the run."""
+    inputs = CustomState(user_request=question, iteration=0, crawl_depth=0, max_crawl_depth=2, max_iterations=3, messages=Overwrite([]),
+                         sources_data=Overwrite([]), relevant_links=Overwrite(set()), visited_links=Overwrite(set()),
+                         retrieved_docs=[], search_queries=[], retrieval_plan=[], response_rating="", best_response="", best_rating="")
+    config = {"configurable": {"thread_id": f"benchmark-{uuid.uuid4().hex}"}, 'recursion_limit': 100}
+    started = time.perf_counter()
+    evaluations = []
+    async for update in graph.astream(inputs, config=config, stream_mode='updates'):
+        if 'response_evaluator' in update:
+            evaluations.append(time.perf_counter() - started)
+    return evaluations, time.perf_counter() - started
+
+async def run(questions: list, repeat: int):
+    graphs = {'sequential': build_sequential_graph(), 'parallel': app.subgraph_builder.compile()}
+    results = {name: {'first': [], 'loops': [], 'total': []} for name in graphs}
+    turn = 0
+    for _ in range(repeat):
+        for question in questions:
+            names = list(graphs) if turn % 2 == 0 else list(reversed(graphs))
+            turn += 1
+            for name in names:
+                evaluations, total = await timed_run(graphs[name], question)
+                if evaluations:
+                    results[name]['first'].append(evaluations[0])
+                    results[name]['loops'].extend(np.diff(evaluations))
+                results[name]['total'].append(total)
+    print(f"{'graph':<12} {'1st iteration s':>16} {'later iteration s':>18} {'loops':>6} {'run s':>8}")
+    mean = lambda values: float(np.mean(values)) if len(values) else float('nan')
+    for name, result in results.items():
+        print(f"{name:<12} {mean(result['first']):>16.2f} {mean(result['loops']):>18.2f} {len(result['loops']):>6} "
+              f"{mean(result['total']):>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', nargs='+', default=["What is the current US-India trade deficit?",
+                                                           "Which Indian exports to the US grew the most last year?"])
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args.questions, args.repeat))
+
+if __name__ == '__main__':
+    main()
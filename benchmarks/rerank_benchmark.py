@@ -0,0 +1,89 @@
+"""
+Reranker latency benchmark.
+
+Compares the original per-query fp32 reranking (pad to the longest pair of each query) with the batched,
+length-sorted Reranker engine for every backend, reporting latency per 100 pairs and the largest score
+difference against the fp32 reference.
+
+Usage (from the repository root):
+    python -m benchmarks.rerank_benchmark --backends torch torch-int8 onnx --queries 5 --docs 15
+"""
+import argparse
+import random
+import time
+import torch
+from langchain_core.documents import Document
+import config
+from utils.retrieval import Reranker
+
+SENTENCES = [
+    "India's merchandise trade deficit with the United States narrowed in December as exports rose.",
+    "The Commerce Department reported that goods imports from India reached a record high last year.",
+    "Tariff negotiations between Washington and New Delhi stalled over agricultural market access.",
+    "Pharmaceutical and electronics shipments accounted for most of the growth in Indian exports.",
+    "Analysts expect the rupee to remain under pressure while crude oil prices stay elevated.",
+    "The census bureau publishes monthly goods and services trade balances by partner country.",
+    "Smartphone assembly moved from China to India, lifting the value of exports to the US market.",
+]
+QUERIES = [
+    "India US trade deficit December 2025",
+    "US imports from India by product category",
+    "India US tariff negotiations status",
+    "Effect of smartphone exports on India US trade balance",
+    "monthly census trade balance India",
+]
+
+def make_candidates(n_queries: int, n_docs: int, seed: int = 0):
+    rng = random.Random(seed)
+    candidates = []
+    for q in range(n_queries):
+        docs = [Document(page_content=' '.join(rng.choices(SENTENCES, k=rng.randint(1, 25)))) for _ in range(n_docs)]
+        candidates.append((QUERIES[q % len(QUERIES)], docs))
+    return candidates
+
+def baseline_scores(reranker: Reranker, candidates: list):
+    """The original rerank_results: one fp32 forward pass per query, padded to its longest pair."""
+    scores = []
+    with torch.no_grad():
+        for query, docs in candidates:
+            inputs = reranker.tokenizer([[query, doc.page_content] for doc in docs], padding=True, truncation=True,
+                                        return_tensors='pt', max_length=512)
+            scores.extend(reranker.model(**inputs, return_dict=True).logits.view(-1,).float().tolist())
+    return scores
+
+def timed(fn, repeats: int):
+    fn()  # warmup
+    started = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['torch', 'torch-int8', 'onnx'])
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--docs', type=int, default=15)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=config.RERANK_NUM_THREADS)
+    args = parser.parse_args()
+
+    candidates = make_candidates(args.queries, args.docs)
+    n_pairs = args.queries * args.docs
+    reference_engine = Reranker(backend='torch', num_threads=args.threads)
+    reference, seconds = timed(lambda: baseline_scores(reference_engine, candidates), args.repeats)
+    print(f"{'variant':<28}{'ms / 100 pairs':>16}{'max |score diff|':>20}")
+    print(f"{'baseline (per-query fp32)':<28}{1000 * seconds * 100 / n_pairs:>16.1f}{0.0:>20.4f}")
+
+    pairs = [[query, doc.page_content] for query, docs in candidates for doc in docs]
+    for backend in args.backends:
+        try:
+            engine = reference_engine if backend == 'torch' else Reranker(backend=backend, num_threads=args.threads)
+        except ImportError as e:
+            print(f"{'engine ' + backend:<28}{'skipped':>16}  ({e})")
+            continue
+        scores, seconds = timed(lambda: engine.score(pairs), args.repeats)
+        max_diff = max(abs(a - b) for a, b in zip(scores, reference))
+        print(f"{'engine ' + backend:<28}{1000 * seconds * 100 / n_pairs:>16.1f}{max_diff:>20.4f}")
+
+if __name__ == '__main__':
+    main()
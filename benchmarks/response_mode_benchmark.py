@@ -0,0 +1,62 @@
+"""
+Response mode benchmark.
+
+Runs the same questions through the chat agent in "strict" and "speculative" RESPONSE_MODE and reports, per mode,
+the time to the first draft token, the time until an answer is shown (the end of the run in strict mode, the end of
+the first draft in speculative mode), the end-to-end run time and how often a refined answer replaced the first draft.
+Calls the real services, so it needs the same credentials as the app.
+
+Usage (from the repository root):
+    python -m benchmarks.response_mode_benchmark --questions "What is the current US-India trade deficit?"
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import numpy as np
+import config
+import app
+
+async def timed_run(question: str, mode: str):
+    config.RESPONSE_MODE = mode
+    times = {}
+    started = time.perf_counter()
+
+    async def tap(events):
+        async for event in events:
+            now = time.perf_counter() - started
+            if app.is_answer_token(event):
+                times.setdefault('first_token', now)
+            if event['event'] == 'on_chain_end' and event['name'] == event['metadata'].get('langgraph_node') == 'response_generator':
+                times.setdefault('first_draft', now)
+                times.setdefault('first_draft_text', event['data']['output']['messages'][-1].response)
+            yield event
+
+    events = app.chat_server.stream(f"benchmark-{uuid.uuid4().hex}", app.chat_agent,
+                                    app.MainState(user_request=question, history=[]), is_token=app.is_answer_token)
+    answer = None  # stays None when nothing is streamed (harmful query, early error)
+    async for answer in app.stream_updates(tap(events), mode=mode):
+        pass
+    times['total'] = time.perf_counter() - started
+    times['answer_shown'] = times.get('first_draft', times['total']) if mode == 'speculative' else times['total']
+    times['refined'] = answer != times.get('first_draft_text')
+    return times
+
+async def run(questions: list, modes: list):
+    print(f"{'mode':<12} {'first token s':>14} {'answer shown s':>15} {'total s':>9} {'refined':>8}")
+    for mode in modes:
+        results = [await timed_run(question, mode) for question in questions]
+        mean = lambda key: np.mean([result[key] for result in results if key in result]) if any(key in result for result in results) else float('nan')
+        print(f"{mode:<12} {mean('first_token'):>14.2f} {mean('answer_shown'):>15.2f} {mean('total'):>9.2f} "
+              f"{sum(result['refined'] for result in results):>4}/{len(results)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', nargs='+', default=["What is the current US-India trade deficit?",
+                                                           "Which Indian exports to the US grew the most last year?"])
+    parser.add_argument('--modes', nargs='+', default=['strict', 'speculative'], choices=['strict', 'speculative'])
+    args = parser.parse_args()
+    asyncio.run(run(args.questions, args.modes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Startup benchmark.
+
+Imports `main` (what app.py and the langgraph.json graphs do) in a fresh interpreter and reports the import time
+and peak resident memory, then, separately, the first use of the on-disk stores that importing no longer opens
+(search and page caches, checkpoint DB: each opens its sqlite file on first access), then the time and memory once
+every registered model is loaded: "lazy" loads nothing else, "warmup" waits for registry.warmup() to finish, "eager"
+loads each model (and the BM25 index / compactor registered next to them) in turn in the foreground and reports
+per-model load times (the cost the old import-time loading paid before serving anything).
+
+Usage (from the repository root):
+    python -m benchmarks.startup_benchmark --modes lazy warmup eager
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+PROBE = r'''
+import json, resource, sys, time
+import config
+config.MODEL_WARMUP = False
+started = time.perf_counter()
+import main
+from utils import registry
+result = {'import_seconds': time.perf_counter() - started,
+          'import_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+from utils import SQLiteCheckpointSaver, page_cache, search_cache
+result['first_use'] = {}
+for name, store in (('search_cache', search_cache), ('page_cache', page_cache), ('checkpointer', SQLiteCheckpointSaver())):
+    opened = time.perf_counter()
+    store.stats()
+    result['first_use'][name] = time.perf_counter() - opened
+mode = sys.argv[1]
+if mode != 'lazy':
+    if mode == 'warmup':
+        registry.warmup().join()
+    else:
+        for name in registry.status():
+            try:
+                registry.get(name)
+            except Exception:
+                pass
+    result['ready_seconds'] = time.perf_counter() - started
+    result['ready_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result['models'] = registry.status()
+print('RESULT ' + json.dumps(result))
+'''
+
+def run_mode(mode: str):
+    completed = subprocess.run([sys.executable, '-c', PROBE, mode], capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith('RESULT '):
+            return json.loads(line[len('RESULT '):])
+    raise RuntimeError(f"{mode} run failed:\n{completed.stderr[-2000:]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['lazy', 'warmup', 'eager'], choices=['lazy', 'warmup', 'eager'])
+    args = parser.parse_args()
+    print(f"{'mode':<8} {'import s':>9} {'import RSS MB':>14} {'ready s':>9} {'ready RSS MB':>13}")
+    for mode in args.modes:
+        result = run_mode(mode)
+        print(f"{mode:<8} {result['import_seconds']:>9.2f} {result['import_rss_mb']:>14.0f} "
+              f"{result.get('ready_seconds', float('nan')):>9.2f} {result.get('ready_rss_mb', float('nan')):>13.0f}")
+        print(f"    first use: " + ', '.join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in result['first_use'].items()))
+        for name, status in result.get('models', {}).items():
+            state = f"{status['load_seconds']}s" if status['ready'] else f"failed: {status['error']}"
+            print(f"    {name:<14} {state}")
+
+if __name__ == '__main__':
+    main()
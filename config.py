@@ -1,3 +1,62 @@
 RERANK_MODEL_NAME = 'BAAI/bge-reranker-v2-m3' # Huggingface model name for reranker
 EMBED_MODEL_ID = "amazon.titan-embed-text-v1"  # Bedrock embedding model ID
-LLM_MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'  # Bedrock LLM model ID
\ No newline at end of file
+LLM_MODEL_ID = 'anthropic.claude-3-5-sonnet-20240620-v1:0'  # Bedrock LLM model ID
+ROBOTS_CACHE_TTL = 3600  # Seconds a fetched robots.txt policy is reused per host
+ROBOTS_NEGATIVE_TTL = 300  # Seconds an unreachable robots.txt is cached as allow-all
+ROBOTS_FETCH_TIMEOUT = 5  # Seconds to wait for a single robots.txt download
+ROBOTS_MAX_CONCURRENCY = 10  # Max robots.txt downloads in flight at once
+SEARCH_MAX_CONCURRENCY = 5  # Max SerpAPI requests in flight per web_search step
+SEARCH_TIMEOUT = 15  # Seconds before a single SerpAPI query is abandoned
+CACHE_DIR = "./cache"  # Directory for on-disk caches
+SEARCH_CACHE_TTL = 6 * 3600  # Seconds a cached SerpAPI result stays valid
+SEARCH_CACHE_MAX_ENTRIES = 5000  # LRU bound on cached search queries
+SCRAPER_USER_AGENT = "AutoScrapperBot"  # User agent sent when loading pages
+BROWSER_CONTEXTS = 2  # Chromium contexts kept open by the shared browser pool
+BROWSER_PAGE_CONCURRENCY = 4  # Pages open at once per browser context
+BROWSER_MAX_INFLIGHT_PAGES = 8  # Cap on pages open across the whole browser pool
+BROWSER_PAGE_TIMEOUT = 30  # Seconds allowed for one page to load and render
+FETCH_MODE = "auto"  # url_loader mode: "auto" (HTTP first, Chromium for JS-only pages), "http" or "chromium"
+HTTP_FETCH_TIMEOUT = 15  # Seconds allowed for a plain HTTP page fetch
+HTTP_MAX_CONNECTIONS = 20  # Pooled keep-alive connections for the HTTP fetcher
+JS_SHELL_MIN_TEXT_CHARS = 500  # Pages with less visible text than this are re-rendered in Chromium
+PAGE_CACHE_MAX_AGE = 24 * 3600  # Seconds a cached page is served before revalidation
+PAGE_CACHE_MAX_ENTRIES = 20000  # Max URLs kept in the page cache
+PIPELINE_SPLIT_WORKERS = 2  # Concurrent markdown splitting workers in data_extracter
+PIPELINE_FILTER_WORKERS = 2  # Concurrent ContentFilter workers in data_extracter
+PIPELINE_QUEUE_SIZE = 8  # Capacity of each queue between ingestion stages
+TERM_VECTOR_CACHE_SIZE = 20000  # Distinct terms whose spaCy vectors are kept in memory
+VECTOR_WRITE_BATCH_SIZE = 64  # Chunks per bulk vector store write
+VECTOR_WRITE_MAX_WAIT = 2.0  # Seconds a buffered chunk may wait before being written
+EMBED_MAX_CONCURRENCY = 8  # Parallel Bedrock embedding requests
+EMBED_MAX_REQUESTS_PER_SECOND = 20  # Rate limit on Bedrock embedding requests
+EMBED_CACHE_MAX_ENTRIES = 50000  # Embeddings kept in the on-disk cache (~6 KB each for Titan v1)
+NEAR_DUPLICATE_MAX_DISTANCE = 3  # Max SimHash bit distance for a chunk to count as a near-duplicate
+NEAR_DUPLICATE_MIN_WORDS = 20  # Shorter chunks are only deduplicated exactly
+RERANK_BACKEND = "torch"  # Reranker backend: "torch" (fp32), "torch-int8" (dynamic quantization) or "onnx"
+RERANK_BATCH_SIZE = 16  # Query/doc pairs per reranker forward pass
+RERANK_NUM_THREADS = 4  # CPU threads used by the reranker
+RERANK_CACHE_SIZE = 20000  # (query, chunk) reranker scores kept in memory
+RERANK_CACHE_TTL = 3600  # Seconds a cached reranker score is reused
+RETRIEVAL_CANDIDATES_K = 15  # Vector search candidates per DB query before reranking
+RRF_K = 60  # Reciprocal-rank fusion constant used to merge per-query rankings
+RETRIEVAL_MODE = "hybrid"  # "vector" (embedding search only) or "hybrid" (BM25 + embedding search fused with RRF)
+BM25_INDEX_DIR = "./chroma_db_cosine/bm25_index"  # On-disk inverted index kept next to the Chroma collection
+BM25_K1 = 1.5  # BM25 term frequency saturation
+BM25_B = 0.75  # BM25 document length normalization
+BM25_SEGMENT_SIZE = 2000  # Chunks held in memory before being written as an index segment
+BM25_MAX_SEGMENTS = 8  # Index segments are merged into one beyond this count
+SESSION_SCOPED_RETRIEVAL = True  # Retrieve only chunks stored by the current conversation thread
+VECTOR_STORE_RETENTION = 7 * 24 * 3600  # Seconds a stored chunk is kept before compaction evicts it
+COMPACTION_INTERVAL = 3600  # Seconds between vector store compaction runs
+COMPACTION_REBUILD_FRACTION = 0.3  # Deleted/live chunk ratio that triggers a rebuild of the collection's HNSW index
+MODEL_WARMUP = True  # Load models on a background thread at startup; False loads each one on first use only
+MODEL_SERVER_SOCKET = None  # Unix socket of a shared model server (python -m utils.model_server), e.g. "/tmp/ai-agent-models.sock" (needs MODEL_SERVER_AUTHKEY); None loads models in-process
+MODEL_SERVER_TIMEOUT = 120  # Seconds a model server call may take
+SERVING_MAX_CONCURRENCY = 8  # Agent runs executing at once across all chat sessions
+SERVING_MAX_QUEUE = 32  # Requests allowed to wait for a free slot before new ones are rejected
+SERVING_LATENCY_WINDOW = 500  # Recent requests used for the latency percentiles
+CHECKPOINT_KEEP_LAST = 4  # Graph checkpoints kept per conversation thread; older ones are pruned from the checkpoint store
+CHECKPOINT_THREAD_TTL = 7 * 24 * 3600  # Seconds an idle conversation thread's checkpoints are kept
+CHECKPOINT_COMPRESSION_LEVEL = 6  # zlib level of stored graph state (0 stores it uncompressed)
+STREAMING_RESPONSES = True  # Stream progress updates and the draft answer to the chat UI; False shows only the final answer
+RESPONSE_MODE = "strict"  # "strict": answer once the evaluator accepts a draft; "speculative": show the first draft at once, replace it only with a higher-rated one
@@ -6,8 +6,11 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
-from typing import Dict, List, Set
+import config
+import operator
+from typing import Annotated, Dict, List, Set
 from langgraph.graph import  END, MessagesState
+from langgraph.types import Send
 from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
@@ -17,23 +20,36 @@ from schemas import *
 from utils import *
 
 load_dotenv()
-embed_model = load_embed_model()
-model = load_llm()
-vector_store = Chroma(
+def load_vector_store():
+    return Chroma(
         collection_name="web_data_collection", 
-        embedding_function = embed_model,
+        embedding_function = registry.get('embed_model'),
         persist_directory="./chroma_db_cosine", 
         collection_metadata={"hnsw:space": "cosine"})
+# Clients, models and on-disk indexes are built on first use (see ModelRegistry); importing the graphs does no I/O
+embed_model = registry.register('embed_model', load_embed_model)
+model = registry.register('llm', load_llm)
+vector_store = registry.register('vector_store', load_vector_store)
+chunk_dedup_index = NearDuplicateIndex(vector_store)
+def load_lexical_index():
+    return BM25Index(vector_store=vector_store)
+lexical_index = registry.register('lexical_index', load_lexical_index)  # opens its directory and lock file on first use
+def load_compactor():
+    return VectorStoreCompactor(vector_store, dedup_index=chunk_dedup_index, lexical_index=lexical_index)
+compactor = registry.register('compactor', load_compactor)  # started by the app, not at import
+# Parallel branches write sources and links in the same step, so these channels merge updates instead of replacing them;
+# callers reset them with langgraph.types.Overwrite
 class CustomState(MessagesState):
     user_request: str
     refined_user_request: str
     user_request_analysis: Dict 
     search_queries: List 
-    sources_data: List
-    relevant_links: Set 
+    sources_data: Annotated[List, operator.add]
+    relevant_links: Annotated[Set, operator.or_]
     contexts: List 
     retrieved_docs: List 
-    visited_links: Set 
+    visited_links: Annotated[Set, operator.or_]
+    retrieval_plan: List
     
     action_rationale: str = ""
     next_step: str = ""
@@ -41,35 +57,44 @@ class CustomState(MessagesState):
     max_crawl_depth: int = 3
     iteration: int = 0
     max_iterations: int = 5
+    response_rating: str = ""
+    best_response: str = ""
+    best_rating: str = ""
+def session_id_of(config: RunnableConfig = None):
+    """Conversation thread the node runs for; chunks are stored and retrieved per thread."""
+    return (config or {}).get('configurable', {}).get('thread_id')
+
+HARMFUL_QUERY_RESPONSE = "The query has been identified as potentially harmful or sensitive. Therefore, no further processing will be done."
+# Evaluator ratings, worst first
+RESPONSE_RATINGS = ['highly unsatisfactory', 'unsatisfactory', 'satisfactory', 'highly_satisfactory']
+
 # TODO: Add Reddit toolnode
 # TODO: Add instructions to avoid Reddit, discord, qoura
-def user_query_analyzer(state: CustomState, config: RunnableConfig=None) -> CustomState:
+async def user_query_analyzer(state: CustomState, config: RunnableConfig=None) -> CustomState:
     
     """Analyze the user query and create structured analysis."""
     
-    user_request_analysis = model.with_structured_output(QueryAnalysisResults).invoke(
+    user_request_analysis = await model.with_structured_output(QueryAnalysisResults).ainvoke(
         [SystemPrompts.user_request_analyser,
         HumanMessage(f"""## User Query: 
                     {state['user_request']}
                     """)
         ])
     # state['refined_user_request'] = user_request_analysis.refined_query
-    state['user_request_analysis'] = user_request_analysis
     if user_request_analysis.is_harmful == True:
-        state['messages'].append(AIMessage(content="The query has been identified as potentially harmful or sensitive. Therefore, no further processing will be done."))
-        return state
-    state['messages'].append(HumanMessage(content=state['user_request']))
+        return {'user_request_analysis': user_request_analysis,
+                'messages': [AIMessage(content=HARMFUL_QUERY_RESPONSE)]}
     logger.info(f"**user_query_analyzer**=> Refined User Request: {state['user_request']}")
-    return state
+    return {'user_request_analysis': user_request_analysis, 'messages': [HumanMessage(content=state['user_request'])]}
 
-def search_query_planner(state: CustomState, config: RunnableConfig=None):
+async def search_query_planner(state: CustomState, config: RunnableConfig=None):
     
     """Plan the search queries based on user input."""
     
     previous_queries = state.get('search_queries', "N/A")
     action_rationale = state.get('action_rationale', "N/A")
     planner = model.with_structured_output(SearchPlan, include_raw=True)
-    output = planner.invoke(
+    output = await planner.ainvoke(
         [SystemPrompts.search_query_planner,
         HumanMessage(f"""## User Request:
             {state['user_request']}
@@ -85,97 +110,83 @@ def search_query_planner(state: CustomState, config: RunnableConfig=None):
     else:
         query_data = output['parsed']    
     search_queries = query_data.model_dump()['search_queries']
-    state['search_queries'].extend(search_queries)
-    logger.info(f"**search_query_planner**=> Planned {len(state['search_queries'])} search queries. Queries: {[q['query'] for q in search_queries]}")
-    return state
+    logger.info(f"**search_query_planner**=> Planned {len(state['search_queries']) + len(search_queries)} search queries. Queries: {[q['query'] for q in search_queries]}")
+    return {'search_queries': state['search_queries'] + search_queries}
 
-def web_search(state: CustomState, config: RunnableConfig=None):
+async def web_search(state: CustomState, config: RunnableConfig=None):
     
     """Retrieve URLs using search queries."""
     
-    web_queries = state['search_queries']
+    search_queries = [dict(query_item) for query_item in state['search_queries']]  # other branches read the current list
+    pending_queries = [query_item for query_item in search_queries if query_item.get('search_performed') != True]
+    search_results = await search_many([query_item['query'] for query_item in pending_queries])
     all_sources = []
-    for query_item in web_queries:
-        if query_item.get('search_performed') ==True:
-            continue
-        query = query_item['query']
-        search_data = retrieve_search_results(query=query )
+    # Merge in planner order so results stay deterministic regardless of completion order
+    for query_item, search_data in zip(pending_queries, search_results):
+        if search_data is None:
+            continue  # failed or timed out; left pending for the next planning round
         query_item['search_performed'] = True
         for item in search_data:
             item['metadata']['query_id'] = query_item['query_id']
         all_sources.extend(search_data)
-    state['sources_data'].extend(all_sources)
-    logger.info(f"**web_search**=> Total URL retrieved from Web: {len(all_sources)}")
-    return state
+    logger.info(f"**web_search**=> Total URL retrieved from Web: {len(all_sources)}. Search cache: {search_cache.stats()}")
+    return {'search_queries': search_queries, 'sources_data': all_sources}
 
 # sources_data: list[sources] 
 # sources: dict[metadata:{'source': str, 'link': str, 'date': str, 'sitelinks': dict, }, ]
 # TODO: load urls in parallel and adjust the for loops => done
-import asyncio
-def data_extracter(state: CustomState, config: RunnableConfig =None):
+async def data_extracter(state: CustomState, config: RunnableConfig =None):
     
-    """Load, process and Store data from the URLs by filtering relevant content."""
+    """
+    Load, process and Store data from the URLs by filtering relevant content.
+    Loads the unvisited search results and crawled relevant_links of its input; when search and crawl run in
+    parallel, each branch sends it only its own links.
+    """
     
     text_splitter = AdvancedMarkdownSplitter(chunk_size=5000, chunk_overlap=50)    
     links_to_scrape = [source['metadata']['link'] for source in state['sources_data'] if 'link' in source['metadata'] and source['metadata']['link'] not in state['visited_links']]
+    links_to_scrape = list(dict.fromkeys(links_to_scrape))  # the same URL often comes back for several queries
+    additional_links = [link for link in state['relevant_links'] if link not in state['visited_links']]
     
-    # Ethical scrapping: Filter links based on robots.txt
-    links_to_scrape = [link for link in links_to_scrape if can_fetch_url((link))]
+    # Ethical scrapping: Filter links based on robots.txt (one concurrent pass for both link sets)
+    robots_allowed = await can_fetch_urls(links_to_scrape + additional_links)
+    links_to_scrape = [link for link in links_to_scrape if robots_allowed[link]]
     # TODO: Prioritize links based on count
     links_to_scrape = links_to_scrape[:10]  # Limit to 10 links per iteration to manage load
     target_terms = state['user_request_analysis'].model_dump()['query_parameters']
     contentfilter = ContentFilter(target_terms=target_terms, header_threshold=0.3, chunk_threshold=0.3)
     logger.info(f"**data_extracter**=> Links to scrape: {links_to_scrape}")
-    # Load content from URLs
-    if links_to_scrape:
-        output = asyncio.run(url_loader(links_to_scrape))
-        if output:
-            for source in state['sources_data']:
-                if source['metadata']['link'] in output:
-                    # Process raw content
-                    content = text_splitter.split_text(output[source['metadata']['link']]['page_content'])
-                    # source['metadata']['visited'] = True
-                    # source['metadata']['links_extracted'] = False
-                    # source['metadata']['claims_extracted']= False
-                    source['metadata'].update(output[source['metadata']['link']]['metadata'])
-                    
-                    # Filter and add content to vector store
-                    if not source.get('stored_in_db', False):
-                        asyncio.run(contentfilter.filter_and_add_to_vectorestore(content, source['metadata'], vector_store))
-                        source['stored_in_db'] = True
-                    state['visited_links'].add(source['metadata']['link'])
 
     # Process additional crawled links
     # TODO: Add a logger info for logging additional links: Done
-    additional_links = [link for link in state['relevant_links'] if link not in state['visited_links']]
-    additional_links = [link for link in additional_links if can_fetch_url((link))]
+    additional_links = [link for link in additional_links if robots_allowed[link] and link not in links_to_scrape]
     logger.info(f"**data_extracter**=> Additional links to scrape: {additional_links}")
-    if additional_links:
-        state['crawl_depth'] += 1
-        output = url_loader(additional_links)
-        for link, data in output.items():
-            data['metadata']['link'] = link            
-            new_source = {
-                'metadata': data['metadata'],
-            }
-            content= text_splitter.split_text(data['page_content'])
-            # new_source['metadata']['visited'] = True
-            # Filter content and add to vector store
-            if not new_source.get('stored_in_db', False):
-                asyncio.run(contentfilter.filter_and_add_to_vectorestore(content, new_source['metadata'], vector_store))
-                new_source['stored_in_db'] = True
-            state['sources_data'].append(new_source)
-            state['visited_links'].add(link)
-    return state            
+    update = {}
 
-def retriever(state: CustomState, config: RunnableConfig=None) -> CustomState:
-    
-    """Generate response based on the query."""
-    
-    retriever = AdvancedRetriever(vector_store=vector_store, llm=model)
+    # Load, split, filter and store every page in one streaming pass
+    pages = {}
+    for source in state['sources_data']:
+        link = source['metadata'].get('link')
+        if link in links_to_scrape and link not in pages:
+            pages[link] = dict(source['metadata'])
+    pages.update({link: {'link': link} for link in additional_links})
+    session_id = session_id_of(config)
+    if session_id is not None:
+        for metadata in pages.values():
+            metadata['session_id'] = str(session_id)
+    if not pages:
+        return update
+    pipeline = IngestionPipeline(text_splitter, contentfilter, vector_store, dedup_index=chunk_dedup_index, lexical_index=lexical_index)
+    loaded = await pipeline.run(pages)
+    # Stored pages are tracked by visited_links; crawled pages are added to the sources
+    update['visited_links'] = set(loaded)
+    update['sources_data'] = [{'metadata': loaded[link], 'stored_in_db': True} for link in additional_links if link in loaded]
+    return update
+
+def retrieval_prompt(state: CustomState):
     action_rationale = state.get('action_rationale', "N/A")
     search_queries = [q['query'] for q in state['search_queries']]
-    prompt = f""" 
+    return f""" 
                 **User Query**
                 {state['user_request']}
                 **Performed Web Search Queries**
@@ -183,11 +194,29 @@ def retriever(state: CustomState, config: RunnableConfig=None) -> CustomState:
                 **Action Rationale (CRITICAL):**
                 {action_rationale}
                 """
-    retreived_docs = retriever(HumanMessage(content=prompt))
+
+async def retrieval_planner(state: CustomState, config: RunnableConfig=None):
+    
+    """Plan the vector store queries while data_extracter is still storing pages."""
+    
+    planner = AdvancedRetriever(vector_store=vector_store, llm=model)
+    plan = await planner.aplan(HumanMessage(content=retrieval_prompt(state)))
+    return {'retrieval_plan': [q_item.model_dump() for q_item in plan]}
+
+async def retriever(state: CustomState, config: RunnableConfig=None) -> CustomState:
+    
+    """Generate response based on the query."""
+    
+    session_id = session_id_of(config)
+    retriever = AdvancedRetriever(vector_store=vector_store, llm=model, lexical_index=lexical_index,
+                                  session_id=str(session_id) if session_id is not None else None)
+    # Uses the plan of retrieval_planner when it ran in this iteration; plans inline when the evaluator asked for retrieval only
+    plan = [DBQuery(**q_item) for q_item in state['retrieval_plan']] if state.get('retrieval_plan') else None
+    retreived_docs = await retriever.ainvoke(HumanMessage(content=retrieval_prompt(state)), q_items=plan)
     # TODO: save retrieved docs into state instead of only contexts: Done
     # TODO: stop storing all retrieved docs to state: Done
     # new_docs = [doc for doc in retreived_docs if doc not in state['retrieved_docs']]
-    logger.info(f"**retriever**=> Retrieved {len(retreived_docs)} new documents. First 3 contexts: {retreived_docs[:3]} ")
+    logger.info(f"**retriever**=> Retrieved {len(retreived_docs)} new documents. Embedding cache: {embed_model.stats()}. First 3 contexts: {retreived_docs[:3]} ")
     # state['retrieved_docs'].extend(new_docs)
     context_format = "Text:\n {content}\nSource: {source}\nURL: {link}\n Source Reliability: {source_reliability}\n\n"
     contexts = "\n".join([context_format.format(content=doc.page_content, source=doc.metadata.get('source', ''), link=doc.metadata['link'], source_reliability=doc.metadata['source_reliability']) for doc in retreived_docs])
@@ -196,15 +225,14 @@ def retriever(state: CustomState, config: RunnableConfig=None) -> CustomState:
                     Retrieved Contexts:
                     {contexts}
                     """, )
-    state['contexts'] = contexts_augmented
-    return state
+    return {'contexts': contexts_augmented, 'retrieval_plan': []}
 
-def response_generator(state: CustomState, config: RunnableConfig=None) -> CustomState:
+async def response_generator(state: CustomState, config: RunnableConfig=None) -> CustomState:
     
     """Generate response based on the query and retrieved contexts."""
     response_generator = model.with_structured_output(ResponseGeneration)
     
-    response = response_generator.invoke([
+    response = await response_generator.ainvoke([
         SystemPrompts.response_generator, 
         state['contexts'],
         #state['refined_user_request'],
@@ -214,12 +242,13 @@ def response_generator(state: CustomState, config: RunnableConfig=None) -> Custo
     logger.info(f"**response_generator**=> {response}")
     return {'messages': state['messages']+[AIMessage(content=f"**Response:** {response}", response = response.response_to_user_query)]}
 
-def response_evaluator(state: CustomState, config: RunnableConfig=None) -> CustomState:
+async def response_evaluator(state: CustomState, config: RunnableConfig=None) -> CustomState:
     
     """Evaluate the generated response and decide next steps."""
     
     response_evaluator = model.with_structured_output(ResponseEvaluation)
-    evaluation = response_evaluator.invoke( [
+    draft = state['messages'][-1].response
+    evaluation = await response_evaluator.ainvoke( [
         SystemPrompts.response_evaluator, 
         state['contexts'],
         #state['user_request'],
@@ -228,15 +257,30 @@ def response_evaluator(state: CustomState, config: RunnableConfig=None) -> Custo
     if evaluation.next_step !='finish':
         state['messages'].append(HumanMessage(content=f"**Evaluator:** {evaluation.response_evaluation}\nNext Step: {evaluation.next_step}")) 
     logger.info(f"**response_evaluator**=> {evaluation}")
-    return {'messages':state['messages'],'action_rationale': evaluation.action_rationale, 'next_step': evaluation.next_step, 'iteration': state['iteration'] + 1}
+    update = {'messages':state['messages'],'action_rationale': evaluation.action_rationale, 'next_step': evaluation.next_step, 'iteration': state['iteration'] + 1,
+              'response_rating': evaluation.response_rating}
+    # A later draft only replaces the best one if the evaluator rates it strictly higher
+    if not state.get('best_rating') or RESPONSE_RATINGS.index(evaluation.response_rating) > RESPONSE_RATINGS.index(state['best_rating']):
+        update.update(best_response=draft, best_rating=evaluation.response_rating)
+    return update
+
+def final_response(state: CustomState):
+    """Answer of a finished web search run: its last draft in "strict" mode, its best-rated draft in "speculative" mode."""
+    analysis = state.get('user_request_analysis')
+    if analysis is not None and analysis.is_harmful:
+        return HARMFUL_QUERY_RESPONSE
+    if config.RESPONSE_MODE == 'speculative' and state.get('best_response'):
+        return state['best_response']
+    # The evaluator's feedback follows the last draft when the run stops at the iteration or crawl depth limit
+    return next((message.response for message in reversed(state['messages']) if getattr(message, 'response', None) is not None), "")
 
 # TODO: Implement as a llm function and extract links: Done      
-def crawl_contexts(state: CustomState, config: RunnableConfig=None):
+async def crawl_contexts(state: CustomState, config: RunnableConfig=None):
     
     """Get relevant links from the sources."""
     
     link_extractor = model.with_structured_output(URLExtraction)
-    response = link_extractor.invoke(
+    response = await link_extractor.ainvoke(
          [
             SystemPrompts.context_crawler,
             state['contexts'],
@@ -244,27 +288,43 @@ def crawl_contexts(state: CustomState, config: RunnableConfig=None):
         ]
     )
     logger.info(f"**crawl_contexts**=> Crawled {len(response.urls)} links.")
-    return {'relevant_links': response.links, 'crawl_depth': state['crawl_depth']+1}
+    return {'relevant_links': set(response.urls), 'crawl_depth': state['crawl_depth']+1}
 
 def conditional_edge(state: CustomState, config: RunnableConfig=None)-> Literal[END, 'retriever', 'search_query_planner', 'crawl_contexts']:
     
-    """Route to the next step based on evaluation."""
+    """Route to the next step based on evaluation; a web search also crawls the current contexts while the crawl depth allows."""
     
     if state['next_step'] == 'finish':
         return END
     if state['next_step'] == 'web_search':
+        # crawl_contexts counts the crawl depth once for this pass
+        if state['crawl_depth'] < state['max_crawl_depth']:
+            return ['search_query_planner', 'crawl_contexts']
         return 'search_query_planner'
     if state['iteration']> state['max_iterations'] or state['crawl_depth']> state['max_crawl_depth']:
         logger.warning("Maximum iterations or crawl depth reached. Ending the process.")
         return END
     return state['next_step']
  
+def route_search_results(state: CustomState, config: RunnableConfig=None) -> Literal['data_extracter', 'retrieval_planner']:
+    
+    """Store the search results while the DB queries are planned; crawled links are loaded by the crawl branch."""
+    
+    return [Send('data_extracter', {**state, 'relevant_links': set()}), 'retrieval_planner']
+
+def route_crawled_links(state: CustomState, config: RunnableConfig=None) -> Literal['data_extracter', 'retrieval_planner']:
+    
+    """Store the crawled pages: next to the web search branch (which plans the DB queries), or on their own."""
+    
+    if state['next_step'] == 'web_search':
+        return [Send('data_extracter', {**state, 'sources_data': []})]
+    return ['data_extracter', 'retrieval_planner']
+
 def route_harmful_query(state: CustomState, config: RunnableConfig=None) -> Literal[END, 'search_query_planner']:
     
     """Route the query based on harmfulness assessment."""
     
     if state['user_request_analysis'].is_harmful == True:
         logger.warning("Harmful or sensitive content detected in the query. Ending the process.")
-        state['messages'].append(AIMessage(content="The query has been identified as potentially harmful or sensitive. Therefore, no further processing will be done."))
         return END
     return 'search_query_planner'
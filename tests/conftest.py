@@ -0,0 +1,4 @@
+import config
+
+# The tests never call the real models, so importing main must not start loading them in the background
+config.MODEL_WARMUP = False
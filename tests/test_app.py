@@ -0,0 +1,75 @@
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+import app
+
+FIRST, SECOND, FINAL = "Exports rose 5%", "Exports rose 5.2% in 2024", "Exports rose 5.2% in 2024 (final)"
+
+def node_event(kind, node, **data):
+    return {'event': kind, 'name': node, 'metadata': {'langgraph_node': node}, 'data': data, 'parent_ids': ['run']}
+
+def draft(*tokens, response):
+    """Events of one response_generator step streaming its ResponseGeneration tool call."""
+    streamed = [{'event': 'on_chat_model_stream', 'name': 'model', 'metadata': {'langgraph_node': 'response_generator'},
+                 'data': {'chunk': AIMessageChunk(content='', tool_call_chunks=[{'name': None, 'args': token, 'id': None, 'index': 0}])},
+                 'parent_ids': ['run', 'response_generator']} for token in tokens]
+    return [node_event('on_chain_start', 'response_generator'), *streamed,
+            node_event('on_chain_end', 'response_generator', output={'messages': [AIMessage(content='', response=response)]})]
+
+def evaluation(best_response):
+    return [node_event('on_chain_start', 'response_evaluator'),
+            node_event('on_chain_end', 'response_evaluator', output={'best_response': best_response})]
+
+def run_events(best_after_second_draft):
+    return [node_event('on_chain_start', 'user_query_analyzer'),
+            node_event('on_chain_start', 'web_search'),
+            node_event('on_chain_end', 'web_search', output={'sources_data': [{}, {}, {}]}),
+            *draft('{"response_to_user_query": "Exports ', 'rose 5%"}', response=FIRST), *evaluation(FIRST),
+            *draft('{"response_to_user_query": "Exports rose 5.2% in 2024"}', response=SECOND), *evaluation(best_after_second_draft),
+            {'event': 'on_chain_end', 'name': 'LangGraph', 'metadata': {}, 'data': {'output': {'messages': [AIMessage(content=FINAL)]}},
+             'parent_ids': []}]
+
+EVENTS = run_events(SECOND)
+
+async def replay(events):
+    for event in events:
+        yield event
+
+def updates(mode, show_progress=True, events=EVENTS):
+    async def collect():
+        return [update async for update in app.stream_updates(replay(events), mode=mode, show_progress=show_progress)]
+    return asyncio.run(collect())
+
+def test_strict_mode_streams_progress_and_drafts_then_the_final_answer():
+    shown = updates('strict')
+    assert shown[0] == "_Analyzing the question..._"
+    assert any("_Found 3 search results_" in update for update in shown)
+    # The partial tool call arguments are shown as the draft is written
+    assert any(update.endswith("Exports ") for update in shown)
+    assert any(update.endswith(FIRST) for update in shown)
+    assert not any(update.startswith(FIRST) for update in shown)
+    assert shown[-1] == FINAL
+
+def test_strict_mode_without_progress_only_shows_the_final_answer():
+    assert updates('strict', show_progress=False) == [FINAL]
+
+def test_speculative_mode_shows_the_first_draft_and_replaces_it_when_refined():
+    shown = updates('speculative')
+    first_answer = next(i for i, update in enumerate(shown) if update.startswith(FIRST))
+    refined = next(i for i, update in enumerate(shown) if update.startswith(SECOND))
+    assert any(update.endswith("Exports ") for update in shown[:first_answer])
+    # The first draft stays on top while it is evaluated and the second draft is written
+    assert first_answer < refined and all(update.startswith(FIRST) for update in shown[first_answer:refined])
+    assert "_Reviewing the answer..._" in shown[refined - 1]
+    assert "_Refined the answer_" in shown[refined]
+    assert shown[-1] == FINAL
+
+def test_speculative_mode_keeps_the_first_draft_when_it_stays_best():
+    shown = updates('speculative', events=run_events(FIRST))
+    assert not any("_Refined the answer_" in update or update.startswith(SECOND) for update in shown[:-1])
+    assert updates('speculative', show_progress=False, events=run_events(FIRST)) == [FIRST, FINAL]
+
+@pytest.mark.parametrize('mode', ['strict', 'speculative'])
+def test_response_mode_defaults_to_the_config(monkeypatch, mode):
+    monkeypatch.setattr(app.config, 'RESPONSE_MODE', mode)
+    assert updates(None, show_progress=False)[0] == (FINAL if mode == 'strict' else FIRST)
@@ -0,0 +1,114 @@
+import json
+import multiprocessing
+import os
+from utils.bm25 import BM25Index, tokenize
+
+def segment_names(directory):
+    with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+        return json.load(f)['segments']
+
+def test_tokenize_keeps_figures_and_tickers():
+    assert tokenize("Brent-crude hit $1,250.5 in Q3/2024 (U.S data)") == ['brent-crude', 'hit', '1,250.5', 'in', 'q3/2024', 'u.s', 'data']
+
+def test_search_ranks_exact_terms(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add(['a', 'b', 'c'], ["India exports rose 12% in 2024", "Crude oil imports from the US", "Tariffs on steel and aluminium"])
+    hits = index.search('crude oil', k=2)
+    assert hits[0][0] == 'b'
+    assert all(score > 0 for _, score in hits)
+    assert index.search('nothing matches this') == []
+
+def test_commit_writes_a_segment_that_reopens(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add(['a', 'b'], ["India exports rose", "Crude oil imports"])
+    index.commit()
+    assert len(segment_names(tmp_path)) == 1
+    reopened = BM25Index(str(tmp_path))
+    assert len(reopened) == 2
+    assert reopened.search('crude')[0][0] == 'b'
+
+def test_segments_merge_beyond_max_segments(tmp_path):
+    index = BM25Index(str(tmp_path), segment_size=2, max_segments=2)
+    for i in range(8):
+        index.add([f"doc-{i}"], [f"shared term{i}"])
+    index.commit()
+    assert len(segment_names(tmp_path)) <= 2
+    assert len(index) == 8
+    assert {doc_id for doc_id, _ in index.search('shared', k=10)} == {f"doc-{i}" for i in range(8)}
+    assert index.search('term5', k=1)[0][0] == 'doc-5'
+    # Merged-away segment files are removed
+    names = {name.split('.')[0] for name in os.listdir(tmp_path) if name.endswith('.npy')}
+    assert names == set(segment_names(tmp_path))
+
+def test_search_is_scoped_to_a_session(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add(['a', 'b'], ["crude oil imports", "crude oil exports"], ['first', 'second'])
+    index.commit()
+    index.add(['c'], ["crude oil prices"], ['first'])
+    assert {doc_id for doc_id, _ in index.search('crude oil', session_id='first')} == {'a', 'c'}
+
+def test_indexes_see_each_others_commits(tmp_path):
+    first, second = BM25Index(str(tmp_path)), BM25Index(str(tmp_path))
+    first.add(['a'], ["crude oil imports"])
+    first.commit()
+    second.add(['b'], ["steel tariffs"])
+    second.commit()
+    assert len(set(segment_names(tmp_path))) == 2
+    assert first.search('steel')[0][0] == 'b'
+    assert second.search('crude')[0][0] == 'a'
+
+def _add_from_process(directory, worker):
+    index = BM25Index(directory, segment_size=3, max_segments=2)
+    for i in range(12):
+        index.add([f"{worker}-{i}"], [f"shared worker{worker} item{i}"])
+    index.commit()
+
+def test_processes_share_the_index_directory(tmp_path):
+    processes = [multiprocessing.Process(target=_add_from_process, args=(str(tmp_path), worker)) for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+    index = BM25Index(str(tmp_path))
+    assert len(index) == 36
+    assert len(index.search('shared', k=100)) == 36
+
+class FakeStore:
+    """The part of the Chroma API the index reads."""
+    def __init__(self):
+        self.chunks = {}
+
+    def add(self, ids, texts):
+        self.chunks.update(zip(ids, texts))
+
+    def get(self, ids=None, include=(), limit=None, offset=0):
+        ids = list(self.chunks) if ids is None else [doc_id for doc_id in ids if doc_id in self.chunks]
+        ids = ids[offset:offset + limit] if limit else ids
+        return {'ids': ids, 'documents': [self.chunks[doc_id] for doc_id in ids], 'metadatas': [{} for _ in ids]}
+
+def test_pending_delta_of_another_index_is_not_duplicated(tmp_path):
+    store = FakeStore()
+    store.add(['a'], ["crude oil imports"])
+    writer = BM25Index(str(tmp_path))
+    writer.add(['a'], ["crude oil imports"])
+    writer.commit()
+    # Another process stores a chunk and keeps it in its uncommitted delta
+    store.add(['b'], ["steel tariffs"])
+    writer.add(['b'], ["steel tariffs"])
+    reader = BM25Index(str(tmp_path), vector_store=store)
+    assert reader.search('steel')[0][0] == 'b'
+    writer.commit()
+    merged = BM25Index(str(tmp_path))
+    assert len(merged) == 2
+    assert [doc_id for doc_id, _ in merged.search('steel tariffs crude', k=10)].count('b') == 1
+
+def test_index_is_rebuilt_when_the_store_lost_chunks(tmp_path):
+    store = FakeStore()
+    store.add(['a'], ["crude oil imports"])
+    index = BM25Index(str(tmp_path))
+    index.add(['a', 'gone'], ["crude oil imports", "deleted chunk"])
+    index.commit()
+    synced = BM25Index(str(tmp_path), vector_store=store)
+    assert synced.search('deleted') == []
+    assert len(synced) == 1
@@ -0,0 +1,156 @@
+import asyncio
+import operator
+from typing import Annotated, Set
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, MessagesState, START, END
+from utils.checkpointing import SQLiteCheckpointSaver
+
+class State(MessagesState):
+    turns: int
+    links: Annotated[Set, operator.or_]
+
+def build_graph(checkpointer):
+    def search(state: State):
+        return {'links': {f"https://example.com/{state['turns']}"}}
+
+    def answer(state: State):
+        return {'messages': [AIMessage(content=f"answer {state['turns']}")], 'turns': state['turns'] + 1}
+
+    builder = StateGraph(State)
+    builder.add_node(search)
+    builder.add_node(answer)
+    builder.add_edge(START, 'search')
+    builder.add_edge('search', 'answer')
+    builder.add_edge('answer', END)
+    return builder.compile(checkpointer=checkpointer)
+
+def thread(thread_id='conversation'):
+    return {'configurable': {'thread_id': thread_id}}
+
+def run_turns(graph, turns, thread_id='conversation'):
+    for turn in range(turns):
+        inputs = {'messages': [HumanMessage(content=f"question {turn}")]}
+        if turn == 0:
+            inputs.update(turns=0, links=set())
+        graph.invoke(inputs, config=thread(thread_id))
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'checkpoints.sqlite')
+
+def test_state_round_trips_through_a_new_saver(path):
+    run_turns(build_graph(SQLiteCheckpointSaver(path)), 3)
+    state = build_graph(SQLiteCheckpointSaver(path)).get_state(thread())
+    assert state.values['turns'] == 3
+    assert state.values['links'] == {f"https://example.com/{turn}" for turn in range(3)}
+    assert [message.content for message in state.values['messages']] == [
+        'question 0', 'answer 0', 'question 1', 'answer 1', 'question 2', 'answer 2']
+
+def test_list_and_get_tuple_by_id(path):
+    saver = SQLiteCheckpointSaver(path, keep_last=None)
+    run_turns(build_graph(saver), 2)
+    checkpoints = list(saver.list(thread()))
+    ids = [checkpoint.config['configurable']['checkpoint_id'] for checkpoint in checkpoints]
+    assert ids == sorted(ids, reverse=True)
+    assert checkpoints[0].parent_config['configurable']['checkpoint_id'] == ids[1]
+    older = saver.get_tuple({'configurable': {'thread_id': 'conversation', 'checkpoint_ns': '', 'checkpoint_id': ids[-1]}})
+    assert older.config['configurable']['checkpoint_id'] == ids[-1]
+    assert len(list(saver.list(thread(), limit=2))) == 2
+
+def test_pruning_keeps_the_last_checkpoints_and_their_blobs(path):
+    saver = SQLiteCheckpointSaver(path, keep_last=2)
+    graph = build_graph(saver)
+    run_turns(graph, 4)
+    assert len(list(saver.list(thread()))) == 2
+    assert graph.get_state(thread()).values['turns'] == 4
+    unpruned = SQLiteCheckpointSaver(path + '.all', keep_last=None)
+    run_turns(build_graph(unpruned), 4)
+    assert saver.stats()['blobs'] < unpruned.stats()['blobs']
+
+def test_pruning_is_per_thread(path):
+    saver = SQLiteCheckpointSaver(path, keep_last=2)
+    graph = build_graph(saver)
+    run_turns(graph, 3, 'first')
+    run_turns(graph, 1, 'second')
+    assert graph.get_state(thread('first')).values['turns'] == 3
+    assert graph.get_state(thread('second')).values['turns'] == 1
+    assert saver.stats()['threads'] == 2
+
+def test_delete_thread(path):
+    saver = SQLiteCheckpointSaver(path)
+    graph = build_graph(saver)
+    run_turns(graph, 2, 'first')
+    run_turns(graph, 2, 'second')
+    saver.delete_thread('first')
+    assert saver.get_tuple(thread('first')) is None
+    assert graph.get_state(thread('second')).values['turns'] == 2
+    assert saver.stats()['threads'] == 1
+
+def test_idle_threads_expire(path):
+    saver = SQLiteCheckpointSaver(path)
+    run_turns(build_graph(saver), 1)
+    saver.thread_ttl = 0
+    saver.delete_expired_threads()
+    assert saver.get_tuple(thread()) is None
+    stats = saver.stats()
+    assert (stats['threads'], stats['checkpoints'], stats['blobs'], stats['writes']) == (0, 0, 0, 0)
+
+def test_async_round_trip(path):
+    graph = build_graph(SQLiteCheckpointSaver(path))
+
+    async def run():
+        await graph.ainvoke({'messages': [HumanMessage(content='question')], 'turns': 0, 'links': set()}, config=thread())
+        return await graph.aget_state(thread())
+
+    assert asyncio.run(run()).values['turns'] == 1
+
+def build_app(checkpointer, own_thread: bool):
+    """The app's shape: a chat graph whose node runs a compiled agent graph on the same store."""
+    class AgentState(MessagesState):
+        steps: int
+
+    def step(state: AgentState):
+        return {'steps': state['steps'] + 1}
+
+    agent_builder = StateGraph(AgentState)
+    for name in ('plan', 'search', 'answer'):
+        agent_builder.add_node(name, step)
+    agent_builder.add_edge(START, 'plan')
+    agent_builder.add_edge('plan', 'search')
+    agent_builder.add_edge('search', 'answer')
+    agent_builder.add_edge('answer', END)
+    agent = agent_builder.compile(checkpointer=checkpointer)
+
+    async def respond(state: MessagesState, config: RunnableConfig):
+        if own_thread:
+            config = {'configurable': {'thread_id': f"{config['configurable']['thread_id']}:agent"}}
+        result = await agent.ainvoke({'messages': [], 'steps': 0}, config=config)
+        return {'messages': [AIMessage(content=f"{result['steps']} steps")]}
+
+    chat_builder = StateGraph(MessagesState)
+    chat_builder.add_node(respond)
+    chat_builder.add_edge(START, 'respond')
+    chat_builder.add_edge('respond', END)
+    return chat_builder.compile(checkpointer=checkpointer)
+
+def row_counts(saver):
+    stats = saver.stats()
+    return stats['checkpoints'], stats['blobs'], stats['writes']
+
+@pytest.mark.parametrize('own_thread', [False, True])
+def test_app_shape_keeps_a_bounded_number_of_rows(path, own_thread):
+    saver = SQLiteCheckpointSaver(path, keep_last=2)
+    app = build_app(saver, own_thread)
+
+    def ask(turns: int):
+        for _ in range(turns):
+            asyncio.run(app.ainvoke({'messages': [HumanMessage(content='question')]}, config=thread()))
+        return row_counts(saver)
+
+    after_two = ask(2)
+    assert ask(3) == after_two
+    namespaces = {row[0] for row in saver._conn.execute("SELECT DISTINCT checkpoint_ns FROM checkpoints")}
+    assert len(namespaces) <= 2
+    assert [message.content for message in app.get_state(thread()).values['messages']][-1] == '3 steps'
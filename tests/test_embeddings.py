@@ -0,0 +1,30 @@
+from langchain_core.embeddings import Embeddings
+from utils.models import CachedEmbeddings, ConcurrentEmbeddings
+
+class RecordingEmbeddings(Embeddings):
+    """Embeds documents and queries to different vectors and records every call."""
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(('documents', list(texts)))
+        return [[1.0, float(len(text))] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(('query', text))
+        return [2.0, float(len(text))]
+
+def test_queries_and_documents_do_not_share_cache_entries(tmp_path):
+    model = RecordingEmbeddings()
+    embeddings = CachedEmbeddings(model, path=str(tmp_path / 'embeddings.sqlite'))
+    assert embeddings.embed_documents(['crude oil']) == [[1.0, 9.0]]
+    assert embeddings.embed_query('crude oil') == [2.0, 9.0]
+    assert embeddings.embed_queries(['crude oil', 'steel']) == [[2.0, 9.0], [2.0, 5.0]]
+    assert model.calls == [('documents', ['crude oil']), ('query', 'crude oil'), ('query', 'steel')]
+
+def test_embed_queries_runs_the_misses_concurrently(tmp_path):
+    model = RecordingEmbeddings()
+    embeddings = CachedEmbeddings(ConcurrentEmbeddings(model, max_concurrency=4, requests_per_second=1000),
+                                  path=str(tmp_path / 'embeddings.sqlite'))
+    assert embeddings.embed_queries(['a', 'bb', 'a']) == [[2.0, 1.0], [2.0, 2.0], [2.0, 1.0]]
+    assert sorted(model.calls) == [('query', 'a'), ('query', 'bb')]
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import StateGraph, START
+from langgraph.types import Overwrite
+import config
+import main
+from main import CustomState, HARMFUL_QUERY_RESPONSE, final_response, route_harmful_query, user_query_analyzer
+from schemas import QueryAnalysisResults
+from utils.checkpointing import SQLiteCheckpointSaver
+from utils.models import LazyModel
+
+def analysis(is_harmful: bool):
+    return QueryAnalysisResults(query_parameters={'keywords': ['trade'], 'entities': ['India']},
+                                search_complexity={'complexity_level': 'Simple', 'multi_faceted': False}, is_harmful=is_harmful)
+
+def draft(text: str):
+    return AIMessage(content=f"**Response:** {text}", response=text)
+
+def finished_run(**state):
+    messages = [HumanMessage(content='question'), draft('first draft'), HumanMessage(content='**Evaluator:** more detail'),
+                draft('second draft'), HumanMessage(content='**Evaluator:** still missing figures')]
+    return {'user_request_analysis': analysis(False), 'messages': messages, **state}
+
+def test_harmful_query_returns_the_refusal():
+    state = {'user_request_analysis': analysis(True), 'messages': [AIMessage(content=HARMFUL_QUERY_RESPONSE)]}
+    assert final_response(state) == HARMFUL_QUERY_RESPONSE
+
+def test_harmful_query_ignores_leftover_drafts(monkeypatch):
+    monkeypatch.setattr(config, 'RESPONSE_MODE', 'speculative')
+    state = finished_run(user_request_analysis=analysis(True), best_response='first draft')
+    assert final_response(state) == HARMFUL_QUERY_RESPONSE
+
+def test_strict_mode_returns_the_last_draft(monkeypatch):
+    monkeypatch.setattr(config, 'RESPONSE_MODE', 'strict')
+    assert final_response(finished_run(best_response='first draft', best_rating='satisfactory')) == 'second draft'
+
+def test_speculative_mode_returns_the_best_rated_draft(monkeypatch):
+    monkeypatch.setattr(config, 'RESPONSE_MODE', 'speculative')
+    assert final_response(finished_run(best_response='first draft', best_rating='satisfactory')) == 'first draft'
+
+def test_speculative_mode_without_a_rated_draft_returns_the_last_draft(monkeypatch):
+    monkeypatch.setattr(config, 'RESPONSE_MODE', 'speculative')
+    assert final_response(finished_run(best_response='')) == 'second draft'
+
+def test_run_without_a_draft_returns_an_empty_answer():
+    assert final_response({'user_request_analysis': analysis(False), 'messages': [HumanMessage(content='question')]}) == ""
+
+class FakeAnalyzer:
+    """Stands in for the LLM: answers the query analysis with the next verdict."""
+    def __init__(self, verdicts: list):
+        self.verdicts = verdicts
+
+    def with_structured_output(self, schema):
+        return self
+
+    async def ainvoke(self, messages, config=None):
+        return analysis(self.verdicts.pop(0))
+
+def test_harmful_query_on_a_persisted_thread_does_not_return_the_previous_answer(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'model', FakeAnalyzer([False, True]))
+
+    async def search_query_planner(state: CustomState):
+        return {'messages': [draft('previous answer')]}
+
+    builder = StateGraph(CustomState)
+    builder.add_node(user_query_analyzer)
+    builder.add_node('search_query_planner', search_query_planner)
+    builder.add_edge(START, 'user_query_analyzer')
+    builder.add_conditional_edges('user_query_analyzer', route_harmful_query)
+    graph = builder.compile(checkpointer=SQLiteCheckpointSaver(str(tmp_path / 'checkpoints.sqlite')))
+    thread = {'configurable': {'thread_id': 'session'}}
+
+    async def ask(question: str):
+        # Same reset of the message channel as generate_websearch_response
+        return await graph.ainvoke(CustomState(user_request=question, messages=Overwrite([])), config=thread)
+
+    assert final_response(asyncio.run(ask('first question'))) == 'previous answer'
+    assert final_response(asyncio.run(ask('harmful question'))) == HARMFUL_QUERY_RESPONSE
+    messages = graph.get_state(thread).values['messages']
+    assert not any(getattr(message, 'response', None) for message in messages)
+    assert [message.content for message in messages].count(HARMFUL_QUERY_RESPONSE) == 1
+
+def test_importing_main_does_not_start_the_compactor():
+    assert not any(thread.name == 'vector-store-compactor' for thread in threading.enumerate())
+
+def test_stores_are_opened_on_first_use(tmp_path):
+    path = tmp_path / 'cache' / 'checkpoints.sqlite'
+    saver = SQLiteCheckpointSaver(str(path))
+    assert not path.parent.exists()
+    assert saver.stats()['checkpoints'] == 0
+    assert path.exists()
+
+def test_main_registers_its_indexes_lazily():
+    assert isinstance(main.lexical_index, LazyModel)
+    assert isinstance(main.compactor, LazyModel)
+
+def test_web_search_verdict_also_crawls_while_depth_allows():
+    state = {'next_step': 'web_search', 'crawl_depth': 0, 'max_crawl_depth': 2, 'iteration': 1, 'max_iterations': 3}
+    assert main.conditional_edge(state) == ['search_query_planner', 'crawl_contexts']
+    assert main.conditional_edge({**state, 'crawl_depth': 2}) == 'search_query_planner'
+
+def test_parallel_branches_store_only_their_own_links():
+    state = {'next_step': 'web_search', 'sources_data': [{'metadata': {'link': 'https://search.example'}}],
+             'relevant_links': {'https://crawled.example'}}
+    to_store, planner = main.route_search_results(state)
+    assert (to_store.node, to_store.arg['relevant_links'], to_store.arg['sources_data']) == ('data_extracter', set(), state['sources_data'])
+    assert planner == 'retrieval_planner'
+    [crawled] = main.route_crawled_links(state)
+    assert (crawled.node, crawled.arg['sources_data'], crawled.arg['relevant_links']) == ('data_extracter', [], state['relevant_links'])
+
+def test_crawl_verdict_stores_the_links_and_plans_the_retrieval():
+    assert main.route_crawled_links({'next_step': 'crawl_contexts'}) == ['data_extracter', 'retrieval_planner']
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from utils import pipeline
+from utils.pipeline import IngestionPipeline
+
+PAGES = {f"https://trade.example.org/{i}": {'link': f"https://trade.example.org/{i}"} for i in range(50)}
+
+class FakeLoader:
+    """Stands in for iter_url_loader and counts the pages it handed out."""
+    def __init__(self):
+        self.loaded = 0
+
+    async def __call__(self, urls, fetch_mode=None, use_cache=True):
+        for url in urls:
+            await asyncio.sleep(0)
+            self.loaded += 1
+            yield url, {'metadata': {'source': url}, 'page_content': f"Exports reported on {url}"}
+
+class FakeSplitter:
+    def split_text(self, text):
+        if text.endswith('/3'):
+            raise ValueError('unparseable markdown')
+        return [text]
+
+class FakeFilter:
+    def select_relevant(self, content, metadata):
+        return list(content), [dict(metadata) for _ in content]
+
+class FakeStore:
+    """In-memory vector store; raises on every write when `failing`."""
+    def __init__(self, failing=False):
+        self.failing = failing
+        self.chunks = {}
+
+    def get(self, ids=None, include=()):
+        return {'ids': [id_ for id_ in ids or [] if id_ in self.chunks]}
+
+    async def aadd_texts(self, texts, metadatas=None, ids=None):
+        if self.failing:
+            raise ConnectionError('store unavailable')
+        self.chunks.update(zip(ids, texts))
+
+@pytest.fixture
+def loader(monkeypatch):
+    fake = FakeLoader()
+    monkeypatch.setattr(pipeline, 'iter_url_loader', fake)
+    return fake
+
+def run(store, **kwargs):
+    ingestion = IngestionPipeline(FakeSplitter(), FakeFilter(), store, store_batch_size=1, **kwargs)
+    return asyncio.run(asyncio.wait_for(ingestion.run(PAGES), timeout=5))
+
+def test_pipeline_stores_every_page(loader):
+    store = FakeStore()
+    loaded = run(store, queue_size=2)
+    assert set(loaded) == set(PAGES)
+    assert loaded['https://trade.example.org/0']['link'] == 'https://trade.example.org/0'
+    # The page that failed to split is skipped, the others are stored
+    assert len(store.chunks) == len(PAGES) - 1
+
+def test_store_failure_cancels_the_other_stages(loader):
+    with pytest.raises(ConnectionError):
+        run(FakeStore(failing=True), queue_size=1, split_workers=1, filter_workers=1)
+    # The fetch stage stopped at the full queues instead of loading every page
+    assert loader.loaded < len(PAGES)
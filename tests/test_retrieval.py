@@ -0,0 +1,88 @@
+from langchain_core.documents import Document
+from schemas import DBQuery
+from utils.retrieval import AdvancedRetriever, RemoteReranker
+
+def chunk(chunk_id: str):
+    return Document(page_content=f"text of {chunk_id}", metadata={'chunk_id': chunk_id})
+
+class QueryEmbeddings:
+    """Records which embedding method the retriever uses."""
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(('documents', texts))
+        return [[0.0] for text in texts]
+
+    def embed_queries(self, texts):
+        self.calls.append(('queries', texts))
+        return [[float(i)] for i, text in enumerate(texts)]
+
+class FakeStore:
+    def __init__(self, pools: list):
+        self.embeddings = QueryEmbeddings()
+        self.pools = pools
+
+    def similarity_search_by_vector(self, embedding, k, filter=None):
+        return self.pools[int(embedding[0])][:k]
+
+def retriever(store=None, **kwargs):
+    return AdvancedRetriever(store or FakeStore([]), llm=None, mode='vector', **kwargs)
+
+def test_search_embeds_all_queries_as_queries():
+    store = FakeStore([[chunk('a')], [chunk('b')]])
+    pools = retriever(store).search(['first', 'second'])
+    assert store.embeddings.calls == [('queries', ['first', 'second'])]
+    assert [[doc.metadata['chunk_id'] for doc in pool] for pool in pools] == [['a'], ['b']]
+
+def test_merge_honours_every_query_quota():
+    shared, first_only, second_only = chunk('shared'), chunk('first'), chunk('second')
+    ranked_pools = [[(shared, 3.0), (first_only, 2.0)], [(shared, 5.0), (second_only, 1.0)]]
+    q_items = [DBQuery(query='first', n_results=1), DBQuery(query='second', n_results=1)]
+    merged = retriever().merge(q_items, ranked_pools)
+    # The shared chunk fills the first query's quota; the second query still gets a chunk of its own
+    assert [doc.metadata['chunk_id'] for doc in merged] == ['shared', 'second']
+
+def test_merge_orders_chunks_by_rrf_score():
+    a, b, c = chunk('a'), chunk('b'), chunk('c')
+    ranked_pools = [[(a, 1.0), (b, 0.5)], [(b, 1.0), (c, 0.5)]]
+    q_items = [DBQuery(query='first', n_results=2), DBQuery(query='second', n_results=2)]
+    assert [doc.metadata['chunk_id'] for doc in retriever().merge(q_items, ranked_pools)] == ['b', 'a', 'c']
+
+class FakeModelClient:
+    """Scores a pair by the number of query words in its text and records every scoring call."""
+    def __init__(self):
+        self.calls = []
+
+    def call(self, method, pairs):
+        self.calls.append(pairs)
+        return [float(sum(word in text.split() for word in query.lower().split())) for query, text in pairs]
+
+def test_rerank_many_scores_every_query_in_one_pass():
+    client = FakeModelClient()
+    docs = [Document(page_content='crude oil', metadata={'chunk_id': 'oil'}),
+            Document(page_content='crude oil tariffs', metadata={'chunk_id': 'tariffs'})]
+    results = RemoteReranker(client).rerank_many([('crude', docs[:1]), ('oil tariffs', docs)])
+    assert len(client.calls) == 1
+    assert [[(doc.metadata['chunk_id'], score) for doc, score in ranked] for ranked in results] == [
+        [('oil', 1.0)], [('tariffs', 2.0), ('oil', 1.0)]]
+
+def test_rerank_scores_are_reused_across_calls():
+    client = FakeModelClient()
+    reranker = RemoteReranker(client)
+    oil, steel = chunk('oil'), chunk('steel')
+    reranker.rerank('Crude  Oil', [oil])
+    # The same chunk under a differently cased/spaced query is not scored again; only the new chunk is
+    reranker.rerank_many([('crude oil', [oil, steel]), ('crude oil', [steel])])
+    assert client.calls == [[['Crude  Oil', 'text of oil']], [['crude oil', 'text of steel']]]
+
+def test_rerank_scores_expire_and_are_bounded():
+    client = FakeModelClient()
+    reranker = RemoteReranker(client)
+    reranker.score_cache.max_size = 1
+    reranker.rerank('oil', [chunk('a'), chunk('b')])
+    reranker.rerank('oil', [chunk('b')])
+    reranker.rerank('oil', [chunk('a')])  # evicted by 'b'
+    reranker.score_cache.ttl = -1
+    reranker.rerank('oil', [chunk('a')])  # expired
+    assert [len(pairs) for pairs in client.calls] == [2, 1, 1]
@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from utils.serving import ChatServer, ServerBusyError
+
+class FakeAgent:
+    """Compiled-graph stand-in: each run waits for `release`, recording its thread id and the peak concurrency."""
+    def __init__(self, fail_on=None):
+        self.release = asyncio.Event()
+        self.fail_on = fail_on
+        self.running = 0
+        self.peak = 0
+        self.started = []
+
+    async def ainvoke(self, inputs, config=None):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.started.append((config['configurable']['thread_id'], inputs))
+        try:
+            await self.release.wait()
+            if inputs == self.fail_on:
+                raise ValueError('run failed')
+            return {'answer': inputs}
+        finally:
+            self.running -= 1
+
+    async def astream_events(self, inputs, config=None, version=None):
+        yield {'event': 'on_chain_start'}
+        yield {'event': 'on_chat_model_stream', 'data': inputs}
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_runs_beyond_the_limit_wait_for_a_slot():
+    async def run():
+        server, agent = ChatServer(max_concurrency=2, max_queue=10), FakeAgent()
+        tasks = [asyncio.create_task(server.run(f"user{i}", agent, i)) for i in range(5)]
+        await settle()
+        assert (server.active, server.queued) == (2, 3)
+        agent.release.set()
+        results = await asyncio.gather(*tasks)
+        return server, agent, results
+
+    server, agent, results = asyncio.run(run())
+    assert results == [{'answer': i} for i in range(5)]
+    assert agent.peak == 2
+    assert server.stats()['completed'] == 5
+
+def test_requests_of_one_session_run_in_order_on_its_thread():
+    async def run():
+        server, agent = ChatServer(max_concurrency=4, max_queue=10), FakeAgent()
+        tasks = [asyncio.create_task(server.run('alice', agent, turn)) for turn in range(3)]
+        await settle()
+        assert agent.running == 1
+        agent.release.set()
+        await asyncio.gather(*tasks)
+        return agent
+
+    agent = asyncio.run(run())
+    assert agent.started == [('session-alice', 0), ('session-alice', 1), ('session-alice', 2)]
+
+def test_full_queue_raises_server_busy():
+    async def run():
+        server, agent = ChatServer(max_concurrency=1, max_queue=1), FakeAgent()
+        running = asyncio.create_task(server.run('alice', agent, 'first'))
+        await settle()
+        queued = asyncio.create_task(server.run('bob', agent, 'second'))
+        await settle()
+        with pytest.raises(ServerBusyError):
+            await server.run('carol', agent, 'third')
+        agent.release.set()
+        await asyncio.gather(running, queued)
+        return server.stats()
+
+    stats = asyncio.run(run())
+    assert (stats['completed'], stats['rejected'], stats['queued'], stats['active']) == (2, 1, 0, 0)
+
+def test_failed_and_cancelled_requests_free_their_slot():
+    async def run():
+        server, agent = ChatServer(max_concurrency=1, max_queue=10), FakeAgent(fail_on='bad')
+        failing = asyncio.create_task(server.run('alice', agent, 'bad'))
+        await settle()
+        cancelled = asyncio.create_task(server.run('bob', agent, 'never'))
+        await settle()
+        cancelled.cancel()
+        agent.release.set()
+        with pytest.raises(ValueError):
+            await failing
+        assert await server.run('carol', agent, 'ok') == {'answer': 'ok'}
+        return server.stats()
+
+    stats = asyncio.run(run())
+    assert (stats['failed'], stats['completed'], stats['queued'], stats['active']) == (1, 1, 0, 0)
+
+def test_stream_records_time_to_first_token():
+    async def run():
+        server = ChatServer()
+        is_token = lambda event: event['event'] == 'on_chat_model_stream'
+        events = [event async for event in server.stream('alice', FakeAgent(), 'draft', is_token=is_token)]
+        return server, events
+
+    server, events = asyncio.run(run())
+    assert [event['event'] for event in events] == ['on_chain_start', 'on_chat_model_stream']
+    assert server.stats()['ttft_p50'] is not None
@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from utils import storage
+from utils.storage import NearDuplicateIndex, VectorStoreCompactor, VectorStoreWriter
+
+TEXT = ("India's merchandise exports to the United States rose in the last fiscal year, led by electronics, "
+        "pharmaceuticals and engineering goods, while imports of crude oil and coal from the US also increased sharply.")
+
+class FakeEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [[float(len(text) % 7) + 1.0, 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+@pytest.fixture
+def vector_store(tmp_path):
+    return Chroma(collection_name='test_chunks', embedding_function=FakeEmbeddings(), persist_directory=str(tmp_path / 'chroma'))
+
+def write(vector_store, texts, metadatas, dedup_index=None):
+    async def run():
+        writer = VectorStoreWriter(vector_store, dedup_index=dedup_index, batch_size=10, max_wait=0.01)
+        await writer.add(texts, metadatas)
+        await writer.close()
+        return writer.stats
+    return asyncio.run(run())
+
+def test_writer_skips_exact_repeats(vector_store):
+    stats = write(vector_store, [TEXT, TEXT], [{'link': 'https://a.example'}, {'link': 'https://a.example'}])
+    assert stats['duplicates_skipped'] == 1
+    assert stats['chunks_stored'] == 1
+    assert len(vector_store.get(include=[])['ids']) == 1
+
+def test_writer_does_not_rewrite_stored_chunks(vector_store):
+    write(vector_store, [TEXT], [{'link': 'https://a.example'}])
+    stats = write(vector_store, [TEXT], [{'link': 'https://a.example'}])
+    assert stats['already_stored'] == 1
+    assert stats['chunks_stored'] == 0
+
+def test_writer_skips_near_duplicates_of_stored_chunks(vector_store):
+    write(vector_store, [TEXT], [{'link': 'https://a.example'}], dedup_index=NearDuplicateIndex(vector_store))
+    # A fresh index loads the fingerprints of the stored chunk
+    stats = write(vector_store, [TEXT], [{'link': 'https://syndicated.example'}], dedup_index=NearDuplicateIndex(vector_store))
+    assert stats['near_duplicates_skipped'] == 1
+    assert len(vector_store.get(include=[])['ids']) == 1
+
+def test_near_duplicates_are_scoped_per_session(vector_store):
+    dedup_index = NearDuplicateIndex(vector_store)
+    write(vector_store, [TEXT], [{'link': 'https://a.example', 'session_id': 'first'}], dedup_index=dedup_index)
+    stats = write(vector_store, [TEXT], [{'link': 'https://b.example', 'session_id': 'second'}], dedup_index=dedup_index)
+    assert stats['near_duplicates_skipped'] == 0
+    assert stats['chunks_stored'] == 1
+
+def test_writer_stamps_chunks(vector_store):
+    write(vector_store, [TEXT], [{'link': 'https://a.example', 'session_id': 'first'}], dedup_index=NearDuplicateIndex(vector_store))
+    metadata = vector_store.get(include=['metadatas'])['metadatas'][0]
+    assert {'chunk_id', 'added_at', 'simhash', 'session_id'} <= set(metadata)
+
+def test_near_duplicate_index_loads_off_the_event_loop(vector_store, monkeypatch):
+    threads = []
+    load = NearDuplicateIndex.load
+    def recording_load(self):
+        threads.append(threading.current_thread())
+        load(self)
+    monkeypatch.setattr(NearDuplicateIndex, 'load', recording_load)
+    write(vector_store, [TEXT], [{'link': 'https://a.example'}], dedup_index=NearDuplicateIndex(vector_store))
+    assert threads and threads[0] is not threading.main_thread()
+
+class FlakyStore:
+    """Vector store whose first `failures` writes fail."""
+    def __init__(self, store, failures: int):
+        self.store = store
+        self.failures = failures
+
+    def get(self, **kwargs):
+        return self.store.get(**kwargs)
+
+    async def aadd_texts(self, texts, metadatas=None, ids=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('store unavailable')
+        return await self.store.aadd_texts(texts, metadatas=metadatas, ids=ids)
+
+def test_failed_timed_flush_keeps_the_batch_for_close(vector_store):
+    store = FlakyStore(vector_store, failures=1)
+
+    async def run():
+        writer = VectorStoreWriter(store, batch_size=10, max_wait=0.01)
+        await writer.add([TEXT], [{'link': 'https://a.example'}])
+        await asyncio.sleep(0.1)  # the timed flush fails
+        await writer.close()
+        return writer.stats
+
+    stats = asyncio.run(run())
+    assert stats['failed_flushes'] == 1
+    assert stats['chunks_stored'] == 1
+    assert len(vector_store.get(include=[])['ids']) == 1
+
+def test_close_raises_when_the_store_keeps_failing(vector_store):
+    async def run():
+        writer = VectorStoreWriter(FlakyStore(vector_store, failures=3), batch_size=10, max_wait=0.01)
+        await writer.add([TEXT], [{'link': 'https://a.example'}])
+        await writer.close()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+
+def test_rescraped_chunks_count_as_already_stored(vector_store):
+    dedup_index = NearDuplicateIndex(vector_store)
+    write(vector_store, [TEXT], [{'link': 'https://a.example'}], dedup_index=dedup_index)
+    stats = write(vector_store, [TEXT], [{'link': 'https://a.example'}], dedup_index=dedup_index)
+    assert stats['already_stored'] == 1
+    assert stats['near_duplicates_skipped'] == 0
+
+def test_failed_write_leaves_no_fingerprint_behind(vector_store):
+    dedup_index = NearDuplicateIndex(vector_store)
+
+    async def run():
+        writer = VectorStoreWriter(FlakyStore(vector_store, failures=1), dedup_index=dedup_index, batch_size=10, max_wait=60)
+        await writer.add([TEXT], [{'link': 'https://a.example'}])
+        await writer.close()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(run())
+    stats = write(vector_store, [TEXT], [{'link': 'https://syndicated.example'}], dedup_index=dedup_index)
+    assert stats['near_duplicates_skipped'] == 0
+    assert stats['chunks_stored'] == 1
+
+def test_near_duplicates_within_a_batch_are_skipped(vector_store):
+    stats = write(vector_store, [TEXT, TEXT + ' '], [{'link': 'https://a.example'}, {'link': 'https://b.example'}],
+                  dedup_index=NearDuplicateIndex(vector_store))
+    assert stats['near_duplicates_skipped'] == 1
+    assert stats['chunks_stored'] == 1
+
+def test_compactor_evicts_stale_chunks_and_rebuilds(vector_store):
+    write(vector_store, [TEXT, TEXT.upper()], [{'link': 'https://a.example'}, {'link': 'https://b.example'}])
+    stale_id = vector_store.get(include=[])['ids'][0]
+    vector_store._collection.update(ids=[stale_id], metadatas=[{'link': 'https://a.example', 'added_at': 0.0}])
+    compactor = VectorStoreCompactor(vector_store, retention=3600, rebuild_fraction=0.5)
+    assert compactor.run_once() == 1
+    stats = compactor.stats()
+    assert (stats['chunks'], stats['evicted'], stats['rebuilds']) == (1, 1, 1)
+    assert stats['query_ms_before'] is not None and stats['query_ms_after'] is not None
+    # The store now reads and writes the rebuilt collection
+    assert stale_id not in vector_store.get(include=[])['ids']
+    write(vector_store, [TEXT.title()], [{'link': 'https://c.example'}])
+    assert len(vector_store.get(include=[])['ids']) == 2
+
+def test_compactor_rejects_unsupported_langchain_chroma(vector_store, monkeypatch):
+    monkeypatch.setattr(storage, 'SUPPORTED_LANGCHAIN_CHROMA', ((0, 0), (0, 0)))
+    with pytest.raises(RuntimeError, match='does not support langchain_chroma'):
+        VectorStoreCompactor(vector_store).run_once()
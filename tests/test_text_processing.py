@@ -0,0 +1,103 @@
+import zlib
+import numpy as np
+import pytest
+from utils import text_processing
+from utils.text_processing import RelevanceScorer, TermVectorCache, extract_entities
+
+DIM = 16
+
+class FakeDoc:
+    """Whitespace-tokenized doc with seeded per-word vectors; words starting with 'oov' have none."""
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = text.split()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __str__(self):
+        return self.text
+
+    @property
+    def vector(self):
+        if not self.tokens:
+            return np.zeros(DIM, dtype=np.float32)
+        return np.mean([np.zeros(DIM, dtype=np.float32) if token.startswith('oov')
+                        else np.random.default_rng(zlib.crc32(token.lower().encode())).standard_normal(DIM).astype(np.float32)
+                        for token in self.tokens], axis=0)
+
+    @property
+    def vector_norm(self):
+        return float(np.linalg.norm(self.vector))
+
+    def similarity(self, other):
+        return float(self.vector @ other.vector / (self.vector_norm * other.vector_norm))
+
+    @property
+    def ents(self):
+        return [FakeDoc(token) for token in self.tokens if token[:1].isupper()]
+
+class FakeNLP:
+    pipe_names = ['tok2vec', 'tagger', 'parser', 'ner']
+
+    class vocab:
+        vectors_length = DIM
+
+    def __call__(self, text):
+        return FakeDoc(text)
+
+    make_doc = __call__
+
+    def pipe(self, texts, disable=None):
+        return [FakeDoc(text) for text in texts]
+
+class FakeKeyBERT:
+    """Keyphrases are the first longer words of each text; unwraps single-document results like KeyBERT."""
+    def extract_keywords(self, docs, keyphrase_ngram_range=(1, 1), seed_keywords=None):
+        docs = [docs] if isinstance(docs, str) else docs
+        keywords = [[(word.lower(), 0.5) for word in doc.split()[:4] if len(word) > 3] for doc in docs]
+        return keywords[0] if len(keywords) == 1 else keywords
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    monkeypatch.setattr(text_processing, 'nlp', FakeNLP())
+    monkeypatch.setattr(text_processing, 'kw_model', FakeKeyBERT())
+    monkeypatch.setattr(text_processing, 'term_vector_cache', TermVectorCache(max_size=8))
+    monkeypatch.setattr(text_processing, 'get_model_client', lambda: None)
+
+def has_semantic_match(primary_docs: list, text_to_match: str, threshold: float):
+    """The per-text check ContentFilter ran before RelevanceScorer, kept as the reference."""
+    nlp, kw_model = text_processing.nlp, text_processing.kw_model
+    if not primary_docs or not text_to_match:
+        return False
+    text_entities = [ent.text.lower() for ent in nlp(text_to_match).ents]
+    primary_doc_lengths = [len(doc) for doc in primary_docs]
+    keyphrase_ngram_range = (min(primary_doc_lengths), max(primary_doc_lengths),)
+    seed_keywords = [doc.__str__() for doc in primary_docs]
+    text_keywords = [kw[0] for kw in kw_model.extract_keywords(text_to_match, keyphrase_ngram_range=keyphrase_ngram_range, seed_keywords=seed_keywords)]
+    text_terms = text_entities + text_keywords
+    if not text_terms:
+        return False
+    for p_doc in primary_docs:
+        for term in text_terms:
+            term_doc = nlp(term)
+            if p_doc.vector_norm and term_doc.vector_norm:
+                if p_doc.similarity(term_doc) > threshold:
+                    return True
+    return False
+
+TEXTS = ["India exports of electronics to the United States rose", "Crude oil imports and tariffs", "",
+         "oovalpha oovbeta", "a b c", "Steel and aluminium duties were raised", "Pharmaceuticals shipments fell sharply",
+         "Quarterly trade deficit narrowed", "Weather was pleasant in Delhi"]
+TARGETS = [['India', 'exports'], ['crude oil', 'tariffs', 'oovzero'], ['oovzero'], [], ['trade deficit', 'Delhi weather']]
+
+@pytest.mark.parametrize('targets', TARGETS)
+@pytest.mark.parametrize('threshold', [-0.5, 0.0, 0.1, 0.3, 0.6, 0.99])
+def test_scorer_matches_the_per_text_check(targets, threshold):
+    primary_docs = [text_processing.nlp(term) for term in targets]
+    expected = [has_semantic_match(primary_docs, text, threshold) for text in TEXTS]
+    assert RelevanceScorer(targets).matches(TEXTS, extract_entities(TEXTS), threshold) == expected
+
+def test_scorer_matches_exact_terms_and_rejects_unrelated_text():
+    matches = RelevanceScorer(['India', 'exports']).matches(TEXTS, extract_entities(TEXTS), 0.6)
+    assert matches[0] and not matches[2] and not matches[3]
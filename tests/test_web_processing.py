@@ -0,0 +1,251 @@
+import asyncio
+import io
+import time
+import urllib.error
+import pytest
+from utils import web_processing
+from utils.fetchers import looks_like_js_shell
+from utils.caching import PageCache
+
+URL = 'https://trade.example.org/report'
+HTML = "<html><body><p>" + "India's exports to the United States rose sharply last year. " * 20 + "</p></body></html>"
+
+class FakeHttpFetcher:
+    """Answers every request with `response` and records the request headers."""
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    async def fetch(self, url, headers=None):
+        self.requests.append((url, headers))
+        return self.response
+
+def http_response(status=200, text=HTML, headers=None):
+    return {'status': status, 'text': text, 'headers': {'content-type': 'text/html', **(headers or {})}}
+
+@pytest.fixture
+def page_cache(tmp_path, monkeypatch):
+    cache = PageCache(str(tmp_path / 'pages.sqlite'))
+    monkeypatch.setattr(web_processing, 'page_cache', cache)
+    monkeypatch.setattr(web_processing, '_html_to_markdown', lambda url, html: 'converted markdown')
+    return cache
+
+def load(url=URL, fetch_mode='auto'):
+    return asyncio.run(web_processing.load_page(url, fetch_mode))
+
+def test_fresh_pages_are_served_from_the_cache(page_cache, monkeypatch):
+    fetcher = FakeHttpFetcher(http_response())
+    monkeypatch.setattr(web_processing, 'http_fetcher', fetcher)
+    assert load()['metadata']['fetch_path'] == 'http'
+    page = load()
+    assert page['metadata']['fetch_path'] == 'cache'
+    assert page['page_content'] == 'converted markdown'
+    assert len(fetcher.requests) == 1
+
+def test_stale_pages_are_revalidated_with_their_validators(page_cache, monkeypatch):
+    page_cache.put(URL, HTML, 'cached markdown', 0.9, etag='"v1"', last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+    page_cache.max_age = 60
+    page_cache._conn.execute("UPDATE pages SET fetched_at = 0")
+    fetcher = FakeHttpFetcher(http_response(status=304, text=''))
+    monkeypatch.setattr(web_processing, 'http_fetcher', fetcher)
+    page = load()
+    assert fetcher.requests == [(URL, {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})]
+    assert page['metadata']['fetch_path'] == 'revalidated'
+    assert page['page_content'] == 'cached markdown'
+    assert page_cache.stats()['revalidated'] == 1
+    # The 304 makes the entry fresh again
+    assert page_cache.get(URL)['fresh']
+
+def test_changed_pages_are_refetched_and_replace_their_body(page_cache, monkeypatch):
+    page_cache.put(URL, HTML, 'old markdown', 0.9, etag='"v1"')
+    page_cache.max_age = 0
+    changed = HTML.replace('rose', 'fell')
+    monkeypatch.setattr(web_processing, 'http_fetcher', FakeHttpFetcher(http_response(text=changed, headers={'etag': '"v2"'})))
+    page = load()
+    assert page['metadata']['fetch_path'] == 'http'
+    assert page_cache.get(URL)['etag'] == '"v2"'
+    assert page_cache.stats()['unique_bodies'] == 1
+
+def test_bodies_shared_by_another_url_are_kept(page_cache):
+    page_cache.put(URL, HTML, 'markdown', 0.9)
+    page_cache.put('https://mirror.example.org/report', HTML, 'markdown', 0.5)
+    page_cache.put(URL, HTML.replace('rose', 'fell'), 'markdown', 0.9)
+    assert page_cache.stats()['unique_bodies'] == 2
+    assert page_cache.get('https://mirror.example.org/report')['html'] == HTML
+
+ROBOTS = b"User-agent: *\nDisallow: /private/\n"
+
+class FakeRobotsServer:
+    """Stands in for urllib.request.urlopen: serves robots.txt, raising the queued errors first."""
+    def __init__(self, body=ROBOTS, errors=()):
+        self.body = body
+        self.errors = list(errors)
+        self.requests = []
+
+    def __call__(self, url, timeout=None):
+        self.requests.append(url)
+        if self.errors:
+            raise self.errors.pop(0)
+        return io.BytesIO(self.body)
+
+@pytest.fixture
+def robots_server(monkeypatch):
+    def serve(**kwargs):
+        server = FakeRobotsServer(**kwargs)
+        monkeypatch.setattr(web_processing.urllib.request, 'urlopen', server)
+        monkeypatch.setattr(web_processing.time, 'sleep', lambda seconds: None)
+        return server
+    return serve
+
+def test_robots_policy_is_fetched_once_per_host(robots_server):
+    server = robots_server()
+    robots = web_processing.RobotsPolicyCache()
+    assert robots.can_fetch('https://trade.example.org/report')
+    assert not robots.can_fetch('https://trade.example.org/private/data')
+    assert server.requests == ['https://trade.example.org/robots.txt']
+
+def test_robots_fetch_is_retried_once_after_a_timeout(robots_server):
+    server = robots_server(errors=[TimeoutError('timed out')])
+    robots = web_processing.RobotsPolicyCache()
+    assert not robots.can_fetch('https://trade.example.org/private/data')
+    assert len(server.requests) == 2
+
+def test_unreachable_robots_is_cached_as_allow_all(robots_server):
+    server = robots_server(errors=[urllib.error.URLError('unreachable')])
+    robots = web_processing.RobotsPolicyCache()
+    assert robots.can_fetch('https://trade.example.org/private/data')
+    assert robots.can_fetch('https://trade.example.org/private/other')
+    assert len(server.requests) == 1
+    # Once the negative entry expires the host is asked again
+    robots.negative_ttl = -1
+    robots._store(robots.robots_url(URL), None)
+    assert not robots.can_fetch('https://trade.example.org/private/data')
+    assert len(server.requests) == 2
+
+def test_forbidden_robots_disallows_the_host(robots_server):
+    robots_server(errors=[urllib.error.HTTPError(URL, 403, 'Forbidden', {}, None)])
+    assert not web_processing.RobotsPolicyCache().can_fetch(URL)
+
+def test_can_fetch_many_loads_each_host_once(robots_server):
+    server = robots_server()
+    robots = web_processing.RobotsPolicyCache()
+    urls = ['https://trade.example.org/report', 'https://trade.example.org/private/data', 'https://stats.example.gov/tables']
+    results = asyncio.run(robots.can_fetch_many(urls))
+    assert results == {urls[0]: True, urls[1]: False, urls[2]: True}
+    assert sorted(server.requests) == ['https://stats.example.gov/robots.txt', 'https://trade.example.org/robots.txt']
+    asyncio.run(robots.can_fetch_many(urls))
+    assert len(server.requests) == 2
+
+def fake_search(slow_query=None, failing_query=None):
+    """Stands in for retrieve_search_results: one query hangs, another raises."""
+    def search(query, api_params=None, max_results=5):
+        if query == slow_query:
+            time.sleep(1)
+        if query == failing_query:
+            raise ConnectionError('SerpAPI unavailable')
+        return [{'metadata': {'link': f"https://{query}.example"}}]
+    return search
+
+def test_search_many_isolates_a_hung_query(monkeypatch):
+    monkeypatch.setattr(web_processing, 'retrieve_search_results', fake_search(slow_query='slow'))
+    started = time.perf_counter()
+    results = asyncio.run(web_processing.search_many(['tariffs', 'slow', 'exports'], timeout=0.2))
+    assert time.perf_counter() - started < 1
+    assert results == [[{'metadata': {'link': 'https://tariffs.example'}}], None, [{'metadata': {'link': 'https://exports.example'}}]]
+
+def test_search_many_isolates_a_failing_query(monkeypatch):
+    monkeypatch.setattr(web_processing, 'retrieve_search_results', fake_search(failing_query='broken'))
+    results = asyncio.run(web_processing.search_many(['broken', 'exports']))
+    assert results == [None, [{'metadata': {'link': 'https://exports.example'}}]]
+
+class FakeGoogleSearch:
+    """Stands in for serpapi.GoogleSearch and records the params of every request."""
+    requests = []
+    output = {'organic_results': [{'link': 'https://trade.example.org/report', 'source': 'Trade', 'title': 'Report'}]}
+
+    def __init__(self, params):
+        self.params = params
+
+    def get_dict(self):
+        FakeGoogleSearch.requests.append(self.params)
+        return self.output
+
+@pytest.fixture
+def search_cache(tmp_path, monkeypatch):
+    cache = web_processing.SearchResultCache(str(tmp_path / 'search.sqlite'))
+    monkeypatch.setattr(web_processing, 'search_cache', cache)
+    monkeypatch.setattr(web_processing, 'GoogleSearch', FakeGoogleSearch)
+    monkeypatch.setattr(FakeGoogleSearch, 'requests', [])
+    return cache
+
+def test_repeated_queries_hit_the_search_cache(search_cache):
+    first = web_processing.retrieve_search_results('India US trade 2024')
+    assert first == [{'metadata': {'link': 'https://trade.example.org/report', 'source': 'Trade'}}]
+    # Case, whitespace and punctuation do not change the key
+    assert web_processing.retrieve_search_results('  india us trade, 2024?') == first
+    assert len(FakeGoogleSearch.requests) == 1
+    assert (search_cache.hits, search_cache.misses) == (1, 1)
+
+def test_search_cache_is_keyed_by_api_params(search_cache):
+    web_processing.retrieve_search_results('India US trade', {'gl': 'in'})
+    web_processing.retrieve_search_results('India US trade', {'gl': 'us'})
+    assert [params['gl'] for params in FakeGoogleSearch.requests] == ['in', 'us']
+
+def test_search_cache_can_be_bypassed(search_cache):
+    web_processing.retrieve_search_results('India US trade')
+    web_processing.retrieve_search_results('India US trade', use_cache=False)
+    assert len(FakeGoogleSearch.requests) == 2
+
+def test_search_errors_are_not_cached(search_cache, monkeypatch):
+    monkeypatch.setattr(FakeGoogleSearch, 'output', {'error': 'rate limited'})
+    assert web_processing.retrieve_search_results('India US trade') == []
+    assert len(search_cache) == 0
+
+SPA_SHELL = '<html><body><div id="root"></div><noscript>You need to enable JavaScript to run this app.</noscript></body></html>'
+
+class FakeBrowserPool:
+    """Stands in for the Chromium pool and records the rendered urls."""
+    def __init__(self, html=HTML):
+        self.html = html
+        self.urls = []
+
+    async def fetch(self, url):
+        self.urls.append(url)
+        return self.html
+
+def fetch_page(monkeypatch, response, fetch_mode='auto'):
+    fetcher, browser = FakeHttpFetcher(response), FakeBrowserPool()
+    monkeypatch.setattr(web_processing, 'http_fetcher', fetcher)
+    monkeypatch.setattr(web_processing, 'browser_pool', browser)
+    page = asyncio.run(web_processing._fetch_page(URL, fetch_mode, use_cache=False))
+    return page, fetcher, browser
+
+def test_js_shell_heuristic():
+    assert looks_like_js_shell(SPA_SHELL)
+    assert looks_like_js_shell('<html><body><script>' + 'render();' * 500 + '</script><p>Loading</p></body></html>')
+    assert not looks_like_js_shell(HTML)
+
+def test_static_pages_are_served_over_http(monkeypatch):
+    page, fetcher, browser = fetch_page(monkeypatch, http_response())
+    assert (page['fetch_path'], page['html']) == ('http', HTML)
+    assert browser.urls == []
+
+def test_js_shells_fall_back_to_chromium(monkeypatch):
+    page, fetcher, browser = fetch_page(monkeypatch, http_response(text=SPA_SHELL))
+    assert (page['fetch_path'], page['html']) == ('chromium', HTML)
+    assert browser.urls == [URL]
+
+@pytest.mark.parametrize('response', [None, http_response(status=503), http_response(headers={'content-type': 'application/pdf'})])
+def test_failed_http_fetches_fall_back_to_chromium(monkeypatch, response):
+    page, fetcher, browser = fetch_page(monkeypatch, response)
+    assert page['fetch_path'] == 'chromium'
+
+def test_http_mode_never_starts_the_browser(monkeypatch):
+    page, fetcher, browser = fetch_page(monkeypatch, http_response(text=SPA_SHELL), fetch_mode='http')
+    assert (page['fetch_path'], page['html']) == ('http', None)
+    assert browser.urls == []
+
+def test_chromium_mode_skips_the_http_fetch(monkeypatch):
+    page, fetcher, browser = fetch_page(monkeypatch, http_response(), fetch_mode='chromium')
+    assert page['fetch_path'] == 'chromium'
+    assert fetcher.requests == []
@@ -1,4 +1,11 @@
 from .models import *
+from .caching import *
+from .fetchers import *
 from .text_processing import *
 from .retrieval import *
-from .web_processing import *
\ No newline at end of file
+from .web_processing import *
+from .storage import *
+from .bm25 import *
+from .pipeline import *
+from .serving import *
+from .checkpointing import *
\ No newline at end of file
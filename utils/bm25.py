@@ -0,0 +1,350 @@
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+import config
+import logging
+bm25logger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/retrieval.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+bm25logger.addHandler(handler)
+bm25logger.setLevel(logging.DEBUG)
+
+# Words plus numbers/tickers with inner separators: "1,250.5", "u.s", "brent-crude", "q3/2024"
+_TOKEN = re.compile(r"\w+(?:[.,'/-]\w+)*")
+
+def tokenize(text: str):
+    return _TOKEN.findall(text.lower())
+
+def term_hash(term: str):
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big')
+
+class _Segment:
+    """Immutable on-disk segment; every array is memory-mapped, so opening one costs no reads."""
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        load = lambda part: np.load(os.path.join(directory, f"{name}.{part}.npy"), mmap_mode='r')
+        self.terms = load('terms')  # sorted uint64 term hashes
+        self.offsets = load('offsets')  # postings of terms[i] are postings[offsets[i]:offsets[i + 1]]
+        self.postings = load('postings')  # document positions within the segment
+        self.tfs = load('tfs')  # term frequency of each posting
+        self.doc_lens = load('doc_lens')
+        self.doc_ids = load('doc_ids')
+        self.sessions = load('sessions')  # session id of each document, b'' when unscoped
+        self._id_set = None
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    def id_set(self):
+        """Document ids of the segment, read once (segments never change)."""
+        if self._id_set is None:
+            self._id_set = {doc_id.decode('utf-8') for doc_id in self.doc_ids}
+        return self._id_set
+
+    def lookup(self, term: int):
+        i = np.searchsorted(self.terms, np.uint64(term))
+        if i == len(self.terms) or self.terms[i] != term:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.postings[start:end], self.tfs[start:end]
+
+    def doc_id(self, position: int):
+        return self.doc_ids[position].decode('utf-8')
+
+    def session_mask(self, session_id: str):
+        return np.asarray(self.sessions) == session_id.encode('utf-8')
+
+class _Delta:
+    """In-memory segment receiving new chunks until it is written to disk."""
+    def __init__(self):
+        self.postings = {}  # term hash -> ([positions], [tfs])
+        self.ids = []
+        self.lens = []
+        self.sessions = []
+        self._id_set = set()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, doc_id: str, tokens: list, session_id: str = None):
+        """Adds a chunk; returns False (and ignores it) if the delta already holds doc_id."""
+        if doc_id in self._id_set:
+            return False
+        self._id_set.add(doc_id)
+        position = len(self.ids)
+        self.ids.append(doc_id)
+        self.lens.append(len(tokens))
+        self.sessions.append(session_id or '')
+        for term, tf in Counter(term_hash(token) for token in tokens).items():
+            positions, tfs = self.postings.setdefault(term, ([], []))
+            positions.append(position)
+            tfs.append(tf)
+        return True
+
+    def lookup(self, term: int):
+        entry = self.postings.get(term)
+        return None if entry is None else (np.array(entry[0]), np.array(entry[1]))
+
+    def doc_id(self, position: int):
+        return self.ids[position]
+
+    def session_mask(self, session_id: str):
+        return np.array([session == session_id for session in self.sessions], dtype=bool)
+
+    def columns(self, skip: set = frozenset()):
+        """(doc_ids, lens, sessions, terms, positions, tfs) of the delta, leaving out the documents in `skip`."""
+        terms = np.array([term for term, (positions, _) in self.postings.items() for _ in positions], dtype=np.uint64)
+        positions = np.array([p for positions, _ in self.postings.values() for p in positions], dtype=np.int32)
+        tfs = np.array([tf for _, tfs in self.postings.values() for tf in tfs], dtype=np.int32)
+        keep = np.array([doc_id not in skip for doc_id in self.ids], dtype=bool)
+        if keep.all():
+            return self.ids, self.lens, self.sessions, terms, positions, tfs
+        # Drop the skipped documents' postings and renumber the remaining positions
+        renumbered = (np.cumsum(keep) - 1).astype(np.int32)
+        kept = keep[positions]
+        pick = lambda values: [value for value, keep_it in zip(values, keep) if keep_it]
+        return pick(self.ids), pick(self.lens), pick(self.sessions), terms[kept], renumbered[positions[kept]], tfs[kept]
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index kept next to a vector store, for exact terms (figures, tickers, entity names)
+    that embedding search tends to miss.
+    New chunks go to an in-memory delta that is written as an immutable segment of memory-mapped .npy arrays
+    on `commit()` (or once it reaches `segment_size`); segments are merged once there are more than `max_segments`.
+    Opening the index only maps the segment files, so startup does not read the postings.
+    Processes sharing the directory serialize segment writes and merges with a file lock and pick up each other's
+    committed segments from the manifest; uncommitted deltas stay private to their process.
+    A commit skips chunks that a committed segment already holds, so a chunk indexed by two processes is stored once.
+    On first use, store chunks that neither the committed segments nor the delta hold (pre-existing collection,
+    lost delta, another process's pending delta) are indexed; the index is only rebuilt when it holds chunks
+    the store no longer has.
+    Args:
+        directory: folder holding the manifest and segment files
+        vector_store: store the index mirrors; document ids are the store's ids
+        k1, b: BM25 parameters
+        segment_size: delta chunks that trigger a segment write
+        max_segments: segments kept before they are merged into one
+    """
+    def __init__(self, directory: str = config.BM25_INDEX_DIR, vector_store=None, k1: float = config.BM25_K1, b: float = config.BM25_B,
+                 segment_size: int = config.BM25_SEGMENT_SIZE, max_segments: int = config.BM25_MAX_SEGMENTS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.vector_store = vector_store
+        self.k1 = k1
+        self.b = b
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self._lock = threading.RLock()
+        self._delta = _Delta()
+        self._synced = vector_store is None
+        self._lock_file = open(os.path.join(directory, 'index.lock'), 'a')
+        self._file_lock_depth = 0
+        self._segments = []
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._refresh()
+
+    def __len__(self):
+        return self._n_docs
+
+    @contextmanager
+    def _file_lock(self, mode: int = fcntl.LOCK_EX):
+        """Locks the directory against other processes; callers hold self._lock, so only the outermost call locks the file."""
+        if not self._file_lock_depth:
+            fcntl.flock(self._lock_file, mode)
+        self._file_lock_depth += 1
+        try:
+            yield
+        finally:
+            self._file_lock_depth -= 1
+            if not self._file_lock_depth:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _manifest_version(self):
+        try:
+            stat = os.stat(os.path.join(self.directory, 'manifest.json'))
+            return stat.st_ino, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        """Reloads the segment list from the manifest, which other processes may have changed (call under the file lock)."""
+        manifest = self._read_manifest()
+        self._manifest_seen = self._manifest_version()
+        opened = {segment.name: segment for segment in self._segments}
+        self._next_segment = manifest['next_segment']
+        self._segments = [opened.get(name) or _Segment(self.directory, name) for name in manifest['segments']]
+        self._count()
+
+    def _count(self):
+        self._n_docs = sum(len(segment) for segment in self._segments) + len(self._delta)
+        self._total_len = sum(int(segment.doc_lens.sum()) for segment in self._segments) + sum(self._delta.lens)
+
+    def _committed_ids(self):
+        """Ids of the chunks in the committed segments."""
+        ids = set()
+        for segment in self._segments:
+            ids |= segment.id_set()
+        return ids
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segments': [], 'next_segment': 0}
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, 'manifest.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'segments': [segment.name for segment in self._segments], 'next_segment': self._next_segment}, f)
+        os.replace(path + '.tmp', path)  # readers never see a half-written manifest
+        self._manifest_seen = self._manifest_version()
+
+    def _write_segment(self, doc_ids: list, doc_lens, sessions: list, terms, positions, tfs):
+        order = np.lexsort((positions, terms))
+        terms, positions, tfs = terms[order], positions[order], tfs[order]
+        unique_terms, starts = np.unique(terms, return_index=True)
+        name = f"segment_{self._next_segment:06d}"
+        self._next_segment += 1
+        arrays = {'terms': unique_terms, 'offsets': np.append(starts, len(terms)).astype(np.int64), 'postings': positions,
+                  'tfs': tfs, 'doc_lens': np.asarray(doc_lens, dtype=np.int32),
+                  'doc_ids': np.array([doc_id.encode('utf-8') for doc_id in doc_ids], dtype=bytes),
+                  'sessions': np.array([session.encode('utf-8') for session in sessions], dtype=bytes)}
+        for part, array in arrays.items():
+            np.save(os.path.join(self.directory, f"{name}.{part}.npy"), array)
+        return _Segment(self.directory, name)
+
+    def _remove_files(self, segments: list):
+        for segment in segments:
+            for part in ('terms', 'offsets', 'postings', 'tfs', 'doc_lens', 'doc_ids', 'sessions'):
+                try:
+                    os.remove(os.path.join(self.directory, f"{segment.name}.{part}.npy"))
+                except OSError:
+                    pass
+
+    def add(self, ids: list, texts: list, sessions: list = None):
+        """
+        Indexes chunks under their vector store ids, optionally tagged with their session ids.
+        Ids already in the delta are ignored; ids already committed are dropped on commit.
+        """
+        with self._lock:
+            for doc_id, text, session_id in zip(ids, texts, sessions or [None] * len(ids)):
+                tokens = tokenize(text)
+                if self._delta.add(doc_id, tokens, session_id):
+                    self._n_docs += 1
+                    self._total_len += len(tokens)
+            if len(self._delta) >= self.segment_size:
+                self.commit()
+
+    def commit(self):
+        """Writes the delta (minus chunks other processes committed meanwhile) as a new segment and merges segments beyond max_segments."""
+        with self._lock, self._file_lock():
+            self._refresh()
+            if len(self._delta):
+                doc_ids, *columns = self._delta.columns(skip=self._committed_ids())
+                if doc_ids:
+                    self._segments.append(self._write_segment(doc_ids, *columns))
+                self._delta = _Delta()
+            if len(self._segments) > self.max_segments:
+                self._merge()
+            self._write_manifest()
+            self._count()
+
+    def _merge(self):
+        old = self._segments
+        doc_ids, doc_lens, sessions, terms, positions, tfs = [], [], [], [], [], []
+        base = 0
+        for segment in old:
+            doc_ids.extend(segment.doc_id(i) for i in range(len(segment)))
+            sessions.extend(session.decode('utf-8') for session in segment.sessions)
+            doc_lens.append(np.asarray(segment.doc_lens))
+            terms.append(np.repeat(np.asarray(segment.terms), np.diff(segment.offsets)))
+            positions.append(np.asarray(segment.postings) + base)
+            tfs.append(np.asarray(segment.tfs))
+            base += len(segment)
+        self._segments = [self._write_segment(doc_ids, np.concatenate(doc_lens), sessions, np.concatenate(terms),
+                                              np.concatenate(positions).astype(np.int32), np.concatenate(tfs))]
+        self._write_manifest()
+        self._remove_files(old)
+        bm25logger.info(f"**BM25 Index**=> Merged {len(old)} segments ({base} chunks).")
+
+    def rebuild(self, page_size: int = 5000):
+        """Re-indexes every chunk of the vector store from scratch."""
+        with self._lock, self._file_lock():
+            self._refresh()
+            old = self._segments
+            self._segments, self._delta, self._n_docs, self._total_len = [], _Delta(), 0, 0
+            self._write_manifest()  # the commits below re-read the manifest
+            offset = 0
+            while True:
+                page = self.vector_store.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+                self.add(page['ids'], page['documents'], [(metadata or {}).get('session_id') for metadata in page['metadatas']])
+                if len(page['ids']) < page_size:
+                    break
+                offset += page_size
+            self.commit()
+            self._remove_files(old)
+        bm25logger.info(f"**BM25 Index**=> Rebuilt from the vector store ({self._n_docs} chunks).")
+
+    def _sync(self, page_size: int = 5000):
+        """Compares the store's chunk ids with the committed segments and the delta: indexes the missing chunks, rebuilds if the index holds deleted ones."""
+        self._synced = True
+        stored = self.vector_store.get(include=[])['ids']
+        if len(stored) == self._n_docs:
+            return
+        indexed = self._committed_ids() | set(self._delta.ids)
+        if not indexed <= set(stored):
+            bm25logger.info(f"**BM25 Index**=> Index holds {len(indexed - set(stored))} chunks the store no longer has; rebuilding.")
+            self.rebuild()
+            return
+        missing = [doc_id for doc_id in stored if doc_id not in indexed]
+        for start in range(0, len(missing), page_size):
+            page = self.vector_store.get(ids=missing[start:start + page_size], include=['documents', 'metadatas'])
+            self.add(page['ids'], page['documents'], [(metadata or {}).get('session_id') for metadata in page['metadatas']])
+        self.commit()
+        bm25logger.info(f"**BM25 Index**=> Indexed {len(missing)} store chunks missing from the index.")
+
+    def search(self, query: str, k: int = 15, session_id: str = None):
+        """Returns up to k (document id, BM25 score) pairs, best first, restricted to session_id's chunks if given."""
+        with self._lock:
+            if self._manifest_version() != self._manifest_seen:
+                with self._file_lock(fcntl.LOCK_SH):
+                    self._refresh()
+            if not self._synced:
+                self._sync()
+            parts = self._segments + [self._delta]
+            n_docs, avg_len = self._n_docs, self._total_len / max(self._n_docs, 1)
+            terms = {term_hash(token) for token in tokenize(query)}
+            # Postings are looked up once; document frequencies span every part
+            found = {term: [part.lookup(term) for part in parts] for term in terms}
+            hits = []
+            for i, part in enumerate(parts):
+                if not len(part):
+                    continue
+                doc_lens = np.asarray(part.lens if part is self._delta else part.doc_lens, dtype=np.float32)
+                scores = np.zeros(len(part), dtype=np.float32)
+                for term, lookups in found.items():
+                    if lookups[i] is None:
+                        continue
+                    df = sum(len(lookup[0]) for lookup in lookups if lookup is not None)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    positions, tfs = lookups[i]
+                    tfs = np.asarray(tfs, dtype=np.float32)
+                    norm = self.k1 * (1 - self.b + self.b * doc_lens[positions] / avg_len)
+                    scores[positions] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+                if session_id is not None:
+                    scores[~part.session_mask(session_id)] = 0
+                candidates = np.flatnonzero(scores)
+                if len(candidates) > k:
+                    candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+                hits.extend((float(scores[position]), part.doc_id(position)) for position in candidates)
+        hits.sort(reverse=True)
+        return [(doc_id, score) for score, doc_id in hits[:k]]
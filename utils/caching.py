@@ -0,0 +1,208 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+class _SQLiteStore:
+    """
+    Thread-safe autocommit sqlite connection shared by the disk-backed caches.
+    The file is opened (and its tables created by `_create_schema`) on first use, so building a store does no I/O.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connect_lock = threading.Lock()
+
+    def _create_schema(self, conn):
+        """Creates the tables of the store on a fresh connection."""
+
+    @property
+    def _conn(self):
+        if self._connection is None:
+            with self._connect_lock:
+                if self._connection is None:
+                    if os.path.dirname(self.path):
+                        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    self._create_schema(conn)
+                    self._connection = conn
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+class SQLiteCache(_SQLiteStore):
+    """
+    Disk-backed key/value cache with TTL expiry and LRU size eviction.
+    Values are stored as raw bytes; callers own (de)serialization.
+    Args:
+        path: sqlite file path (parent directories are created)
+        table: table name, so several caches can share one file
+        ttl: seconds an entry stays valid, None to never expire
+        max_entries: least recently used entries beyond this count are evicted
+    """
+
+    def __init__(self, path: str, table: str = 'cache', ttl: float = None, max_entries: int = 10000):
+        super().__init__(path)
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _create_schema(self, conn):
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value BLOB, created_at REAL, accessed_at REAL)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at ON {self.table} (accessed_at)")
+
+    def _expired(self, created_at: float, now: float):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key: str):
+        """Returns the cached bytes for key, or None on a miss/expired entry."""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list):
+        """Returns {key: value} for every key that is cached and fresh."""
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):  # stay under sqlite's bound-parameter limit
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, created_at FROM {self.table} WHERE key IN ({','.join('?' * len(batch))})", batch).fetchall()
+                for key, value, created_at in rows:
+                    if not self._expired(created_at, now):
+                        found[key] = value
+            missing = [key for key in keys if key not in found]  # absent or expired
+            if found:
+                self._conn.executemany(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", [(now, key) for key in found])
+            if missing:
+                self._conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in missing])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key: str, value: bytes):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, value, now, now) for key, value in items.items()])
+            self._evict()
+
+    def _evict(self):
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0, 'entries': len(self)}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+
+class PageCache(_SQLiteStore):
+    """
+    Persistent store of fetched pages keyed by URL.
+    Keeps raw HTML, converted markdown, the source reliability score and HTTP validators (ETag/Last-Modified).
+    Bodies are stored once per content hash, so identical pages served under different URLs share one row.
+    Args:
+        path: sqlite file path
+        max_age: seconds a page is served without revalidation
+        max_entries: oldest URLs beyond this count are evicted along with bodies nothing references
+    """
+
+    def __init__(self, path: str, max_age: float = 24 * 3600, max_entries: int = 20000):
+        super().__init__(path)
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _create_schema(self, conn):
+        conn.execute("""CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, content_hash TEXT, etag TEXT, last_modified TEXT,
+                        source_reliability REAL, fetched_at REAL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS pages_fetched_at ON pages (fetched_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS bodies (content_hash TEXT PRIMARY KEY, html TEXT, markdown TEXT)")
+
+    @staticmethod
+    def content_hash(html: str):
+        return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+    def get(self, url: str):
+        """Returns the cached page as a dict (with a 'fresh' flag), or None if the URL was never stored."""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT p.content_hash, p.etag, p.last_modified, p.source_reliability, p.fetched_at, b.html, b.markdown
+                   FROM pages p JOIN bodies b ON b.content_hash = p.content_hash WHERE p.url = ?""", (url,)).fetchone()
+        if row is None:
+            return None
+        content_hash, etag, last_modified, source_reliability, fetched_at, html, markdown = row
+        return {'url': url, 'content_hash': content_hash, 'etag': etag, 'last_modified': last_modified,
+                'source_reliability': source_reliability, 'fetched_at': fetched_at, 'html': html, 'markdown': markdown,
+                'fresh': time.time() - fetched_at <= self.max_age}
+
+    def markdown_for(self, content_hash: str):
+        """Markdown already converted for an identical body, if any."""
+        with self._lock:
+            row = self._conn.execute("SELECT markdown FROM bodies WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, url: str, html: str, markdown: str, source_reliability: float, etag: str = None, last_modified: str = None):
+        content_hash = self.content_hash(html)
+        with self._lock:
+            previous = self._conn.execute("SELECT content_hash FROM pages WHERE url = ?", (url,)).fetchone()
+            self._conn.execute("INSERT OR IGNORE INTO bodies (content_hash, html, markdown) VALUES (?, ?, ?)",
+                               (content_hash, html, markdown))
+            self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                               (url, content_hash, etag, last_modified, source_reliability, time.time()))
+            if previous and previous[0] != content_hash:
+                # The page changed: drop its old body unless another URL still serves it
+                self._conn.execute("DELETE FROM bodies WHERE content_hash = ? AND NOT EXISTS "
+                                   "(SELECT 1 FROM pages WHERE content_hash = ?)", (previous[0], previous[0]))
+            self._evict()
+        return content_hash
+
+    def record(self, outcome: str):
+        """Counts a lookup served from the cache ('hits'), revalidated ('revalidated') or fetched ('misses')."""
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def touch(self, url: str):
+        """Marks a page as fresh again after a 304 Not Modified."""
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url))
+
+    def _evict(self):
+        deleted = self._conn.execute(
+            "DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)).rowcount
+        if deleted:
+            self._conn.execute("DELETE FROM bodies WHERE content_hash NOT IN (SELECT content_hash FROM pages)")
+
+    def stats(self):
+        with self._lock:
+            pages, bodies = self._conn.execute("SELECT (SELECT COUNT(*) FROM pages), (SELECT COUNT(*) FROM bodies)").fetchone()
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses, 'pages': pages, 'unique_bodies': bodies}
@@ -0,0 +1,278 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import zlib
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (WRITES_IDX_MAP, BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata,
+                                       CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata, writes_sort_key)
+import config
+from .caching import _SQLiteStore
+import logging
+checkpointlogger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/test.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+checkpointlogger.addHandler(handler)
+checkpointlogger.setLevel(logging.INFO)
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver[str], _SQLiteStore):
+    """
+    Disk-backed LangGraph checkpointer, a drop-in replacement for InMemorySaver.
+    A checkpoint row only holds the channel versions; channel values are stored as zlib-compressed blobs keyed by
+    (channel, version) and written only for the channels that changed in that step, so a step that leaves `contexts`
+    or `sources_data` untouched does not store them again.
+    Only the last `keep_last` checkpoints of each thread (and subgraph namespace) are kept; blobs they no longer
+    reference are deleted with them. Subgraph namespaces are per task, so once the root namespace has checkpointed
+    after a task, the task's namespace is finished and only the latest finished one is kept.
+    Threads idle for longer than `thread_ttl` are deleted entirely.
+    Args:
+        path: sqlite file path
+        keep_last: checkpoints kept per thread and namespace, None keeps every checkpoint (and every namespace)
+        thread_ttl: seconds since its last checkpoint after which a thread is deleted, None to keep threads forever
+        compression_level: zlib level of the stored values (0 stores them uncompressed)
+        serde: serializer, LangGraph's default when None
+    """
+    def __init__(self, path: str = os.path.join(config.CACHE_DIR, 'checkpoints.sqlite'), keep_last: int = config.CHECKPOINT_KEEP_LAST,
+                 thread_ttl: float = config.CHECKPOINT_THREAD_TTL, compression_level: int = config.CHECKPOINT_COMPRESSION_LEVEL,
+                 serde=None):
+        BaseCheckpointSaver.__init__(self, serde=serde)
+        _SQLiteStore.__init__(self, path)
+        self._lock = threading.RLock()  # put() prunes while holding it
+        self.keep_last = keep_last
+        self.thread_ttl = thread_ttl
+        self.compression_level = compression_level
+        self._last_expiry = 0.0
+
+    def _create_schema(self, conn):
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS checkpoints (thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT,
+                        parent_id TEXT, type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB, created_at REAL,
+                        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))""")
+        conn.execute("CREATE INDEX IF NOT EXISTS checkpoints_created_at ON checkpoints (created_at)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS blobs (thread_id TEXT, checkpoint_ns TEXT, channel TEXT, version TEXT,
+                        type TEXT, value BLOB, PRIMARY KEY (thread_id, checkpoint_ns, channel, version))""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS writes (thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, task_id TEXT,
+                        idx INTEGER, channel TEXT, type TEXT, value BLOB, task_path TEXT,
+                        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))""")
+
+    def _dumps(self, value):
+        type_, data = self.serde.dumps_typed(value)
+        return type_, zlib.compress(data, self.compression_level)
+
+    def _loads(self, type_: str, data: bytes):
+        return self.serde.loads_typed((type_, zlib.decompress(data)))
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions):
+        values = {}
+        for channel, version in versions.items():
+            row = self._conn.execute("SELECT type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                                     (thread_id, checkpoint_ns, channel, str(version))).fetchone()
+            if row is not None and row[0] != 'empty':
+                values[channel] = self._loads(*row)
+        return values
+
+    def _pending_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        rows = self._conn.execute("""SELECT task_id, idx, channel, type, value, task_path FROM writes
+                                     WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?""",
+                                  (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+        rows.sort(key=lambda row: writes_sort_key(row[5], row[0], row[1]))
+        return [(task_id, channel, self._loads(type_, value)) for task_id, _, channel, type_, value, _ in rows]
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, parent_id: str, type_: str, checkpoint: bytes,
+               metadata_type: str, metadata: bytes):
+        checkpoint = self._loads(type_, checkpoint)
+        parent_config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns, 'checkpoint_id': parent_id}}
+        return CheckpointTuple(
+            config={'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns, 'checkpoint_id': checkpoint_id}},
+            checkpoint={**checkpoint, 'channel_values': self._load_blobs(thread_id, checkpoint_ns, checkpoint['channel_versions'])},
+            metadata=self._loads(metadata_type, metadata),
+            parent_config=parent_config if parent_id else None,
+            pending_writes=self._pending_writes(thread_id, checkpoint_ns, checkpoint_id))
+
+    def get_tuple(self, config: RunnableConfig):
+        """Returns the checkpoint named by config, or the thread's latest one when config has no checkpoint_id."""
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        query = "SELECT checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        params = [thread_id, checkpoint_ns]
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        with self._lock:
+            row = self._conn.execute(query + " ORDER BY checkpoint_id DESC LIMIT 1", params).fetchone()
+            return None if row is None else self._tuple(thread_id, checkpoint_ns, *row)
+
+    def list(self, config: RunnableConfig = None, *, filter: dict = None, before: RunnableConfig = None, limit: int = None):
+        """Yields checkpoints newest first, optionally restricted to a thread/namespace, metadata values and an upper id."""
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata "
+                 "FROM checkpoints WHERE 1 = 1")
+        params = []
+        if config:
+            query += " AND thread_id = ?"
+            params.append(config['configurable']['thread_id'])
+            if (checkpoint_ns := config['configurable'].get('checkpoint_ns')) is not None:
+                query += " AND checkpoint_ns = ?"
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < ?"
+            params.append(before_id)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC", params).fetchall()
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if filter:
+                metadata = self._loads(row[6], row[7])
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            if limit is not None:
+                limit -= 1
+            with self._lock:
+                yield self._tuple(*row)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions):
+        """Stores a checkpoint plus the values of the channels in new_versions, then prunes the thread's old checkpoints."""
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable']['checkpoint_ns']
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop('channel_values')
+        blobs = [(thread_id, checkpoint_ns, channel, str(version),
+                  *(self._dumps(values[channel]) if channel in values else ('empty', b'')))
+                 for channel, version in new_versions.items()]
+        type_, data = self._dumps(checkpoint)
+        metadata_type, metadata = self._dumps(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+                self._conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (thread_id, checkpoint_ns, checkpoint['id'], config['configurable'].get('checkpoint_id'),
+                                    type_, data, metadata_type, metadata, time.time()))
+                self._prune(thread_id, checkpoint_ns)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if self.thread_ttl is not None and time.time() - self._last_expiry > min(self.thread_ttl, 3600):
+                self.delete_expired_threads()
+        return {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns, 'checkpoint_id': checkpoint['id']}}
+
+    def put_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = ''):
+        """Stores the pending writes of a task against the checkpoint named by config."""
+        thread_id = config['configurable']['thread_id']
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        checkpoint_id = config['configurable']['checkpoint_id']
+        rows = [(thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel,
+                 *self._dumps(value), task_path) for idx, (channel, value) in enumerate(writes)]
+        with self._lock:
+            if self.keep_last is not None and self._pruned(thread_id, checkpoint_ns, checkpoint_id):
+                return  # async runs save writes in the background; the checkpoint was pruned before they arrived
+            # Special writes (errors, interrupts) replace earlier ones; regular writes are kept once
+            self._conn.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [row for row in rows if row[4] < 0])
+            self._conn.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [row for row in rows if row[4] >= 0])
+
+    def _pruned(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        """True if checkpoint_id is older than every checkpoint kept in its namespace, or its namespace finished and was deleted."""
+        oldest = self._conn.execute("SELECT MIN(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                                    (thread_id, checkpoint_ns)).fetchone()[0]
+        if oldest is not None or checkpoint_ns == '':
+            return oldest is not None and checkpoint_id < oldest
+        latest = self._conn.execute("SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''",
+                                    (thread_id,)).fetchone()[0]
+        return latest is not None and checkpoint_id < latest
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        if self.keep_last is None:
+            return
+        self._prune_namespace(thread_id, checkpoint_ns)
+        if checkpoint_ns == '':
+            self._prune_finished_namespaces(thread_id)
+
+    def _prune_finished_namespaces(self, thread_id: str):
+        """Deletes the subgraph namespaces of a thread that ended before its latest root checkpoint, except the most recent one."""
+        latest = self._conn.execute("SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ''",
+                                    (thread_id,)).fetchone()[0]
+        finished = [row[0] for row in self._conn.execute(
+            """SELECT checkpoint_ns FROM checkpoints WHERE thread_id = ? AND checkpoint_ns != ''
+               GROUP BY checkpoint_ns HAVING MAX(checkpoint_id) < ? ORDER BY MAX(checkpoint_id) DESC LIMIT -1 OFFSET 1""",
+            (thread_id, latest))]
+        for table in ('checkpoints', 'writes', 'blobs'):
+            self._conn.executemany(f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ?",
+                                   [(thread_id, checkpoint_ns) for checkpoint_ns in finished])
+
+    def _prune_namespace(self, thread_id: str, checkpoint_ns: str):
+        key = (thread_id, checkpoint_ns)
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (*key, self.keep_last))]
+        if not stale:
+            return
+        self._conn.executemany("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                               [(*key, checkpoint_id) for checkpoint_id in stale])
+        self._conn.executemany("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                               [(*key, checkpoint_id) for checkpoint_id in stale])
+        # Blob versions are shared between checkpoints; keep every version a remaining checkpoint points to
+        referenced = set()
+        for type_, checkpoint in self._conn.execute("SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?", key):
+            referenced.update((channel, str(version)) for channel, version in self._loads(type_, checkpoint)['channel_versions'].items())
+        unreferenced = [(*key, channel, version) for channel, version in self._conn.execute(
+            "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?", key) if (channel, version) not in referenced]
+        self._conn.executemany("DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", unreferenced)
+
+    def delete_thread(self, thread_id: str):
+        """Deletes every checkpoint, write and blob of a thread."""
+        with self._lock:
+            for table in ('checkpoints', 'writes', 'blobs'):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    def delete_expired_threads(self):
+        """Deletes the threads whose latest checkpoint is older than thread_ttl."""
+        with self._lock:
+            self._last_expiry = time.time()
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?", (self._last_expiry - self.thread_ttl,))]
+            for thread_id in expired:
+                self.delete_thread(thread_id)
+        if expired:
+            checkpointlogger.info(f"**Checkpointer**=> Deleted {len(expired)} idle threads.")
+
+    def stats(self):
+        with self._lock:
+            threads, checkpoints, blobs, writes = self._conn.execute(
+                """SELECT (SELECT COUNT(DISTINCT thread_id) FROM checkpoints), (SELECT COUNT(*) FROM checkpoints),
+                          (SELECT COUNT(*) FROM blobs), (SELECT COUNT(*) FROM writes)""").fetchone()
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return {'threads': threads, 'checkpoints': checkpoints, 'blobs': blobs, 'writes': writes, 'db_bytes': page_count * page_size}
+
+    # sqlite calls block, so the async variants run them off the event loop
+    async def aget_tuple(self, config: RunnableConfig):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: RunnableConfig = None, *, filter: dict = None, before: RunnableConfig = None, limit: int = None):
+        for item in await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit))):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes, task_id: str, task_path: str = ''):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str):
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: str, channel=None):
+        # Same version format as InMemorySaver: zero-padded counter plus a random tiebreaker
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split('.')[0])
+        return f"{current_v + 1:032}.{random.random():016}"
@@ -0,0 +1,232 @@
+import asyncio
+import atexit
+import re
+import threading
+import config
+import logging
+# Child of the web_processing logger, whose handler writes logs/web_processing.log
+fetchlogger = logging.getLogger('utils.web_processing.fetchers')
+fetchlogger.setLevel(logging.DEBUG)
+
+class BackgroundEventLoop:
+    """
+    Event loop running on a daemon thread.
+    Long-lived async resources (browser, HTTP connection pools) are bound to the loop that created them,
+    so they live here and callers on any other loop (or a fresh asyncio.run) reach them through `run`.
+    """
+    def __init__(self, name: str = 'web-fetch-loop'):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """Schedules coro on the background loop and returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run(self, coro):
+        """Awaits coro on the background loop from the caller's loop."""
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stop(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = None
+            self._thread = None
+
+background_loop = BackgroundEventLoop()
+
+class BrowserPool:
+    """
+    Process-wide headless Chromium shared by all url_loader calls.
+    The browser and its contexts are launched once and reused; each fetch opens a page in the next context.
+    Args:
+        n_contexts: browser contexts kept open and used round-robin
+        page_concurrency: pages open at once per context
+        max_inflight_pages: cap on pages open across the whole pool
+        page_timeout: seconds allowed for a single page to load and render
+    """
+    def __init__(self, n_contexts: int = config.BROWSER_CONTEXTS, page_concurrency: int = config.BROWSER_PAGE_CONCURRENCY,
+                 max_inflight_pages: int = config.BROWSER_MAX_INFLIGHT_PAGES, page_timeout: float = config.BROWSER_PAGE_TIMEOUT,
+                 user_agent: str = config.SCRAPER_USER_AGENT, headless: bool = True, loop: BackgroundEventLoop = background_loop):
+        self.n_contexts = n_contexts
+        self.page_concurrency = page_concurrency
+        self.max_inflight_pages = max_inflight_pages
+        self.page_timeout = page_timeout
+        self.user_agent = user_agent
+        self.headless = headless
+        self._loop = loop
+        self._playwright = None
+        self._browser = None
+        self._contexts = []
+        self._next_context = 0
+        self._counter_lock = threading.Lock()
+        self._start_lock = None
+        self._inflight = None
+
+    async def _ensure_started(self):
+        # Runs on the background loop only
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            await self._close()
+            from playwright.async_api import async_playwright
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=self.headless)
+            self._contexts = []
+            for _ in range(self.n_contexts):
+                context = await self._browser.new_context(user_agent=self.user_agent)
+                self._contexts.append((context, asyncio.Semaphore(self.page_concurrency)))
+            self._inflight = asyncio.Semaphore(self.max_inflight_pages)
+            fetchlogger.info(f"**Browser Pool**=> Launched Chromium with {self.n_contexts} contexts.")
+
+    async def _render(self, context, url: str):
+        page = await context.new_page()
+        try:
+            await page.goto(url, timeout=self.page_timeout * 1000)
+            return await page.content()
+        finally:
+            await page.close()
+
+    async def _fetch(self, url: str):
+        await self._ensure_started()
+        async with self._inflight:
+            with self._counter_lock:
+                context, slots = self._contexts[self._next_context % len(self._contexts)]
+                self._next_context += 1
+            async with slots:
+                try:
+                    return await asyncio.wait_for(self._render(context, url), timeout=self.page_timeout)
+                except Exception as e:
+                    fetchlogger.debug(f"**Browser Pool**=> Failed loading {url}: {e}")
+                    return None
+
+    async def fetch(self, url: str):
+        """Returns the rendered HTML of url, or None if it failed or timed out."""
+        return await self._loop.run(self._fetch(url))
+
+    async def fetch_many(self, urls: list):
+        """Returns {url: html} for every url that rendered successfully."""
+        pages = await asyncio.gather(*(self.fetch(url) for url in urls))
+        return {url: html for url, html in zip(urls, pages) if html}
+
+    async def _close(self):
+        for context, _ in self._contexts:
+            try:
+                await context.close()
+            except Exception:
+                pass
+        self._contexts = []
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def close(self):
+        """Closes the browser; the next fetch relaunches it."""
+        if self._browser is not None or self._playwright is not None:
+            self._loop.submit(self._close()).result(timeout=30)
+
+browser_pool = BrowserPool()
+
+class HttpFetcher:
+    """
+    Pooled async HTTP client for static pages: keep-alive connections, gzip, and HTTP/2 when `h2` is installed.
+    The client lives on the background loop so its connection pool survives across calls.
+    """
+    def __init__(self, timeout: float = config.HTTP_FETCH_TIMEOUT, max_connections: int = config.HTTP_MAX_CONNECTIONS,
+                 user_agent: str = config.SCRAPER_USER_AGENT, loop: BackgroundEventLoop = background_loop):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.user_agent = user_agent
+        self._loop = loop
+        self._client = None
+
+    def _get_client(self):
+        # Runs on the background loop only
+        if self._client is None or self._client.is_closed:
+            import httpx
+            try:
+                import h2  # noqa: F401
+                http2 = True
+            except ImportError:
+                http2 = False
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                follow_redirects=True,
+                timeout=self.timeout,
+                headers={'User-Agent': self.user_agent, 'Accept': 'text/html,application/xhtml+xml', 'Accept-Encoding': 'gzip, deflate'},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def _fetch(self, url: str, headers: dict = None):
+        try:
+            response = await self._get_client().get(url, headers=headers)
+        except Exception as e:
+            fetchlogger.debug(f"**HTTP Fetcher**=> Failed loading {url}: {e}")
+            return None
+        return {'status': response.status_code, 'headers': dict(response.headers), 'text': response.text,
+                'http_version': response.http_version}
+
+    async def fetch(self, url: str, headers: dict = None):
+        """Returns {'status', 'headers', 'text', 'http_version'} for url, or None on a transport error."""
+        return await self._loop.run(self._fetch(url, headers))
+
+    async def _close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def close(self):
+        if self._client is not None:
+            self._loop.submit(self._close()).result(timeout=10)
+
+http_fetcher = HttpFetcher()
+
+_HIDDEN_BLOCKS = re.compile(r'<(script|style|noscript|template|svg)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAGS = re.compile(r'<[^>]+>')
+_NOSCRIPT_WARNING = re.compile(r'<noscript\b[^>]*>[^<]*(enable|requires?|turn on)[^<]*javascript', re.IGNORECASE)
+_EMPTY_APP_ROOT = re.compile(r'<div[^>]+id=["\'](root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>', re.IGNORECASE)
+
+def looks_like_js_shell(html: str, min_text_chars: int = config.JS_SHELL_MIN_TEXT_CHARS):
+    """
+    Heuristic for pages whose content is rendered client-side.
+    True when the visible text is tiny, or an empty SPA mount point / "enable JavaScript" notice comes with little text.
+    """
+    visible_text = ' '.join(_TAGS.sub(' ', _HIDDEN_BLOCKS.sub(' ', html)).split())
+    if len(visible_text) < min_text_chars:
+        return True
+    if (_EMPTY_APP_ROOT.search(html) or _NOSCRIPT_WARNING.search(html)) and len(visible_text) < 4 * min_text_chars:
+        return True
+    return False
+
+def shutdown_fetchers():
+    """Releases the shared browser and HTTP client and stops the background fetch loop."""
+    for fetcher in (http_fetcher, browser_pool):
+        try:
+            fetcher.close()
+        except Exception as e:
+            fetchlogger.debug(f"**Fetchers**=> Error during shutdown: {e}")
+    background_loop.stop()
+
+atexit.register(shutdown_fetchers)
@@ -0,0 +1,103 @@
+"""
+Shared model server.
+
+Loads spaCy, KeyBERT and the reranker once and serves them over a Unix socket to every worker process
+configured with the same MODEL_SERVER_SOCKET, so workers do not each hold a copy of the weights.
+The server and its workers must share the same secret in MODEL_SERVER_AUTHKEY; neither starts without it.
+
+Usage (from the repository root):
+    MODEL_SERVER_AUTHKEY=... python -m utils.model_server --socket /tmp/ai-agent-models.sock
+"""
+import argparse
+import os
+import threading
+from multiprocessing.connection import Listener, AuthenticationError
+import config
+from .models import registry, model_server_authkey
+import logging
+serverlogger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/test.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+serverlogger.addHandler(handler)
+serverlogger.setLevel(logging.INFO)
+
+SERVED_MODELS = ['nlp', 'kw_model', 'reranker']
+
+class ModelServer:
+    """
+    Serves the text_processing/retrieval model calls over a Unix socket, one thread per client connection.
+    Each request is a (method, args) tuple answered with ('ok', result) or ('error', message).
+    Calls to the same model are serialized; different models run concurrently.
+    Args:
+        address: Unix socket path (replaced if it exists, created with owner-only permissions)
+        authkey: shared secret clients must present
+    """
+    def __init__(self, address: str, authkey: bytes = None):
+        from . import text_processing, retrieval
+        self.address = address
+        self.authkey = authkey or model_server_authkey()
+        self.methods = {
+            'entities': ('nlp', text_processing.extract_entities),
+            'term_vectors': ('nlp', text_processing.term_vectors),
+            'token_counts': ('nlp', text_processing.token_counts),
+            'keyphrases': ('kw_model', text_processing.keyphrases),
+            'rerank_scores': ('reranker', lambda pairs: retrieval.reranker.score(pairs)),
+            'ready': (None, lambda: registry.is_ready(SERVED_MODELS)),
+        }
+        self._model_locks = {name: threading.Lock() for name in SERVED_MODELS}
+
+    def _dispatch(self, method: str, args: tuple):
+        model_name, function = self.methods[method]
+        if model_name is None:
+            return function(*args)
+        with self._model_locks[model_name]:
+            return function(*args)
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = ('ok', self._dispatch(method, args))
+                except Exception as e:
+                    serverlogger.error(f"**Model Server**=> {method} failed: {e}")
+                    response = ('error', repr(e))
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    return
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # Create the socket owner-only from the start; a chmod after bind leaves a window where others can connect
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        with listener:
+            serverlogger.info(f"**Model Server**=> Listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except AuthenticationError as e:
+                    serverlogger.warning(f"**Model Server**=> Rejected a client: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=config.MODEL_SERVER_SOCKET or '/tmp/ai-agent-models.sock')
+    args = parser.parse_args()
+    config.MODEL_SERVER_SOCKET = None  # this process runs the models itself
+    server = ModelServer(args.socket)
+    registry.warmup(SERVED_MODELS)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,271 @@
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client
+import numpy as np
 from langchain_aws import ChatBedrock, BedrockEmbeddings
+from langchain_core.embeddings import Embeddings
+from langchain_core.rate_limiters import InMemoryRateLimiter
 import config
+from .caching import SQLiteCache
+import logging
+modellogger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/test.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+modellogger.addHandler(handler)
+modellogger.setLevel(logging.INFO)
+
+def model_server_authkey():
+    """Shared secret between the model server and its clients (MODEL_SERVER_AUTHKEY env var)."""
+    authkey = os.getenv('MODEL_SERVER_AUTHKEY')
+    if not authkey:
+        raise RuntimeError("MODEL_SERVER_AUTHKEY must be set to use the model server, e.g. to the output of "
+                           "python -c 'import secrets; print(secrets.token_hex(32))'")
+    return authkey.encode('utf-8')
+
+class ModelClient:
+    """
+    Client of a ModelServer sidecar (see utils/model_server.py) over a Unix socket.
+    Each calling thread keeps its own connection, so pipeline workers do not serialize on one socket.
+    """
+    def __init__(self, address: str, authkey: bytes = None, timeout: float = config.MODEL_SERVER_TIMEOUT):
+        self.address = address
+        self.authkey = authkey or model_server_authkey()
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed:
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def call(self, method: str, *args):
+        """Runs method(*args) on the server and returns its result; reconnects once if the server restarted."""
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((method, args))
+                if not conn.poll(self.timeout):
+                    conn.close()  # a late answer must not be read as the reply to the next call
+                    raise TimeoutError(f"Model server did not answer {method} within {self.timeout}s")
+                status, result = conn.recv()
+                break
+            except TimeoutError:
+                raise
+            except (EOFError, OSError) as e:
+                self._local.conn = None
+                if attempt:
+                    raise ConnectionError(f"Model server at {self.address} is unavailable: {e}")
+        if status == 'error':
+            raise RuntimeError(f"Model server failed on {method}: {result}")
+        return result
+
+    def is_ready(self):
+        try:
+            return bool(self.call('ready'))
+        except Exception:
+            return False
+
+_model_client = None
+
+def get_model_client():
+    """ModelClient for config.MODEL_SERVER_SOCKET, or None when models run in this process."""
+    global _model_client
+    if not config.MODEL_SERVER_SOCKET:
+        return None
+    if _model_client is None or _model_client.address != config.MODEL_SERVER_SOCKET:
+        _model_client = ModelClient(config.MODEL_SERVER_SOCKET)
+    return _model_client
+
+class LazyModel:
+    """Stand-in returned by ModelRegistry.register: the first attribute access or call loads the model."""
+    __slots__ = ('_registry', '_name')
+
+    def __init__(self, registry, name: str):
+        object.__setattr__(self, '_registry', registry)
+        object.__setattr__(self, '_name', name)
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._registry.get(self._name), attr, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._registry.get(self._name)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyModel({self._name!r}, ready={self._registry.is_ready([self._name])})"
+
+class ModelRegistry:
+    """
+    Process-wide models (spaCy, KeyBERT, reranker, Bedrock clients, vector store and its indexes) loaded on first use
+    instead of at import, so the graphs can be imported and served before the heavy models are in memory.
+    Modules keep their usual globals: `register` returns a LazyModel that loads the model when it is first used.
+    `warmup` loads models on a background thread ahead of the first request; `is_ready`/`status` report progress.
+    Models registered with served=True are used through the model server when MODEL_SERVER_SOCKET is set,
+    so warmup skips them and readiness asks the server instead.
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._served = set()
+        self._models = {}
+        self._locks = {}
+        self._load_seconds = {}
+        self._errors = {}
+
+    def register(self, name: str, loader, served: bool = False):
+        """Registers loader() as the way to build model `name` and returns its LazyModel."""
+        self._loaders[name] = loader
+        if served:
+            self._served.add(name)
+        self._locks[name] = threading.Lock()
+        return LazyModel(self, name)
+
+    def get(self, name: str):
+        """Returns model `name`, loading it (once, even under concurrent callers) if needed."""
+        if name in self._models:
+            return self._models[name]
+        with self._locks[name]:
+            if name not in self._models:
+                started = time.perf_counter()
+                try:
+                    self._models[name] = self._loaders[name]()
+                except Exception as e:
+                    self._errors[name] = repr(e)
+                    raise
+                self._errors.pop(name, None)
+                self._load_seconds[name] = round(time.perf_counter() - started, 3)
+                modellogger.info(f"**Model Registry**=> Loaded {name} in {self._load_seconds[name]}s")
+        return self._models[name]
+
+    def local_models(self):
+        """Models this process loads itself."""
+        return [name for name in self._loaders if get_model_client() is None or name not in self._served]
+
+    def warmup(self, names: list = None):
+        """Loads the given (default: all local) models one after another on a daemon thread and returns the thread."""
+        def load_all():
+            for name in names or self.local_models():
+                try:
+                    self.get(name)
+                except Exception as e:
+                    modellogger.error(f"**Model Registry**=> Warmup of {name} failed: {e}")
+        thread = threading.Thread(target=load_all, name='model-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self, names: list = None):
+        """Readiness probe: True once every given (default: local) model is loaded and the model server, if used, is ready."""
+        if names is None and get_model_client() is not None and not get_model_client().is_ready():
+            return False
+        return all(name in self._models for name in names or self.local_models())
+
+    def status(self):
+        return {name: {'ready': name in self._models, 'load_seconds': self._load_seconds.get(name), 'error': self._errors.get(name)}
+                for name in self._loaders}
+
+registry = ModelRegistry()
+
+class ConcurrentEmbeddings(Embeddings):
+    """
+    Embeds documents with parallel, rate-limited requests.
+    Bedrock Titan embeds one text per request and BedrockEmbeddings sends them one after another;
+    this wrapper fans a batch out over a thread pool while keeping under the request rate limit.
+    """
+    def __init__(self, embeddings: Embeddings, max_concurrency: int = config.EMBED_MAX_CONCURRENCY,
+                 requests_per_second: float = config.EMBED_MAX_REQUESTS_PER_SECOND):
+        self.embeddings = embeddings
+        self.rate_limiter = InMemoryRateLimiter(requests_per_second=requests_per_second, check_every_n_seconds=0.05,
+                                                max_bucket_size=max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='embeddings')
+
+    def _embed_one(self, text: str):
+        self.rate_limiter.acquire()
+        return self.embeddings.embed_documents([text])[0]
+
+    def embed_documents(self, texts: list):
+        if len(texts) <= 1:
+            return [self._embed_one(text) for text in texts]
+        return list(self._executor.map(self._embed_one, texts))
+
+    def _embed_query(self, text: str):
+        self.rate_limiter.acquire()
+        return self.embeddings.embed_query(text)
+
+    def embed_query(self, text: str):
+        return self._embed_query(text)
+
+    def embed_queries(self, texts: list):
+        """Embeds several retrieval queries in parallel, each with the model's query embedding."""
+        if len(texts) <= 1:
+            return [self._embed_query(text) for text in texts]
+        return list(self._executor.map(self._embed_query, texts))
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent embedding cache in front of another Embeddings model.
+    Vectors are stored as float32 blobs keyed by model id + text hash, so chunk texts and retrieval queries
+    are embedded once across iterations, sessions and reruns; only cache misses reach the model.
+    Query keys carry their own prefix, since a model may embed a query differently from a document.
+    """
+    def __init__(self, embeddings: Embeddings, model_id: str = config.EMBED_MODEL_ID,
+                 path: str = os.path.join(config.CACHE_DIR, 'embedding_cache.sqlite'), max_entries: int = config.EMBED_CACHE_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = SQLiteCache(path, table='embeddings', max_entries=max_entries)
+
+    def _key(self, text: str, kind: str = ''):
+        return f"{self.model_id}:{kind}{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def embed_documents(self, texts: list):
+        keys = [self._key(text) for text in texts]
+        cached = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = {key: np.asarray(vector, dtype=np.float32).tobytes() for key, vector in zip(missing, vectors)}
+            self.cache.set_many(new_entries)
+            cached.update(new_entries)
+        return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+    def embed_query(self, text: str):
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: list):
+        """Query embeddings for several retrieval queries; the misses are embedded together (in parallel when the model supports it)."""
+        keys = [self._key(text, 'query:') for text in texts]
+        cached = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            if hasattr(self.embeddings, 'embed_queries'):
+                vectors = self.embeddings.embed_queries(list(missing.values()))
+            else:
+                vectors = [self.embeddings.embed_query(text) for text in missing.values()]
+            new_entries = {key: np.asarray(vector, dtype=np.float32).tobytes() for key, vector in zip(missing, vectors)}
+            self.cache.set_many(new_entries)
+            cached.update(new_entries)
+        return [np.frombuffer(cached[key], dtype=np.float32).tolist() for key in keys]
+
+    def stats(self):
+        return self.cache.stats()
 
 def load_embed_model():
     aws_access_key = os.getenv('AWS_ACCESS_KEY_ID') 
     aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY') 
     region = os.getenv('AWS_REGION')  
     embeddings = BedrockEmbeddings(
-        model_id="amazon.titan-embed-text-v1",
+        model_id=config.EMBED_MODEL_ID,
         region_name=region, 
         aws_access_key_id=aws_access_key, 
         aws_secret_access_key=aws_secret_key
         ) 
-    return embeddings
+    return CachedEmbeddings(ConcurrentEmbeddings(embeddings))
 def load_llm(model_id = config.LLM_MODEL_ID, region = os.getenv('AWS_REGION')):
     llm = ChatBedrock( 
     model_id=model_id,  
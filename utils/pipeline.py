@@ -0,0 +1,119 @@
+import asyncio
+import time
+import config
+from .bm25 import BM25Index
+from .storage import NearDuplicateIndex, VectorStoreWriter
+from .web_processing import iter_url_loader
+import logging
+pipelinelogger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/text_processing.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+pipelinelogger.addHandler(handler)
+pipelinelogger.setLevel(logging.DEBUG)
+
+_DONE = object()  # end-of-stream marker passed between stages
+
+class IngestionPipeline:
+    """
+    Streams pages through fetch -> split -> filter -> store.
+    Stages are connected by bounded queues, so a page is split as soon as it is fetched and a slow stage
+    applies backpressure to the ones before it instead of buffering every page in memory.
+    Args:
+        text_splitter: AdvancedMarkdownSplitter used on each page
+        content_filter: ContentFilter selecting the relevant chunks
+        vector_store: store receiving the accepted chunks through a VectorStoreWriter
+        dedup_index: NearDuplicateIndex of vector_store, used to skip near-duplicate chunks
+        lexical_index: BM25Index of vector_store, updated with the stored chunks
+        split_workers / filter_workers: concurrent workers per CPU-bound stage
+        queue_size: capacity of each inter-stage queue
+        store_batch_size: chunks per bulk vector store write (see VectorStoreWriter)
+    """
+    def __init__(self, text_splitter, content_filter, vector_store, dedup_index: NearDuplicateIndex = None, lexical_index: BM25Index = None,
+                 split_workers: int = config.PIPELINE_SPLIT_WORKERS, filter_workers: int = config.PIPELINE_FILTER_WORKERS,
+                 queue_size: int = config.PIPELINE_QUEUE_SIZE, store_batch_size: int = config.VECTOR_WRITE_BATCH_SIZE):
+        self.text_splitter = text_splitter
+        self.content_filter = content_filter
+        self.vector_store = vector_store
+        self.dedup_index = dedup_index
+        self.lexical_index = lexical_index
+        self.split_workers = split_workers
+        self.filter_workers = filter_workers
+        self.queue_size = queue_size
+        self.store_batch_size = store_batch_size
+
+    async def _fetch_stage(self, pages: dict, split_queue: asyncio.Queue, loaded: dict):
+        async for url, output in iter_url_loader(list(pages)):
+            metadata = {**pages[url], **output['metadata']}
+            loaded[url] = metadata
+            await split_queue.put((output['page_content'], metadata))
+        for _ in range(self.split_workers):
+            await split_queue.put(_DONE)
+
+    async def _split_stage(self, split_queue: asyncio.Queue, filter_queue: asyncio.Queue):
+        while (item := await split_queue.get()) is not _DONE:
+            page_content, metadata = item
+            try:
+                content = await asyncio.to_thread(self.text_splitter.split_text, page_content)
+            except Exception as e:
+                pipelinelogger.error(f"**Ingestion Pipeline**=> Failed to split {metadata.get('source')}: {e}")
+                continue
+            await filter_queue.put((content, metadata))
+
+    async def _filter_stage(self, filter_queue: asyncio.Queue, store_queue: asyncio.Queue):
+        while (item := await filter_queue.get()) is not _DONE:
+            content, metadata = item
+            try:
+                texts, metadatas = await asyncio.to_thread(self.content_filter.select_relevant, content, metadata)
+            except Exception as e:
+                pipelinelogger.error(f"**Ingestion Pipeline**=> Failed to filter {metadata.get('source')}: {e}")
+                continue
+            if texts:
+                await store_queue.put((texts, metadatas))
+
+    async def _store_stage(self, store_queue: asyncio.Queue, writer: VectorStoreWriter):
+        try:
+            while (item := await store_queue.get()) is not _DONE:
+                texts, metadatas = item
+                await writer.add(texts, metadatas)
+        finally:
+            await writer.close()
+
+    async def run(self, pages: dict):
+        """
+        Loads, splits, filters and stores the given pages.
+        pages: {url: base metadata merged into every chunk of that page}
+        Returns {url: merged page metadata} for the pages that were loaded.
+        """
+        started = time.perf_counter()
+        split_queue = asyncio.Queue(self.queue_size)
+        filter_queue = asyncio.Queue(self.queue_size)
+        store_queue = asyncio.Queue(self.queue_size)
+        loaded = {}
+        writer = VectorStoreWriter(self.vector_store, dedup_index=self.dedup_index, lexical_index=self.lexical_index,
+                                   batch_size=self.store_batch_size)
+
+        async def run_stage(workers: list, next_queue: asyncio.Queue, n_next: int):
+            await asyncio.gather(*workers)
+            for _ in range(n_next):
+                await next_queue.put(_DONE)
+
+        tasks = [
+            asyncio.create_task(self._fetch_stage(pages, split_queue, loaded)),
+            asyncio.create_task(run_stage([self._split_stage(split_queue, filter_queue) for _ in range(self.split_workers)],
+                                          filter_queue, self.filter_workers)),
+            asyncio.create_task(run_stage([self._filter_stage(filter_queue, store_queue) for _ in range(self.filter_workers)],
+                                          store_queue, 1)),
+            asyncio.create_task(self._store_stage(store_queue, writer)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # The other stages would stay blocked on their bounded queues
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        pipelinelogger.info(f"**Ingestion Pipeline**=> {len(loaded)}/{len(pages)} pages loaded in {time.perf_counter() - started:.2f}s. "
+                            f"Writer: {writer.stats}")
+        return loaded
@@ -1,7 +1,12 @@
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
-import torch
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+from collections import OrderedDict
 from schemas import DBQueryPlan
 import config
+from .models import registry, get_model_client
 import logging
 retrievallogger = logging.getLogger(__name__)
 handler = logging.FileHandler('logs/retrieval.log', encoding='utf-8')
@@ -10,26 +15,256 @@ handler.setFormatter(formatter)
 retrievallogger.addHandler(handler)
 retrievallogger.setLevel(logging.DEBUG)
 
-reranker_tokenizer = AutoTokenizer.from_pretrained(config.RERANK_MODEL_NAME)
-reranker_model = AutoModelForSequenceClassification.from_pretrained(config.RERANK_MODEL_NAME)
-reranker_model.eval()
+def doc_key(doc):
+    """Identity of a retrieved chunk: its chunk_id, or a hash of its text for chunks stored without one."""
+    return doc.metadata.get('chunk_id') or hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+
+class RerankScoreCache:
+    """
+    In-memory LRU/TTL cache of reranker logits keyed by (normalized query, chunk id).
+    Chunks without a chunk_id (written before deterministic ids) are keyed by a hash of their text.
+    """
+    def __init__(self, max_size: int = config.RERANK_CACHE_SIZE, ttl: float = config.RERANK_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._scores = OrderedDict()  # key -> (score, stored_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, doc):
+        return (' '.join(query.lower().split()), doc_key(doc))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._scores.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._scores[key]
+                return None
+            self._scores.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, score: float):
+        with self._lock:
+            self._scores[key] = (score, time.monotonic())
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+class Reranker:
+    """
+    CPU cross-encoder reranking engine.
+    All (query, doc) pairs are tokenized once, sorted by token length and scored in batches, so padding only
+    grows to the longest pair of each batch. Backends:
+        "torch": fp32 PyTorch (reference scores)
+        "torch-int8": PyTorch with dynamic int8 quantization of the Linear layers
+        "onnx": ONNX Runtime through optimum (`pip install optimum[onnxruntime]`)
+    Args:
+        model_name: Huggingface cross-encoder
+        backend: one of the backends above
+        batch_size: pairs per forward pass
+        num_threads: intra-op threads used by the backend
+        max_length: truncation length of a pair
+    """
+    def __init__(self, model_name: str = config.RERANK_MODEL_NAME, backend: str = config.RERANK_BACKEND,
+                 batch_size: int = config.RERANK_BATCH_SIZE, num_threads: int = config.RERANK_NUM_THREADS, max_length: int = 512):
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.max_length = max_length
+        self.score_cache = RerankScoreCache()
+        from transformers import AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = self._load_model()
+
+    def _load_model(self):
+        import torch
+        from transformers import AutoModelForSequenceClassification
+        if self.backend == 'onnx':
+            try:
+                import onnxruntime
+                from optimum.onnxruntime import ORTModelForSequenceClassification
+            except ImportError:
+                raise ImportError("The onnx reranker backend requires optimum and onnxruntime. "
+                                  "Please install them with `pip install optimum[onnxruntime]`.")
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = self.num_threads
+            return ORTModelForSequenceClassification.from_pretrained(self.model_name, export=True, session_options=session_options)
+        torch.set_num_threads(self.num_threads)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        model.eval()
+        if self.backend == 'torch-int8':
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif self.backend != 'torch':
+            raise ValueError(f"Unknown reranker backend: {self.backend}")
+        return model
+
+    def score(self, pairs: list):
+        """Returns the relevance logit of every [query, text] pair, in input order."""
+        if not pairs:
+            return []
+        import torch
+        encodings = self.tokenizer(pairs, truncation=True, max_length=self.max_length)
+        order = sorted(range(len(pairs)), key=lambda i: len(encodings['input_ids'][i]))
+        scores = [0.0] * len(pairs)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                inputs = self.tokenizer.pad({key: [values[i] for i in batch] for key, values in encodings.items()},
+                                            padding=True, return_tensors='pt')
+                logits = self.model(**inputs, return_dict=True).logits.view(-1,).float()
+                for i, logit in zip(batch, logits.tolist()):
+                    scores[i] = logit
+        return scores
+
+    def rerank_many(self, queries_docs: list):
+        """
+        Reranks the candidates of several queries in one scoring pass, reusing cached scores.
+        queries_docs: [(query, docs)]; returns [[(doc, score)] sorted by score] per query.
+        """
+        keys = [self.score_cache.key(query, doc) for query, docs in queries_docs for doc in docs]
+        cached = [self.score_cache.get(key) for key in keys]
+        # Only (query, chunk) pairs not scored recently go to the model; repeats within the call are scored once
+        to_score = {key: [query, doc.page_content] for key, score, (query, doc) in
+                    zip(keys, cached, ((query, doc) for query, docs in queries_docs for doc in docs)) if score is None}
+        new_scores = dict(zip(to_score, self.score(list(to_score.values()))))
+        for key, score in new_scores.items():
+            self.score_cache.set(key, score)
+        if keys:
+            retrievallogger.info(f"**Reranker**=> Reused {len(keys) - len(to_score)}/{len(keys)} cached scores "
+                                 f"({(len(keys) - len(to_score)) / len(keys):.0%}), scored {len(to_score)} pairs.")
+        scores = iter(score if score is not None else new_scores[key] for key, score in zip(keys, cached))
+        results = []
+        for query, docs in queries_docs:
+            scored = [(doc, next(scores)) for doc in docs]
+            retrievallogger.debug(f"Reranker scores: {[score for doc, score in scored]}")
+            results.append(sorted(scored, key=lambda item: item[1], reverse=True))
+        return results
+
+    def rerank(self, query: str, docs):
+        return self.rerank_many([(query, docs)])[0]
+
+class RemoteReranker(Reranker):
+    """Reranker scoring pairs on the model server; the score cache stays in this process."""
+    def __init__(self, client):
+        self.client = client
+        self.score_cache = RerankScoreCache()
+
+    def score(self, pairs: list):
+        return self.client.call('rerank_scores', pairs) if pairs else []
+
+def load_reranker():
+    client = get_model_client()
+    return RemoteReranker(client) if client is not None else Reranker()
+
+reranker = registry.register('reranker', load_reranker)  # loaded on first use
 def rerank_results(query: str, docs):
-    
-    pairs = [[query, doc.page_content] for doc in docs]
-    with torch.no_grad():
-        inputs = reranker_tokenizer(pairs, padding=True, truncation=True, return_tensors='pt', max_length=512)
-        scores = reranker_model(**inputs, return_dict=True).logits.view(-1,).float()
-    results = [(doc, score) for doc, score in zip(docs, scores.tolist())]
-    logging.debug(f"Reranker scores: {[score for doc, score in results]}")    
-    reranked_results = sorted(results, key=lambda item: item[1], reverse=True)
-    return reranked_results
+    return reranker.rerank(query, docs)
 
 from prompts import SystemPrompts
 from langchain.messages import HumanMessage
+from langchain_core.documents import Document
+
 class AdvancedRetriever:
-    def __init__(self, vector_store, llm):
+    """
+    Multi-query retriever: plans DB queries with the llm, runs all vector searches concurrently on one batched
+    query embedding, reranks every query's candidates in one pass and merges them without duplicates.
+    Each query contributes up to its n_results distinct chunks; the merged list is ordered by reciprocal-rank fusion.
+    In "hybrid" mode every query also runs a BM25 search on `lexical_index`; its hits are fused with the vector hits
+    by RRF into the query's k reranking candidates, so chunks matching exact figures, tickers or names are not missed.
+    With a session_id (and SESSION_SCOPED_RETRIEVAL on), both searches only see chunks stored by that session.
+    """
+    def __init__(self, vector_store, llm, lexical_index=None, session_id: str = None, mode: str = config.RETRIEVAL_MODE,
+                 k: int = config.RETRIEVAL_CANDIDATES_K, rrf_k: int = config.RRF_K):
         self.vector_store = vector_store
         self.llm = llm
+        self.lexical_index = lexical_index if mode == 'hybrid' else None
+        self.session_id = session_id if config.SESSION_SCOPED_RETRIEVAL else None
+        self.k = k
+        self.rrf_k = rrf_k
+
+    def _lexical_documents(self, lexical_hits: list):
+        """Loads the chunks behind the BM25 hits of every query in one store read."""
+        ids = list(dict.fromkeys(doc_id for hits in lexical_hits for doc_id, score in hits))
+        if not ids:
+            return {}
+        stored = self.vector_store.get(ids=ids, include=['documents', 'metadatas'])
+        return {doc_id: Document(page_content=text, metadata=metadata or {})
+                for doc_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])}
+
+    def _rrf(self, rankings: list):
+        """Reciprocal-rank fusion of ranked document lists: ({doc key: fused score}, {doc key: doc})."""
+        fused, docs = {}, {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking):
+                key = doc_key(doc)
+                docs.setdefault(key, doc)
+                fused[key] = fused.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        return fused, docs
+
+    def _fuse(self, rankings: list):
+        """The k best distinct chunks of several ranked document lists."""
+        fused, docs = self._rrf(rankings)
+        return [docs[key] for key in sorted(fused, key=lambda key: fused[key], reverse=True)[:self.k]]
+
+    def search(self, queries: list):
+        """Candidate pools (k chunks each) for all queries, searched concurrently."""
+        session_filter = {'session_id': self.session_id} if self.session_id else None
+        with ThreadPoolExecutor(max_workers=max(1, 2 * len(queries))) as pool:
+            lexical_futures = [pool.submit(self.lexical_index.search, query, self.k, self.session_id) for query in queries] if self.lexical_index is not None else []
+            # Embedded as one (parallel, cached) batch of query embeddings instead of one round-trip per search
+            embeddings = self.vector_store.embeddings
+            if hasattr(embeddings, 'embed_queries'):
+                query_embeddings = embeddings.embed_queries(queries)
+            else:
+                query_embeddings = list(pool.map(embeddings.embed_query, queries))
+            vector_futures = [pool.submit(self.vector_store.similarity_search_by_vector, embedding, k=self.k, filter=session_filter)
+                              for embedding in query_embeddings]
+            vector_pools = [future.result() for future in vector_futures]
+            lexical_hits = [future.result() for future in lexical_futures]
+        if not lexical_hits:
+            return vector_pools
+        lexical_docs = self._lexical_documents(lexical_hits)
+        retrievallogger.debug(f"**Retriever**=> BM25 hits per query: {[len(hits) for hits in lexical_hits]}")
+        return [self._fuse([vector_docs, [lexical_docs[doc_id] for doc_id, score in hits if doc_id in lexical_docs]])
+                for vector_docs, hits in zip(vector_pools, lexical_hits)]
+
+    def merge(self, q_items: list, ranked_pools: list):
+        """Deduplicates reranked pools, honours every query's n_results quota and orders chunks by RRF score."""
+        fused, docs = self._rrf([[doc for doc, score in ranked] for ranked in ranked_pools])
+        selected = set()
+        for q_item, ranked in zip(q_items, ranked_pools):
+            quota = q_item.n_results
+            for doc, score in ranked:
+                if quota == 0:
+                    break
+                key = doc_key(doc)
+                if key not in selected:
+                    selected.add(key)
+                    quota -= 1
+        return [docs[key] for key in sorted(selected, key=lambda key: fused[key], reverse=True)]
+
+    def retrieve(self, q_items: list):
+        """Searches, reranks and merges the candidates of the planned DB queries (blocking)."""
+        retrievallogger.info(f"Retrieval Queries: {[q_item.query for q_item in q_items]}")
+        if not q_items:
+            return []
+        started = time.perf_counter()
+        pools = []
+        for result_docs in self.search([q_item.query for q_item in q_items]):
+            pools.append(list({doc_key(doc): doc for doc in result_docs}.values()))
+        search_ms = (time.perf_counter() - started) * 1000
+        # One reranking pass over the pairs of every query
+        ranked_pools = reranker.rerank_many([(q_item.query, pool) for q_item, pool in zip(q_items, pools)])
+        all_results = self.merge(q_items, ranked_pools)
+        n_candidates = sum(len(pool) for pool in pools)
+        n_unique = len({doc_key(doc) for pool in pools for doc in pool})
+        retrievallogger.info(f"**Retriever**=> {n_candidates} candidates ({n_unique} unique) -> {len(all_results)} merged results. "
+                             f"Search latency: {search_ms:.0f}ms, session: {self.session_id}")
+        return all_results
+
     def __call__(self, message: HumanMessage):
         """Retrieve relevant documents for multiple queries."""
         retrieval_strategist = self.llm.with_structured_output(DBQueryPlan)
@@ -37,11 +272,19 @@ class AdvancedRetriever:
             SystemPrompts.retriever,
             message
         ])
-        all_results = []
-        retrievallogger.info(f"Retrieval Queries: {[q_item.query for q_item in retrieval_strategy.queries]}")
-        for q_item in retrieval_strategy.queries:
-            result_docs = self.vector_store.similarity_search(q_item.query, k=15)
-            result_docs = rerank_results(q_item.query, [doc for doc in result_docs])[:q_item.n_results]
-            all_results.extend([doc for doc, score in result_docs])
-        return all_results
-          
+        return self.retrieve(retrieval_strategy.queries)
+
+    async def aplan(self, message: HumanMessage):
+        """Plans the DB queries for a message, so they can be planned before the chunks they search are stored."""
+        retrieval_strategist = self.llm.with_structured_output(DBQueryPlan)
+        retrieval_strategy = await retrieval_strategist.ainvoke([
+            SystemPrompts.retriever,
+            message
+        ])
+        return retrieval_strategy.queries
+
+    async def ainvoke(self, message: HumanMessage, q_items: list = None):
+        """Async __call__: the query plan (unless q_items is given) is awaited and the blocking search/rerank runs in a worker thread."""
+        if q_items is None:
+            q_items = await self.aplan(message)
+        return await asyncio.to_thread(self.retrieve, q_items)
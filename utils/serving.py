@@ -0,0 +1,136 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from collections import deque
+import numpy as np
+import config
+import logging
+servinglogger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/test.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+servinglogger.addHandler(handler)
+servinglogger.setLevel(logging.INFO)
+
+class ServerBusyError(RuntimeError):
+    """Raised when the request queue is full."""
+
+class ChatServer:
+    """
+    Serving layer between the chat UI and the agent graphs.
+    Each chat session gets its own graph thread id, so sessions never share checkpoints or message history.
+    At most `max_concurrency` agent runs execute at once; further requests wait in a queue of up to `max_queue`
+    (beyond that ServerBusyError is raised). Requests of the same session run one after another, in order.
+    Queue depth, per-request latency and, for streamed runs, time-to-first-token are logged and summarized by `stats()`.
+    Args:
+        max_concurrency: agent invocations running concurrently
+        max_queue: requests allowed to wait for a slot
+        latency_window: recent requests kept for the latency percentiles
+        recursion_limit: LangGraph recursion limit of each run
+    """
+    def __init__(self, max_concurrency: int = config.SERVING_MAX_CONCURRENCY, max_queue: int = config.SERVING_MAX_QUEUE,
+                 latency_window: int = config.SERVING_LATENCY_WINDOW, recursion_limit: int = 100):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.recursion_limit = recursion_limit
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._slots = None
+        self._session_locks = {}  # thread id -> [lock, pending requests]
+        self._latencies = deque(maxlen=latency_window)
+        self._wait_times = deque(maxlen=latency_window)
+        self._first_token_times = deque(maxlen=latency_window)
+
+    @staticmethod
+    def thread_id(session_key: str = None):
+        """Graph thread id of a chat session; requests without a session get a one-off thread."""
+        return f"session-{session_key}" if session_key else f"request-{uuid.uuid4().hex}"
+
+    def config_for(self, thread_id: str):
+        return {"configurable": {"thread_id": thread_id}, 'recursion_limit': self.recursion_limit}
+
+    def _session_lock(self, thread_id: str):
+        entry = self._session_locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        return entry[0]
+
+    def _release_session(self, thread_id: str):
+        entry = self._session_locks[thread_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._session_locks[thread_id]
+
+    @asynccontextmanager
+    async def _admitted(self, session_key: str):
+        """Queues the request for a slot (in order within its session) and accounts for it; yields its thread id."""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            servinglogger.warning(f"**Chat Server**=> Rejected a request: {self.queued} requests already queued.")
+            raise ServerBusyError("Too many requests are waiting; please retry shortly.")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        thread_id = self.thread_id(session_key)
+        request = {'received': time.perf_counter(), 'first_token': None}
+        self.queued += 1
+        waiting = True
+        try:
+            async with self._session_lock(thread_id):
+                async with self._slots:
+                    self.queued -= 1
+                    waiting = False
+                    self.active += 1
+                    request['started'] = time.perf_counter()
+                    try:
+                        yield thread_id, request
+                        self.completed += 1
+                    except Exception:
+                        self.failed += 1
+                        raise
+                    finally:
+                        self.active -= 1
+                        self._record(thread_id, request)
+        finally:
+            if waiting:  # cancelled while queued
+                self.queued -= 1
+            self._release_session(thread_id)
+
+    async def run(self, session_key: str, agent, inputs):
+        """Runs agent.ainvoke(inputs) on the session's thread once a slot is free and returns its output."""
+        async with self._admitted(session_key) as (thread_id, _):
+            return await agent.ainvoke(inputs, config=self.config_for(thread_id))
+
+    async def stream(self, session_key: str, agent, inputs, is_token=None):
+        """
+        Like `run`, but yields the run's agent.astream_events (v2) events as they happen.
+        The first event for which is_token(event) is true counts as the request's first token (time-to-first-token).
+        """
+        async with self._admitted(session_key) as (thread_id, request):
+            async for event in agent.astream_events(inputs, config=self.config_for(thread_id), version='v2'):
+                if request['first_token'] is None and is_token is not None and is_token(event):
+                    request['first_token'] = time.perf_counter()
+                yield event
+
+    def _record(self, thread_id: str, request: dict):
+        finished = time.perf_counter()
+        received, started, first_token = request['received'], request['started'], request['first_token']
+        self._wait_times.append(started - received)
+        self._latencies.append(finished - received)
+        if first_token is not None:
+            self._first_token_times.append(first_token - received)
+        ttft = f", first token after {first_token - received:.2f}s" if first_token is not None else ""
+        servinglogger.info(f"**Chat Server**=> {thread_id}: waited {started - received:.2f}s, ran {finished - started:.2f}s{ttft}. "
+                           f"Active: {self.active}, queued: {self.queued}")
+
+    def stats(self):
+        latencies = np.array(self._latencies) if self._latencies else None
+        return {'active': self.active, 'queued': self.queued, 'completed': self.completed, 'failed': self.failed,
+                'rejected': self.rejected,
+                'latency_p50': round(float(np.percentile(latencies, 50)), 3) if latencies is not None else None,
+                'latency_p95': round(float(np.percentile(latencies, 95)), 3) if latencies is not None else None,
+                'wait_p95': round(float(np.percentile(self._wait_times, 95)), 3) if self._wait_times else None,
+                'ttft_p50': round(float(np.percentile(self._first_token_times, 50)), 3) if self._first_token_times else None,
+                'ttft_p95': round(float(np.percentile(self._first_token_times, 95)), 3) if self._first_token_times else None}
@@ -0,0 +1,461 @@
+import asyncio
+import hashlib
+import importlib.metadata
+import re
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import config
+import logging
+storagelogger = logging.getLogger(__name__)
+handler = logging.FileHandler('logs/retrieval.log', encoding='utf-8')
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+handler.setFormatter(formatter)
+storagelogger.addHandler(handler)
+storagelogger.setLevel(logging.DEBUG)
+
+def text_hash(text: str):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def chunk_id(text: str, metadata: dict):
+    """Deterministic id from the page URL, header path, chunk position and content hash (and session, if scoped)."""
+    parts = [str(metadata.get('link', metadata.get('source', ''))), str(metadata.get('headers', '')),
+             str(metadata.get('chunk_position', '')), text_hash(text)]
+    if metadata.get('session_id'):
+        parts.append(str(metadata['session_id']))
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+def simhash(text: str, shingle_size: int = 3):
+    """64-bit SimHash over word shingles, or None for texts too short to fingerprint reliably."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < config.NEAR_DUPLICATE_MIN_WORDS:
+        return None
+    shingles = {' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big') for shingle in shingles],
+                      dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0).astype(np.int64) - len(hashes)
+    return sum(1 << i for i in np.flatnonzero(votes > 0).tolist())
+
+class NearDuplicateIndex:
+    """
+    SimHash index of the chunks stored in a vector store, used to skip near-duplicate chunks
+    (syndicated copies, re-scraped pages with trivial edits) before they are embedded.
+    Fingerprints are split into `bands` 16-bit bands: two fingerprints within `max_distance` < bands bits
+    share at least one band, so candidates come from exact band lookups.
+    Fingerprints of stored chunks are kept in their 'simhash' metadata and loaded on first use (async callers
+    run `load` in a thread first, see VectorStoreWriter).
+    Fingerprints are bucketed per session, so a chunk is only a near-duplicate of chunks of its own session.
+    Safe to share between the writers and the compactor thread.
+    """
+    def __init__(self, vector_store=None, max_distance: int = config.NEAR_DUPLICATE_MAX_DISTANCE, bands: int = 4):
+        self.vector_store = vector_store
+        self.max_distance = max_distance
+        self.bands = bands
+        self._band_bits = 64 // bands
+        self._buckets = {}
+        self._loaded = vector_store is None
+        self._lock = threading.RLock()
+
+    def _band_keys(self, fingerprint: int, session_id: str = None):
+        mask = (1 << self._band_bits) - 1
+        return [(session_id, band, (fingerprint >> (band * self._band_bits)) & mask) for band in range(self.bands)]
+
+    def load(self):
+        """Reads the fingerprints of the stored chunks, once; pages through the whole store, so it blocks."""
+        with self._lock:
+            if self._loaded:
+                return
+            offset, page_size = 0, 5000
+            while True:
+                page = self.vector_store.get(include=['metadatas'], limit=page_size, offset=offset)
+                for metadata in page['metadatas']:
+                    if metadata and metadata.get('simhash'):
+                        self.add(int(metadata['simhash'], 16), metadata.get('session_id'))
+                if len(page['ids']) < page_size:
+                    break
+                offset += page_size
+            self._loaded = True
+        storagelogger.info(f"**Near Duplicate Index**=> Loaded fingerprints of {offset + len(page['ids'])} stored chunks.")
+
+    def find(self, fingerprint: int, session_id: str = None):
+        """Returns a fingerprint of the session within max_distance bits, or None."""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            for band_key in self._band_keys(fingerprint, session_id):
+                for candidate in self._buckets.get(band_key, ()):
+                    if (candidate ^ fingerprint).bit_count() <= self.max_distance:
+                        return candidate
+            return None
+
+    def add(self, fingerprint: int, session_id: str = None):
+        with self._lock:
+            for band_key in self._band_keys(fingerprint, session_id):
+                self._buckets.setdefault(band_key, []).append(fingerprint)
+
+    def remove(self, fingerprint: int, session_id: str = None):
+        """Forgets a fingerprint whose chunk was deleted from the store."""
+        with self._lock:
+            if not self._loaded:
+                return  # the lazy load reads the store as it is now
+            for band_key in self._band_keys(fingerprint, session_id):
+                bucket = self._buckets.get(band_key)
+                if bucket and fingerprint in bucket:
+                    bucket.remove(fingerprint)
+
+class _WriteGate:
+    """Lets any number of writer flushes into a store run at once, or the compactor's collection swap alone."""
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._writers = 0
+        self._paused = False
+
+    def try_enter(self):
+        with self._condition:
+            if self._paused:
+                return False
+            self._writers += 1
+            return True
+
+    def exit(self):
+        with self._condition:
+            self._writers -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def paused(self):
+        """Waits for running flushes to finish and holds new ones back until the block exits."""
+        with self._condition:
+            self._paused = True
+            self._condition.wait_for(lambda: self._writers == 0)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._paused = False
+                self._condition.notify_all()
+
+_write_gates = {}  # id(store) -> (store, gate); holding the store keeps its id from being reused
+_write_gates_lock = threading.Lock()
+
+def _write_gate(vector_store):
+    with _write_gates_lock:
+        return _write_gates.setdefault(id(vector_store), (vector_store, _WriteGate()))[1]
+
+class VectorStoreWriter:
+    """
+    Write-behind buffer in front of a vector store.
+    Chunks accepted from any number of pages are deduplicated and written in bulk, one `aadd_texts` call
+    (one embedding batch, one collection write) per flush. A flush happens once `batch_size` chunks are
+    pending or `max_wait` seconds after the oldest pending chunk arrived, and on `close()`. A batch stays buffered
+    until its write succeeds, so a failed timed flush is retried by the next flush, and `close()` raises if it still fails.
+    Chunks get deterministic ids (see `chunk_id`) and are upserted; ids already in the collection are not
+    re-embedded, and the remaining near-duplicates found by `dedup_index` are skipped before embedding. Fingerprints
+    join `dedup_index` only once their chunks are written.
+    Written chunks are also added to `lexical_index`, which is committed to disk on `close()`.
+    Every chunk is stamped with an 'added_at' timestamp used by the retention policy (see VectorStoreCompactor).
+    Args:
+        vector_store: store receiving the chunks
+        dedup_index: NearDuplicateIndex shared across writers of the same store, None to only drop exact repeats
+        lexical_index: BM25Index mirroring the store, None to skip lexical indexing
+        batch_size: pending chunks that trigger a flush
+        max_wait: seconds a chunk may wait in the buffer
+    """
+    def __init__(self, vector_store, dedup_index: NearDuplicateIndex = None, lexical_index=None,
+                 batch_size: int = config.VECTOR_WRITE_BATCH_SIZE, max_wait: float = config.VECTOR_WRITE_MAX_WAIT):
+        self.vector_store = vector_store
+        self.dedup_index = dedup_index
+        self.lexical_index = lexical_index
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.stats = {'chunks_received': 0, 'duplicates_skipped': 0, 'near_duplicates_skipped': 0, 'already_stored': 0,
+                      'chunks_stored': 0, 'batches': 0, 'failed_flushes': 0}
+        self._texts = []
+        self._metadatas = []
+        self._seen = set()
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+        self._timed_flushes = set()
+        self._dedup_loaded = dedup_index is None
+
+    def _accept(self, text: str, metadata: dict):
+        """Drops exact repeats; tags accepted chunks with their id."""
+        key = text_hash(text)
+        if key in self._seen:
+            self.stats['duplicates_skipped'] += 1
+            return False
+        self._seen.add(key)
+        metadata['chunk_id'] = chunk_id(text, metadata)
+        metadata['added_at'] = time.time()
+        return True
+
+    def _drop_near_duplicates(self, texts: list, metadatas: list):
+        """Indexes of the chunks that are not near-duplicates of stored chunks or of earlier chunks of the batch,
+        and the (fingerprint, session) pairs to add to dedup_index once they are written."""
+        keep, fingerprints = [], []
+        batch_index = NearDuplicateIndex(max_distance=self.dedup_index.max_distance, bands=self.dedup_index.bands)
+        for i, (text, metadata) in enumerate(zip(texts, metadatas)):
+            fingerprint = simhash(text)
+            if fingerprint is not None:
+                session_id = metadata.get('session_id')
+                if self.dedup_index.find(fingerprint, session_id) is not None or batch_index.find(fingerprint, session_id) is not None:
+                    self.stats['near_duplicates_skipped'] += 1
+                    continue
+                batch_index.add(fingerprint, session_id)
+                fingerprints.append((fingerprint, session_id))
+                metadata['simhash'] = format(fingerprint, '016x')
+            keep.append(i)
+        return keep, fingerprints
+
+    async def add(self, texts: list, metadatas: list):
+        """Buffers chunks, skipping texts already buffered or written by this writer."""
+        if not self._dedup_loaded:
+            await asyncio.to_thread(self.dedup_index.load)  # keeps the first store scan off the event loop
+            self._dedup_loaded = True
+        for text, metadata in zip(texts, metadatas):
+            self.stats['chunks_received'] += 1
+            if self._accept(text, metadata):
+                self._texts.append(text)
+                self._metadatas.append(metadata)
+        if len(self._texts) >= self.batch_size:
+            await self.flush()
+        elif self._texts and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after(self.max_wait))
+            self._timed_flushes.add(self._timer)
+            self._timer.add_done_callback(self._timed_flushes.discard)
+
+    async def _flush_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            # Nobody awaits this task; the batch stays buffered for the next flush or close()
+            self.stats['failed_flushes'] += 1
+            storagelogger.error(f"**Vector Store Writer**=> Timed flush failed, keeping {len(self._texts)} chunks buffered: {e}")
+
+    async def flush(self):
+        if self._timer is not None:  # the timer clears itself before calling flush
+            self._timer.cancel()
+            self._timer = None
+        async with self._flush_lock:
+            while self._texts:
+                texts, metadatas = self._texts[:self.batch_size], self._metadatas[:self.batch_size]
+                batch = len(texts)
+                started = time.perf_counter()
+                ids = [metadata['chunk_id'] for metadata in metadatas]
+                # A compactor swapping the collection must not miss chunks written during the swap
+                gate = _write_gate(self.vector_store)
+                while not gate.try_enter():
+                    await asyncio.sleep(0.05)
+                try:
+                    # Re-scraped chunks are found by id first, so they count as already stored, not as near-duplicates
+                    existing = set((await asyncio.to_thread(self.vector_store.get, ids=ids, include=[]))['ids'])
+                    if existing:
+                        self.stats['already_stored'] += len(existing)
+                        new = [i for i, id_ in enumerate(ids) if id_ not in existing]
+                        texts, metadatas, ids = [texts[i] for i in new], [metadatas[i] for i in new], [ids[i] for i in new]
+                    fingerprints = []
+                    if self.dedup_index is not None and texts:
+                        new, fingerprints = self._drop_near_duplicates(texts, metadatas)
+                        texts, metadatas, ids = [texts[i] for i in new], [metadatas[i] for i in new], [ids[i] for i in new]
+                    if texts:
+                        await self.vector_store.aadd_texts(texts, metadatas=metadatas, ids=ids)  # upsert by chunk id
+                finally:
+                    gate.exit()
+                # Only a written batch leaves the buffer; add() appends behind it meanwhile
+                del self._texts[:batch], self._metadatas[:batch]
+                for fingerprint, session_id in fingerprints:
+                    self.dedup_index.add(fingerprint, session_id)
+                if texts and self.lexical_index is not None:
+                    await asyncio.to_thread(self.lexical_index.add, ids, texts, [metadata.get('session_id') for metadata in metadatas])
+                self.stats['chunks_stored'] += len(texts)
+                self.stats['batches'] += 1
+                storagelogger.debug(f"**Vector Store Writer**=> Wrote {len(texts)} chunks in {time.perf_counter() - started:.2f}s")
+
+    async def close(self):
+        """Flushes everything still buffered and persists the lexical index; raises if the buffered chunks cannot be written."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._timed_flushes, return_exceptions=True)  # a timed flush may be mid-write
+        await self.flush()
+        if self.lexical_index is not None:
+            await asyncio.to_thread(self.lexical_index.commit)
+
+# langchain_chroma releases whose private attributes _chroma_internals relies on
+SUPPORTED_LANGCHAIN_CHROMA = ((0, 1), (1, 99))
+
+def _chroma_internals(vector_store):
+    """
+    (client, collection, swap) of a langchain_chroma store; the one place that touches its private attributes.
+    swap(new_collection) points the store at another collection.
+    Raises RuntimeError on langchain_chroma releases outside SUPPORTED_LANGCHAIN_CHROMA, or when the attributes are missing.
+    """
+    version = importlib.metadata.version('langchain-chroma')
+    release = tuple(int(part) for part in re.findall(r'\d+', version)[:2])
+    low, high = SUPPORTED_LANGCHAIN_CHROMA
+    # Since 0.1.x the collection lives in `_chroma_collection` (`_collection` is a read-only property over it)
+    attribute = '_chroma_collection' if hasattr(vector_store, '_chroma_collection') else '_collection'
+    if not low <= release <= high or not hasattr(vector_store, '_client') or getattr(vector_store, attribute, None) is None:
+        raise RuntimeError(f"VectorStoreCompactor does not support langchain_chroma {version}; "
+                           f"supported releases: {'.'.join(map(str, low))} to {'.'.join(map(str, high))}.")
+
+    def swap(collection):
+        setattr(vector_store, attribute, collection)
+
+    return vector_store._client, getattr(vector_store, attribute), swap
+
+class VectorStoreCompactor:
+    """
+    Retention policy for a vector store shared by every session.
+    A background job deletes chunks whose 'added_at' is older than `retention` seconds (chunks stored without it are
+    stamped with the time of the first run that sees them, so they are kept for a full retention period) and updates the near-duplicate and BM25 indexes. Deleted chunks stay in the HNSW graph as
+    tombstones, so once they exceed `rebuild_fraction` of the collection, the live chunks are copied (with their
+    embeddings) into a fresh collection that takes over the original name.
+    Every run times a probe query before and after compacting; `stats()` reports both latencies.
+    Args:
+        vector_store: langchain Chroma store to compact
+        dedup_index / lexical_index: indexes of vector_store kept in sync with deletions
+        retention: seconds a chunk is kept
+        interval: seconds between background runs
+        rebuild_fraction: deleted/live ratio that triggers an HNSW rebuild
+    """
+    def __init__(self, vector_store, dedup_index: NearDuplicateIndex = None, lexical_index=None,
+                 retention: float = config.VECTOR_STORE_RETENTION, interval: float = config.COMPACTION_INTERVAL,
+                 rebuild_fraction: float = config.COMPACTION_REBUILD_FRACTION, page_size: int = 5000):
+        self.vector_store = vector_store
+        self.dedup_index = dedup_index
+        self.lexical_index = lexical_index
+        self.retention = retention
+        self.interval = interval
+        self.rebuild_fraction = rebuild_fraction
+        self.page_size = page_size
+        self._stats = {'chunks': None, 'sessions': None, 'evicted': 0, 'rebuilds': 0, 'last_run_seconds': None,
+                       'query_ms_before': None, 'query_ms_after': None}
+        self._deleted_since_rebuild = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _scan(self, collection):
+        """Pages through (ids, metadatas) of the whole collection."""
+        offset = 0
+        while True:
+            page = collection.get(include=['metadatas'], limit=self.page_size, offset=offset)
+            yield page['ids'], page['metadatas']
+            if len(page['ids']) < self.page_size:
+                break
+            offset += self.page_size
+
+    def _probe_query_ms(self, collection):
+        """Latency of a nearest-neighbour query (with a stored chunk's embedding) on the collection, or None if it is empty."""
+        sample = collection.get(include=['embeddings'], limit=1)
+        if not sample['ids']:
+            return None
+        started = time.perf_counter()
+        collection.query(query_embeddings=[sample['embeddings'][0]], n_results=10, include=[])
+        return round((time.perf_counter() - started) * 1000, 2)
+
+    def run_once(self):
+        """Evicts stale chunks and rebuilds the collection when tombstones pile up."""
+        with self._lock:
+            started = time.perf_counter()
+            client, collection, swap = _chroma_internals(self.vector_store)
+            query_ms_before = self._probe_query_ms(collection)
+            cutoff = time.time() - self.retention
+            stale, unstamped, n_chunks, sessions = [], [], 0, set()
+            for ids, metadatas in self._scan(self.vector_store):
+                n_chunks += len(ids)
+                for id_, metadata in zip(ids, metadatas):
+                    metadata = metadata or {}
+                    if 'added_at' not in metadata:
+                        unstamped.append((id_, metadata))
+                    elif metadata['added_at'] < cutoff:
+                        stale.append((id_, metadata))
+                        continue
+                    sessions.add(metadata.get('session_id'))
+            now = time.time()
+            for start in range(0, len(unstamped), 500):
+                batch = unstamped[start:start + 500]
+                collection.update(ids=[id_ for id_, _ in batch], metadatas=[{**metadata, 'added_at': now} for _, metadata in batch])
+            for start in range(0, len(stale), 500):
+                self.vector_store.delete(ids=[id_ for id_, _ in stale[start:start + 500]])
+            if self.dedup_index is not None:
+                for _, metadata in stale:
+                    if metadata.get('simhash'):
+                        self.dedup_index.remove(int(metadata['simhash'], 16), metadata.get('session_id'))
+            n_live = n_chunks - len(stale)
+            self._deleted_since_rebuild += len(stale)
+            if self._deleted_since_rebuild and self._deleted_since_rebuild >= self.rebuild_fraction * max(n_live, 1):
+                collection = self._rebuild_collection(client, collection, swap)
+            if stale and self.lexical_index is not None:
+                self.lexical_index.rebuild()
+            self._stats.update(chunks=n_live, sessions=len(sessions), last_run_seconds=round(time.perf_counter() - started, 3),
+                               query_ms_before=query_ms_before, query_ms_after=self._probe_query_ms(collection))
+            self._stats['evicted'] += len(stale)
+            storagelogger.info(f"**Vector Store Compactor**=> Evicted {len(stale)} of {n_chunks} chunks. Stats: {self._stats}")
+            return len(stale)
+
+    def stats(self):
+        """Counters of the compaction runs and the probe query latency (ms) before/after the last run."""
+        return dict(self._stats)
+
+    def _rebuild_collection(self, client, old, swap):
+        """Copies the live chunks of `old` into a new collection that takes over its name; returns the new collection."""
+        name = old.name
+        for leftover in (f"{name}__compacted", f"{name}__retired"):  # from an interrupted rebuild
+            try:
+                client.delete_collection(leftover)
+            except Exception:
+                pass
+        new = client.create_collection(f"{name}__compacted", metadata=old.metadata, embedding_function=None)
+        copied = set()
+
+        def copy(ids=None):
+            offset = 0
+            while True:
+                page = old.get(ids=ids, include=['embeddings', 'documents', 'metadatas'], limit=self.page_size, offset=offset)
+                page_ids = [id_ for id_ in page['ids'] if id_ not in copied]
+                if page_ids:
+                    keep = [i for i, id_ in enumerate(page['ids']) if id_ not in copied]
+                    new.add(ids=page_ids, embeddings=[page['embeddings'][i] for i in keep],
+                            documents=[page['documents'][i] for i in keep], metadatas=[page['metadatas'][i] for i in keep])
+                    copied.update(page_ids)
+                if len(page['ids']) < self.page_size:
+                    break
+                offset += self.page_size
+
+        copy()
+        # Writers are held back from the last copy until they write to the new collection
+        with _write_gate(self.vector_store).paused():
+            late = [id_ for id_ in old.get(include=[])['ids'] if id_ not in copied]
+            if late:
+                copy(late)  # chunks written while copying
+            old.modify(name=f"{name}__retired")
+            new.modify(name=name)
+            swap(new)
+        client.delete_collection(f"{name}__retired")
+        self._deleted_since_rebuild = 0
+        self._stats['rebuilds'] += 1
+        storagelogger.info(f"**Vector Store Compactor**=> Rebuilt collection {name} with {len(copied)} live chunks.")
+        return new
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                storagelogger.error(f"**Vector Store Compactor**=> Compaction failed: {e}")
+
+    def start(self):
+        """Runs the compaction every `interval` seconds on a daemon thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='vector-store-compactor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,15 +1,28 @@
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from keybert import KeyBERT
-
-kw_model = KeyBERT()
-import spacy
-try:
-    nlp = spacy.load("en_core_web_lg")
-except Exception as e:
-    print("Downloading 'en_core_web_lg' model...")
-    from spacy.cli import download
-    download("en_core_web_lg")
-    nlp = spacy.load("en_core_web_lg")
+import numpy as np
+import threading
+from collections import OrderedDict
+import config
+from .models import registry, get_model_client
+from .storage import VectorStoreWriter
+
+def load_keybert():
+    from keybert import KeyBERT
+    return KeyBERT()
+
+def load_spacy_model(name: str = "en_core_web_lg"):
+    import spacy
+    try:
+        return spacy.load(name)
+    except Exception as e:
+        print(f"Downloading '{name}' model...")
+        from spacy.cli import download
+        download(name)
+        return spacy.load(name)
+
+# Loaded on first use (or by registry.warmup), not at import; served by the model server when one is configured
+kw_model = registry.register('kw_model', load_keybert, served=True)
+nlp = registry.register('nlp', load_spacy_model, served=True)
 
 import logging
 textlogger = logging.getLogger(__name__)
@@ -80,7 +93,149 @@ class AdvancedMarkdownSplitter:
 
 
 
-# TODO: Combine search ent doc and kw ent doc into single set to avoid duplicate computation.
+def extract_entities(texts: list):
+    """Lower-cased entity texts for each text, NER run as one nlp.pipe batch."""
+    if get_model_client() is not None:
+        return get_model_client().call('entities', texts)
+    disabled = [name for name in nlp.pipe_names if name not in ('tok2vec', 'ner')]
+    return [[ent.text.lower() for ent in doc.ents] for doc in nlp.pipe(texts, disable=disabled)]
+
+class TermVectorCache:
+    """
+    Bounded LRU cache of static term vectors, shared by every ContentFilter and kept across iterations.
+    Vectors and norms live in preallocated float32 arrays; each normalized term maps to a row, so the
+    spaCy tokenizer and vector lookup run at most once per distinct string while it stays cached.
+    Args:
+        max_size: number of terms kept before the least recently used ones are evicted
+    """
+    def __init__(self, max_size: int = config.TERM_VECTOR_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()  # normalized term -> row in self._vectors
+        self._vectors = None
+        self._norms = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(term: str):
+        return ' '.join(term.split())
+
+    def _allocate(self):
+        self._vectors = np.zeros((self.max_size, nlp.vocab.vectors_length), dtype=np.float32)
+        self._norms = np.zeros(self.max_size, dtype=np.float32)
+
+    def _row_for(self, term: str):
+        if len(self._rows) < self.max_size:
+            return len(self._rows)
+        _, row = self._rows.popitem(last=False)
+        return row
+
+    def get_many(self, terms: list):
+        """Returns (vectors, norms) for terms, one row per term, computing only the uncached ones."""
+        keys = [self.normalize(term) for term in terms]
+        vectors = np.zeros((len(keys), nlp.vocab.vectors_length), dtype=np.float32)
+        norms = np.zeros(len(keys), dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._allocate()
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    row = self._row_for(key)
+                    self._vectors[row] = nlp.make_doc(key).vector
+                    self._norms[row] = np.linalg.norm(self._vectors[row])
+                    self._rows[key] = row
+                else:
+                    self.hits += 1
+                    self._rows.move_to_end(key)
+                vectors[i] = self._vectors[row]
+                norms[i] = self._norms[row]
+        return vectors, norms
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'terms': len(self._rows)}
+
+term_vector_cache = TermVectorCache()
+
+def term_vectors(terms: list):
+    """
+    Static word vectors (mean of token vectors, i.e. Doc.vector) for each term and their norms.
+    Only tokenization runs, so this matches nlp(term).vector without the rest of the pipeline.
+    """
+    if get_model_client() is not None:
+        return get_model_client().call('term_vectors', terms)
+    return term_vector_cache.get_many(terms)
+
+def token_counts(terms: list):
+    """Number of spaCy tokens in each term."""
+    if get_model_client() is not None:
+        return get_model_client().call('token_counts', terms)
+    return [len(nlp.make_doc(term)) for term in terms]
+
+def keyphrases(texts: list, keyphrase_ngram_range: tuple, seed_keywords: list):
+    """KeyBERT keyphrases (without scores) for every text in one batch."""
+    if get_model_client() is not None:
+        return get_model_client().call('keyphrases', texts, keyphrase_ngram_range, seed_keywords)
+    keywords = kw_model.extract_keywords(texts, keyphrase_ngram_range=keyphrase_ngram_range, seed_keywords=seed_keywords)
+    if len(texts) == 1:
+        keywords = [keywords]  # KeyBERT unwraps single-document results
+    elif len(keywords) < len(texts):
+        keywords = list(keywords) + [[]] * (len(texts) - len(keywords))  # [] for the whole batch when no text had a usable word
+    return [[kw[0] for kw in text_keywords] for text_keywords in keywords]
+
+class RelevanceScorer:
+    """
+    Batched semantic matching of texts against one set of target terms.
+    A text matches when any of its entities/keyphrases has cosine similarity above the threshold
+    with any target term; all similarities for a batch come from one matrix multiply.
+    Args:
+        targets: target term strings (e.g. the query entities or keywords)
+    """
+    def __init__(self, targets: list):
+        self.has_targets = bool(targets)
+        if not self.has_targets:
+            return
+        lengths = token_counts(targets)
+        self.keyphrase_ngram_range = (min(lengths), max(lengths),)
+        self.seed_keywords = [str(term) for term in targets]
+        vectors, norms = term_vectors(self.seed_keywords)
+        # Zero-norm targets can never match, exactly like the vector_norm guard on spaCy similarity
+        self.target_matrix = vectors[norms > 0] / norms[norms > 0, None]
+
+    def extract_keywords(self, texts: list):
+        """KeyBERT keyphrases for every text in one batch, guided by the target terms."""
+        if not texts:
+            return []
+        return keyphrases(texts, self.keyphrase_ngram_range, self.seed_keywords)
+
+    def matches(self, texts: list, entities: list, threshold: float):
+        """
+        texts: texts to score; entities: extract_entities(texts)
+        Returns a list of booleans, True where the text is a semantic match.
+        """
+        results = [False] * len(texts)
+        if not self.has_targets or not len(self.target_matrix):
+            return results
+        indices = [i for i, text in enumerate(texts) if text]
+        keywords = self.extract_keywords([texts[i] for i in indices])
+        text_terms = {i: entities[i] + text_keywords for i, text_keywords in zip(indices, keywords)}
+        unique_terms = list(dict.fromkeys(term for terms in text_terms.values() for term in terms))
+        if not unique_terms:
+            return results
+        vectors, norms = term_vectors(unique_terms)
+        valid = norms > 0
+        unit_vectors = np.zeros_like(vectors)
+        unit_vectors[valid] = vectors[valid] / norms[valid, None]
+        best_similarity = np.where(valid, (unit_vectors @ self.target_matrix.T).max(axis=1), -np.inf)
+        term_best = dict(zip(unique_terms, best_similarity))
+        for i, terms in text_terms.items():
+            results[i] = any(term_best[term] > threshold for term in terms)
+        return results
+
 # TODO: Log similarity scores for analysis.
 class ContentFilter:
     """
@@ -96,10 +251,65 @@ class ContentFilter:
         self.chunk_threshold = chunk_threshold
         self.target_terms = target_terms
     
-    async def filter_and_add_to_vectorestore(self, content: dict, content_metadata, vector_store):
+    def select_relevant(self, content: dict, content_metadata: dict):
+        """ 
+            Selects the content chunks that are semantically relevant to the target terms.
+            Headers of all groups are scored in one batch, then the chunks of the groups whose header did not match.
+            Parameters
+            ----------
+            content : Dict[str, List[str]]
+                A dictionary where:
+                - Keys are strings representing hierarchical headers.
+                - Values are lists of strings, each representing a content chunk associated with the headers.
+            
+            content_metadata : dict
+                Metadata of the content to be added to each chunk.
+
+            Returns
+            -------
+            Tuple[List[str], List[dict]]
+                The relevant chunks and their metadatas, ready for `vector_store.add_texts`.
+        """
+        ent_scorer = RelevanceScorer(self.target_terms['entities'] or [])
+        kw_scorer = RelevanceScorer(self.target_terms['keywords'] or [])
+
+        def semantic_matches(texts: list, threshold: float):
+            if not texts or not (ent_scorer.has_targets or kw_scorer.has_targets):
+                return [False] * len(texts)
+            entities = extract_entities(texts)
+            ent_matches = ent_scorer.matches(texts, entities, threshold)
+            kw_matches = kw_scorer.matches(texts, entities, threshold)
+            return [ent_match or kw_match for ent_match, kw_match in zip(ent_matches, kw_matches)]
+
+        groups = list(content.items())
+        # stage 1: header level filtering
+        header_texts = [headers for headers, _ in groups if headers]
+        header_matches = dict(zip(header_texts, semantic_matches(header_texts, self.header_threshold)))
+        # stage 2: chunk level filtering, only for groups whose header did not match
+        pending = [(g, i, chunk) for g, (headers, chunks) in enumerate(groups) if not header_matches.get(headers) for i, chunk in enumerate(chunks)]
+        chunk_matches = semantic_matches([chunk for _, _, chunk in pending], self.header_threshold)
+        matched_chunks = {(g, i) for (g, i, _), is_match in zip(pending, chunk_matches) if is_match}
+
+        texts, metadatas = [], []
+        n_added = 0
+        for g, (headers, chunks) in enumerate(groups):
+            # A matching header keeps the whole group; otherwise only the chunks that matched themselves
+            positions = [i for i in range(len(chunks)) if header_matches.get(headers) or (g, i) in matched_chunks]
+            if not positions:
+                continue
+            for i in positions:
+                texts.append(chunks[i])
+                metadatas.append({'chunk_position':i+1, 'headers': headers, **content_metadata})
+            n_added += 1
+        textlogger.debug(f"**Content Filter**=> Total header groups added for {content_metadata.get('link', content_metadata.get('source'))}: {n_added} out of {len(content)}. Term vector cache: {term_vector_cache.stats()}")
+        return texts, metadatas
+
+    async def filter_and_add_to_vectorestore(self, content: dict, content_metadata, vector_store, lexical_index=None, dedup_index=None):
         
         """ 
             Adds relevant content chunks to the vector store based on semantic similarity with target terms.
+            The chunks go through a VectorStoreWriter, so they get the same ids, dedup and retention stamps as
+            the ingestion pipeline's.
             Parameters
             ----------
             content : Dict[str, List[str]]
@@ -113,51 +323,15 @@ class ContentFilter:
             vector_store : VectorStore
                 The vector store where relevant chunks will be added.
 
+            lexical_index : BM25Index, optional
+                Inverted index of the vector store, updated with the added chunks.
+
+            dedup_index : NearDuplicateIndex, optional
+                Near-duplicate index of the vector store, used to skip near-duplicate chunks.
+
         """
-        def has_semantic_match(primary_docs: list, text_to_match:str, threshold: float =0.30):
-            """
-            Check if any of the primary_docs have semantic similarity above the threshold with the text_to_match.
-            Returns True if text is a semantic match.
-            """
-            if not primary_docs or not text_to_match:
-                return False
-            text_entities = [ent.text.lower() for ent in nlp(text_to_match).ents]
-            primary_doc_lengths = [len(doc) for doc in primary_docs]
-            keyphrase_ngram_range = (min(primary_doc_lengths), max(primary_doc_lengths),)
-            seed_keywords = [doc.__str__() for doc in primary_docs]
-            text_keywords = [kw[0] for kw in kw_model.extract_keywords(text_to_match, keyphrase_ngram_range=keyphrase_ngram_range, seed_keywords=seed_keywords)]
-            text_terms = text_entities + text_keywords
-            if not text_terms:
-                return False
-            for p_doc in primary_docs:
-                for term in text_terms:
-                        term_doc = nlp(term)
-                        if p_doc.vector_norm and term_doc.vector_norm:
-                            if p_doc.similarity(term_doc) > threshold:
-                                return True
-            return False
-        
-        # Generate docs for target terms
-        search_ent_docs = [nlp(kw) for kw in self.target_terms['entities'] if self.target_terms['entities']]
-        search_kw_docs = [nlp(kw) for kw in self.target_terms['keywords'] if self.target_terms['keywords']]
-        n_added = 0
-        for headers, chunks in content.items():
-            chunks_metadatas = [{'chunk_position':i+1, 'headers': headers} for i in range(len(chunks))]
-            for md in chunks_metadatas:
-                md.update(content_metadata)
-            # stage 1: header level filtering
-            if headers:
-                # secondary_kw_doc = header_keywords['entities'] + header_keywords['nouns'] if (header_keywords['entities'] and header_keywords['nouns']) else (header_keywords['verbs'] + header_keywords['adjectives'])
-                if has_semantic_match(search_ent_docs, headers, self.header_threshold) or has_semantic_match(search_kw_docs, headers, self.header_threshold):
-                    await vector_store.aadd_texts(chunks, metadatas=chunks_metadatas)
-                    n_added += +1
-                    continue # Move to next header group
-            # stage 2: chunk level filtering
-            for  chunk in chunks:
-                ## similarity match for text
-                if has_semantic_match(search_ent_docs, chunk, self.header_threshold) or has_semantic_match(search_kw_docs, chunk, self.header_threshold):
-                    await vector_store.aadd_texts(chunks, metadatas=chunks_metadatas)
-                    n_added += 1
-                    # print("Added chunk based on chunk-level match.: ", len(chunk))
-                    break # Move to next header group
-        textlogger.debug(f"**Content Filter**=> Total header groups added for Header-{headers}: {n_added} out of {len(content)}")
\ No newline at end of file
+        texts, metadatas = self.select_relevant(content, content_metadata)
+        if texts:
+            writer = VectorStoreWriter(vector_store, dedup_index=dedup_index, lexical_index=lexical_index)
+            await writer.add(texts, metadatas)
+            await writer.close()
@@ -1,8 +1,18 @@
-from langchain_community.document_loaders import AsyncChromiumLoader
+from langchain_core.documents import Document
 from langchain_community.document_transformers import MarkdownifyTransformer
 from serpapi import GoogleSearch
+from concurrent.futures import ThreadPoolExecutor
+from .caching import PageCache, SQLiteCache
+from .fetchers import browser_pool, http_fetcher, looks_like_js_shell
+import asyncio
+import hashlib
+import json
+import threading
+import unicodedata
+import config
 import logging
 import os
+import re
 import time
 weblogger = logging.getLogger(__name__)
 handler = logging.FileHandler('logs/web_processing.log', encoding='utf-8')
@@ -11,20 +21,84 @@ handler.setFormatter(formatter)
 weblogger.addHandler(handler)
 weblogger.setLevel(logging.DEBUG)
 
-def retrieve_search_results(query, api_params={}, max_results= 5):
+def normalize_search_query(query: str):
+    """Case/whitespace/punctuation-insensitive form of a search query, used as the cache key."""
+    query = unicodedata.normalize('NFKC', query).lower()
+    query = re.sub(r'[^\w\s$%.-]', ' ', query)
+    return ' '.join(query.split())
+
+class SearchResultCache(SQLiteCache):
+    """Disk-backed cache of SerpAPI organic results keyed by normalized query and api params."""
+    def __init__(self, path=os.path.join(config.CACHE_DIR, 'search_cache.sqlite'),
+                 ttl=config.SEARCH_CACHE_TTL, max_entries=config.SEARCH_CACHE_MAX_ENTRIES):
+        super().__init__(path, table='search_results', ttl=ttl, max_entries=max_entries)
+
+    @staticmethod
+    def make_key(query: str, api_params: dict):
+        params = {str(key): str(val) for key, val in api_params.items() if key not in ('api_key', 'q')}
+        payload = json.dumps({'q': normalize_search_query(query), 'params': params}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def lookup(self, query: str, api_params: dict):
+        value = self.get(self.make_key(query, api_params))
+        return json.loads(value) if value is not None else None
+
+    def store(self, query: str, api_params: dict, results: list):
+        self.set(self.make_key(query, api_params), json.dumps(results).encode('utf-8'))
+
+search_cache = SearchResultCache()
+
+def retrieve_search_results(query, api_params=None, max_results= 5, use_cache=True):
     
     """Retrieve search results from SerpAPI given a query."""
 
+    api_params = dict(api_params or {})  # never share/mutate the caller's params across concurrent searches
+    if use_cache:
+        results = search_cache.lookup(query, api_params)
+        if results is not None:
+            weblogger.debug(f"**Search**=> Cache hit for query: {query}")
+            return results[:max_results]
     api_params['api_key'] = os.getenv('SERP_API_KEY')
     api_params['q'] = query
     search = GoogleSearch(api_params)
     output = search.get_dict()
     results = [{'metadata':{key : val for key, val in res.items() if key in ['source','link', 'date',]}} for res in output.get('organic_results', [])]
+    if use_cache and 'error' not in output:
+        search_cache.store(query, api_params, results)
     return results[:max_results]
 
+# Dedicated pool so a hung SerpAPI request never blocks event loop shutdown (asyncio.run waits on the default executor)
+_search_executor = ThreadPoolExecutor(max_workers=config.SEARCH_MAX_CONCURRENCY, thread_name_prefix='serpapi')
+
+async def search_many(queries: list, api_params=None, max_results=5,
+                      max_concurrency: int = config.SEARCH_MAX_CONCURRENCY, timeout: float = config.SEARCH_TIMEOUT):
+    """
+    Runs several SerpAPI searches concurrently.
+    At most `max_concurrency` searches are in flight; each one gets `timeout` seconds once started.
+    Returns a list aligned with `queries`: the search results, or None if that query failed or timed out.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def _search(query):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(_search_executor, retrieve_search_results, query, api_params, max_results),
+                    timeout=timeout)
+            except asyncio.TimeoutError:
+                weblogger.warning(f"**Search**=> Timed out after {timeout}s: {query}")
+            except Exception as e:
+                weblogger.warning(f"**Search**=> Failed for query {query}: {e}")
+            finally:
+                weblogger.debug(f"**Search**=> {time.perf_counter() - started:.2f}s for query: {query}")
+            return None
+
+    return await asyncio.gather(*(_search(query) for query in queries))
+
 # Source/Domain evaluation: Fast Pass
 from urllib.parse import urlparse
-import re
 class SourceEvaluator:
     """Basic domain evaluator for reliability"""
     def __init__(self):
@@ -62,51 +136,238 @@ class SourceEvaluator:
 # TODO: Ethical Scrapping: add robots.txt checking: Done
 from urllib.robotparser import RobotFileParser
 from urllib.parse import urljoin, urlsplit
+import urllib.error
+import urllib.request
 
-def can_fetch_url(url: str, user_agent='*'):
+class RobotsPolicyCache:
     """
-    Check if a URL can be scraped according to robots.txt
+    Per-host cache of robots.txt policies.
+    Policies are reused for `ttl` seconds; hosts whose robots.txt cannot be read
+    are cached as allow-all for `negative_ttl` seconds so they are not retried per URL.
     """
-    rp = RobotFileParser()
-    base_url = '{uri.scheme}://{uri.netloc}/'.format(uri=urlsplit(url))
-    robots_url = urljoin(base_url, '/robots.txt')
-    rp.set_url(robots_url)
-    try:
-        rp.read()
-    except TimeoutError:
+    def __init__(self, ttl: float = config.ROBOTS_CACHE_TTL, negative_ttl: float = config.ROBOTS_NEGATIVE_TTL,
+                 timeout: float = config.ROBOTS_FETCH_TIMEOUT, max_concurrency: int = config.ROBOTS_MAX_CONCURRENCY):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._policies = {}  # robots_url -> (RobotFileParser | None, expires_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def robots_url(url: str):
+        base_url = '{uri.scheme}://{uri.netloc}/'.format(uri=urlsplit(url))
+        return urljoin(base_url, '/robots.txt')
+
+    def _cached(self, robots_url: str):
+        """Returns (hit, policy) for a robots_url, dropping expired entries."""
+        with self._lock:
+            entry = self._policies.get(robots_url)
+            if entry is None:
+                return False, None
+            policy, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._policies[robots_url]
+                return False, None
+            return True, policy
+
+    def _store(self, robots_url: str, policy):
+        ttl = self.ttl if policy is not None else self.negative_ttl
+        with self._lock:
+            self._policies[robots_url] = (policy, time.monotonic() + ttl)
+
+    def _read_policy(self, robots_url: str):
+        """Downloads and parses robots.txt, mirroring RobotFileParser.read() with a timeout."""
+        rp = RobotFileParser(robots_url)
         try:
-            time.sleep(1)  # avoid rapid retries
-            rp.read()
+            with urllib.request.urlopen(robots_url, timeout=self.timeout) as f:
+                raw = f.read()
+        except urllib.error.HTTPError as err:
+            if err.code in (401, 403):
+                rp.disallow_all = True
+            elif 400 <= err.code < 500:
+                rp.allow_all = True
+            else:
+                raise
+        else:
+            rp.parse(raw.decode("utf-8", errors="ignore").splitlines())
+        return rp
+
+    def _load(self, robots_url: str):
+        try:
+            policy = self._read_policy(robots_url)
+        except TimeoutError:
+            try:
+                time.sleep(1)  # avoid rapid retries
+                policy = self._read_policy(robots_url)
+            except Exception as e:
+                weblogger.debug(f"Could not read robots.txt at {robots_url}: {e}")
+                policy = None
         except Exception as e:
-            weblogger.debug(f"Could not read robots.txt at {robots_url}: {e}")
-    except Exception as e:
-        weblogger.debug(f"Error reading robots.txt at {robots_url}: {e}")
-        return True  # Assume allowed if robots.txt cannot be read
-    if rp.can_fetch(user_agent, url):
-        return True
-    else:
+            weblogger.debug(f"Error reading robots.txt at {robots_url}: {e}")
+            policy = None  # Assume allowed if robots.txt cannot be read
+        self._store(robots_url, policy)
+        return policy
+
+    async def _aload(self, robots_url: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            await asyncio.to_thread(self._load, robots_url)
+
+    @staticmethod
+    def _allowed(policy, url: str, user_agent: str):
+        if policy is None or policy.can_fetch(user_agent, url):
+            return True
         weblogger.debug(f"Blocked by robots.txt: {url}")
         return False
 
-async def url_loader(urls: list): 
+    def can_fetch(self, url: str, user_agent='*'):
+        robots_url = self.robots_url(url)
+        hit, policy = self._cached(robots_url)
+        if not hit:
+            policy = self._load(robots_url)
+        return self._allowed(policy, url, user_agent)
+
+    async def can_fetch_many(self, urls: list, user_agent='*'):
+        """Checks all urls, fetching the robots.txt of every uncached host concurrently."""
+        missing = {self.robots_url(url) for url in urls}
+        missing = [robots_url for robots_url in missing if not self._cached(robots_url)[0]]
+        if missing:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            await asyncio.gather(*(self._aload(robots_url, semaphore) for robots_url in missing))
+        results = {}
+        for url in urls:
+            hit, policy = self._cached(self.robots_url(url))
+            results[url] = self._allowed(policy, url, user_agent)
+        return results
+
+robots_cache = RobotsPolicyCache()
+
+def can_fetch_url(url: str, user_agent='*'):
     """
-    loads content from multiple urls.
+    Check if a URL can be scraped according to robots.txt
+    """
+    return robots_cache.can_fetch(url, user_agent)
+
+async def can_fetch_urls(urls: list, user_agent='*'):
+    """
+    Check a batch of URLs against robots.txt.
+    Returns a dict mapping each url to True if it may be scraped.
+    """
+    return await robots_cache.can_fetch_many(urls, user_agent)
+
+page_cache = PageCache(os.path.join(config.CACHE_DIR, 'page_cache.sqlite'),
+                       max_age=config.PAGE_CACHE_MAX_AGE, max_entries=config.PAGE_CACHE_MAX_ENTRIES)
+
+def _usable_html(url: str, response):
+    """html of a plain HTTP response, or None when the page needs a browser."""
+    if response is None or response['status'] != 200:
+        return None
+    if 'html' not in response['headers'].get('content-type', 'text/html'):
+        return None
+    if looks_like_js_shell(response['text']):
+        weblogger.debug(f"**URL Loader**=> JS-only shell detected, falling back to Chromium: {url}")
+        return None
+    return response['text']
+
+async def _fetch_page(url: str, fetch_mode: str, use_cache: bool = True):
+    """
+    Fetches one page, serving fresh cache entries directly and revalidating stale ones with ETag/Last-Modified.
+    Returns a dict with 'html', 'fetch_path' ('cache', 'revalidated', 'http' or 'chromium'), 'fetch_seconds',
+    and, for cached pages, 'markdown' and 'source_reliability'; 'html' is None if every path failed.
+    """
+    started = time.perf_counter()
+    # The sqlite reads and writes run in worker threads, off the event loop
+    cached = await asyncio.to_thread(page_cache.get, url) if use_cache else None
+
+    def _page(html, fetch_path, response=None, entry=None):
+        page = {'html': html, 'fetch_path': fetch_path, 'fetch_seconds': round(time.perf_counter() - started, 3)}
+        if entry is not None:
+            page.update(markdown=entry['markdown'], source_reliability=entry['source_reliability'], content_hash=entry['content_hash'])
+        if response is not None:
+            page.update(etag=response['headers'].get('etag'), last_modified=response['headers'].get('last-modified'))
+        return page
+
+    if cached and cached['fresh']:
+        page_cache.record('hits')
+        return _page(cached['html'], 'cache', entry=cached)
+    if fetch_mode in ('auto', 'http'):
+        validators = {}
+        if cached and cached['etag']:
+            validators['If-None-Match'] = cached['etag']
+        if cached and cached['last_modified']:
+            validators['If-Modified-Since'] = cached['last_modified']
+        response = await http_fetcher.fetch(url, headers=validators or None)
+        if validators and response is not None and response['status'] == 304:
+            await asyncio.to_thread(page_cache.touch, url)
+            page_cache.record('revalidated')
+            return _page(cached['html'], 'revalidated', entry=cached)
+        page_cache.record('misses')
+        html = _usable_html(url, response)
+        if html is not None or fetch_mode == 'http':
+            return _page(html, 'http', response=response)
+    else:
+        page_cache.record('misses')
+    html = await browser_pool.fetch(url)
+    return _page(html, 'chromium')
+
+def _html_to_markdown(url: str, html: str):
+    html2md = MarkdownifyTransformer(ignore_links=False)
+    return html2md.transform_documents([Document(page_content=html, metadata={'source': url})])[0].page_content
+
+async def load_page(url: str, fetch_mode: str = config.FETCH_MODE, use_cache: bool = True):
+    """
+    Loads one url and converts it to markdown.
+    Returns {'metadata', 'page_content'} like url_loader's values, or None if the page could not be loaded.
     """
     try:
-        loader = AsyncChromiumLoader(urls, user_agent="AutoScrapperBot")
-        html_documents =  await loader.aload()
-        html_documents = [doc for doc in html_documents if doc.page_content.strip() != '']
-        
-        weblogger.info(f"**URL Loader**=> Loaded {len(html_documents)} documents from {len(urls)} urls.")
-        
-        html2md = MarkdownifyTransformer(ignore_links=False)
-        docs_transformed = html2md.transform_documents(html_documents)
-        domain_evaluator = SourceEvaluator()
-        source_reliability = [domain_evaluator(url) for url in urls]
-        outputs = {}
-        for doc, url, source_reliability in zip(docs_transformed, urls, source_reliability):
-            doc.metadata['source_reliability'] = source_reliability
-            outputs[url]={'metadata':doc.metadata, "page_content":doc.page_content}
-        return outputs
+        page = await _fetch_page(url, fetch_mode, use_cache)
+        if not page['html'] or page['html'].strip() == '':
+            return None
+        if 'markdown' not in page:
+            # Identical bodies (mirrors, syndicated copies) reuse one markdown conversion
+            page['content_hash'] = PageCache.content_hash(page['html'])
+            page['markdown'] = await asyncio.to_thread(page_cache.markdown_for, page['content_hash']) if use_cache else None
+            if page['markdown'] is None:
+                page['markdown'] = await asyncio.to_thread(_html_to_markdown, url, page['html'])
+            page['source_reliability'] = SourceEvaluator()(url)
+            if use_cache:
+                await asyncio.to_thread(page_cache.put, url, page['html'], page['markdown'], page['source_reliability'],
+                                        etag=page.get('etag'), last_modified=page.get('last_modified'))
+        metadata = {'source': url, 'source_reliability': page['source_reliability'], 'fetch_path': page['fetch_path'],
+                    'fetch_seconds': page['fetch_seconds'], 'content_hash': page['content_hash']}
+        return {'metadata': metadata, 'page_content': page['markdown']}
     except Exception as e:
-        print(f"{e}: failed loading url {urls}.")
\ No newline at end of file
+        weblogger.warning(f"**URL Loader**=> {e}: failed loading url {url}.")
+        return None
+
+def _log_loaded(outputs: list, n_urls: int):
+    path_counts = {}
+    for output in outputs:
+        path_counts[output['metadata']['fetch_path']] = path_counts.get(output['metadata']['fetch_path'], 0) + 1
+    weblogger.info(f"**URL Loader**=> Loaded {len(outputs)} documents from {n_urls} urls. Served by: {path_counts}")
+    weblogger.debug(f"**URL Loader**=> Page cache: {page_cache.stats()}")
+
+async def iter_url_loader(urls: list, fetch_mode: str = config.FETCH_MODE, use_cache: bool = True):
+    """
+    Streaming variant of url_loader: yields (url, output) as soon as each page is ready, in completion order.
+    """
+    loaded = []
+    for next_page in asyncio.as_completed([load_page(url, fetch_mode, use_cache) for url in urls]):
+        output = await next_page
+        if output is not None:
+            loaded.append(output)
+            yield output['metadata']['source'], output
+    _log_loaded(loaded, len(urls))
+
+async def url_loader(urls: list, fetch_mode: str = config.FETCH_MODE, use_cache: bool = True): 
+    """
+    loads content from multiple urls.
+    fetch_mode: "auto" tries a plain HTTP fetch first and renders in Chromium only JS-only pages,
+                "http" never starts a browser, "chromium" always renders.
+    Pages are read from and written to the persistent page cache unless use_cache is False.
+    Each output's metadata records the 'fetch_path' that served it, 'fetch_seconds' and the body's 'content_hash'.
+    """
+    outputs = await asyncio.gather(*(load_page(url, fetch_mode, use_cache) for url in urls))
+    outputs = [output for output in outputs if output is not None]
+    _log_loaded(outputs, len(urls))
+    return {output['metadata']['source']: output for output in outputs}